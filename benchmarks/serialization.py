@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization Benchmark
+-----------------------
+
+Compares the time and size of a rendered Crossfilter for a list of records
+(`DataFrame.to_dict(orient='records')`, the historical path) and for a DataFrame
+passed directly, reports the size of the coordinate columns for several
+precision settings, and the size and encoding time of the compressed payloads.
+
+Usage: python benchmarks/serialization.py [n_rows ...]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import branca
+
+import crossfolium
+
+
+def make_frame(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'lat': rng.uniform(-60, 60, n),
+        'lng': rng.uniform(-180, 180, n),
+        'category': rng.choice(['Alpha', 'Beta', 'Gamma'], n),
+        'value': rng.randint(0, 1000, n),
+        'date': pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.randint(0, 365, n), unit='D'),
+        })
+
+
+def render(make_crossfilter):
+    """Returns (seconds, bytes) to build and render a Figure holding the Crossfilter."""
+    start = time.time()
+    figure = branca.element.Figure()
+    make_crossfilter().add_to(figure)
+    html = figure.render()
+    return time.time() - start, len(html.encode('utf-8'))
+
+
+def run(sizes):
+    cases = [
+        ('records', lambda df: crossfolium.Crossfilter(df.to_dict(orient='records'))),
+        ('dataframe', lambda df: crossfolium.Crossfilter(df)),
+        ]
+    print('{:>10} {:>12} {:>10} {:>12}'.format('rows', 'path', 'seconds', 'MB'))
+    for n in sizes:
+        df = make_frame(n)
+        for name, make in cases:
+            seconds, size = render(lambda: make(df))
+            print('{:>10} {:>12} {:>10.2f} {:>12.2f}'.format(n, name, seconds, size / 1e6))
+
+
+def precision_report(n):
+    df = make_frame(n)[['lat', 'lng']]
+    settings = [
+        ('full', {}),
+        ('5 decimals', dict(precision={'lat': 5, 'lng': 5})),
+        ('float32', dict(dtypes={'lat': 'float32', 'lng': 'float32'})),
+        ('int32 1e-5', dict(precision={'lat': 5, 'lng': 5},
+                            dtypes={'lat': 'int32', 'lng': 'int32'})),
+        ]
+    print('\n{:>12} {:>12} {:>12}  ({} rows)'.format('setting', 'lat MB', 'lng MB', n))
+    for name, options in settings:
+        sizes = crossfolium.Crossfilter(df, **options).column_sizes()
+        print('{:>12} {:>12.2f} {:>12.2f}'.format(name, sizes['lat'] / 1e6, sizes['lng'] / 1e6))
+
+
+def compression_report(n):
+    df = make_frame(n)
+    print('\n{:>12} {:>10} {:>12}  ({} rows)'.format('compression', 'seconds', 'MB', n))
+    for compression in (None, 'deflate', 'gzip'):
+        crossfilter = crossfolium.Crossfilter(df, compression=compression)
+        start = time.time()
+        payload, _ = crossfilter._payload()
+        print('{:>12} {:>10.2f} {:>12.2f}'.format(
+            str(compression), time.time() - start, len(payload) / 1e6))
+
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000, 1000000]
+    run(sizes)
+    precision_report(sizes[-1])
+    compression_report(sizes[-1])
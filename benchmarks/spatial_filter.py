@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial Filter Benchmark
+------------------------
+
+Compares the ways a map viewport filters the records, while panning over clustered
+points:
+
+- 'lat/lng': two dimensions on lat and lng, each filtered with filterRange;
+- 'cover': one dimension on the Morton codes, filtered on the ranges of the
+  cover of the bounds (crossfolium.mortonCover) with a filter function;
+- 'span': the same dimension, filtered with crossfolium.filterRanges, that is with
+  filterRange on the span of the cover when it is at most 1 + slack times as long
+  (the MarkerClusterFilter spatial_slack), and with the filter function otherwise.
+  A slack of 0, the default, only uses filterRange when the cover is one range, and
+  is exact; a positive slack lets records off the map pass the filter.
+
+For each, it reports the milliseconds per pan, the share of pans filtered with
+filterRange, and the number of records passing the filter over the number of
+records in the bounds. A chart group on another dimension follows the filters, as
+in a dashboard.
+
+It runs the crossfolium runtime in node, with crossfilter 1.3 from
+`npm install crossfilter@1.3.12` (in the current directory), or from the file
+given by the CROSSFILTER environment variable.
+
+Usage: python benchmarks/spatial_filter.py [n_rows ...]
+"""
+from __future__ import print_function
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from crossfolium import spatial
+from crossfolium.crossfolium import _runtime_path
+
+SCRIPT = u"""
+var crossfilter = require(process.env.CROSSFILTER || 'crossfilter');
+var data = require(process.argv[2]);
+var records = data.lat.map(function (lat, i) {
+    return {lat: lat, lng: data.lng[i], code: data.code[i], category: i % 7};
+    });
+var bounds = function (south, west, north, east) {
+    return {
+        getSouth: function () {return south;}, getNorth: function () {return north;},
+        getWest: function () {return west;}, getEast: function () {return east;}
+        };
+    };
+// A pan across the points, in steps of a tenth of the viewport.
+var pans = [];
+for (var step = 0; step < 60; step++) {
+    var lng = -8 + step * 0.6;
+    pans.push(bounds(42, lng, 48, lng + 6));
+    }
+var run = function (name, filter) {
+    var ndx = crossfilter(records);
+    var chart = ndx.dimension(function (d) {return d.category;}).group();
+    var all = ndx.groupAll();
+    var setup = filter(ndx);
+    var ms = 0, ranged = 0, passed = 0, inside = 0;
+    pans.forEach(function (b) {
+        var start = process.hrtime.bigint();
+        ranged += setup(b) ? 1 : 0;
+        chart.all();
+        ms += Number(process.hrtime.bigint() - start) / 1e6;
+        passed += all.value();
+        inside += records.filter(function (d) {
+            return d.lat >= b.getSouth() && d.lat < b.getNorth() &&
+                d.lng >= b.getWest() && d.lng < b.getEast();
+            }).length;
+        });
+    console.log(JSON.stringify([name, ms / pans.length, ranged / pans.length,
+                                passed / Math.max(inside, 1)]));
+    };
+run('lat/lng', function (ndx) {
+    var lat = ndx.dimension(function (d) {return d.lat;});
+    var lng = ndx.dimension(function (d) {return d.lng;});
+    return function (b) {
+        lat.filterRange([b.getSouth(), b.getNorth()]);
+        lng.filterRange([b.getWest(), b.getEast()]);
+        return true;
+        };
+    });
+run('cover', function (ndx) {
+    var code = ndx.dimension(function (d) {return d.code;});
+    return function (b) {
+        code.filterFunction(crossfolium.inRanges(crossfolium.mortonCover(b, LEVEL, 32)));
+        return false;
+        };
+    });
+SLACKS.forEach(function (slack) {
+    run('span, slack ' + slack, function (ndx) {
+        var code = ndx.dimension(function (d) {return d.code;});
+        return function (b) {
+            var ranges = crossfolium.mortonCover(b, LEVEL, 32);
+            crossfolium.filterRanges(code, ranges, slack);
+            return crossfolium.rangeSpan(ranges, slack) !== null;
+            };
+        });
+    });
+"""
+
+
+def make_points(n, seed=0):
+    """Points clustered around a few cities of western Europe, plus a uniform noise."""
+    rng = np.random.RandomState(seed)
+    centers = np.array([[48.86, 2.35], [45.76, 4.84], [43.30, 5.37], [44.84, -0.58],
+                        [47.22, -1.55], [45.46, 9.19], [41.39, 2.17], [46.20, 6.14]])
+    which = rng.randint(0, len(centers), n)
+    lat = centers[which, 0] + rng.normal(0, 0.5, n)
+    lng = centers[which, 1] + rng.normal(0, 0.7, n)
+    noise = rng.uniform(size=n) < 0.2
+    lat[noise] = rng.uniform(36, 52, noise.sum())
+    lng[noise] = rng.uniform(-10, 30, noise.sum())
+    return lat, lng
+
+
+def run(sizes, slacks=(0, 0.5, 2.)):
+    node = shutil.which('node')
+    if node is None:
+        sys.exit("This benchmark needs node.")
+    with io.open(_runtime_path, encoding='utf-8') as f:
+        runtime = f.read()
+    print('{:>10} {:>16} {:>10} {:>12} {:>16}'.format(
+        'rows', 'filter', 'ms/pan', 'filterRange', 'passed/inside'))
+    directory = tempfile.mkdtemp()
+    try:
+        script = os.path.join(directory, 'benchmark.js')
+        with io.open(script, 'w', encoding='utf-8') as f:
+            f.write(runtime + SCRIPT.replace('LEVEL', str(spatial.DEFAULT_LEVEL))
+                    .replace('SLACKS', json.dumps(list(slacks))))
+        for n in sizes:
+            lat, lng = make_points(n)
+            data = os.path.join(directory, 'data.json')
+            with open(data, 'w') as f:
+                json.dump({'lat': lat.tolist(), 'lng': lng.tolist(),
+                           'code': spatial.morton_codes(lat, lng).tolist()}, f)
+            process = subprocess.Popen([node, script, data], stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, cwd=os.getcwd())
+            out, err = process.communicate()
+            if process.returncode:
+                sys.exit(err.decode('utf-8') + "\nInstall crossfilter 1.3 with "
+                         "`npm install crossfilter@1.3.12`, or set CROSSFILTER to "
+                         "the path of crossfilter.js.")
+            for line in out.decode('utf-8').split('\n'):
+                if line:
+                    name, ms, ranged, passed = json.loads(line)
+                    print('{:>10} {:>16} {:>10.2f} {:>11.0f}% {:>16.2f}'.format(
+                        n, name, ms, 100 * ranged, passed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run([int(n) for n in sys.argv[1:]] or [100000, 1000000])
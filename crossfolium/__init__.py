@@ -22,6 +22,7 @@ from crossfolium.crossfolium import (
 from crossfolium.map import (
     FeatureGroupFilter,
     HeatmapFilter,
+    HexbinFilter,
     MarkerClusterFilter,
     )
 
@@ -39,6 +40,7 @@ __all__ = [
     'CountFilter',
     'ResetFilter',
     'HeatmapFilter',
+    'HexbinFilter',
     'GeoChoroplethFilter',
     'MarkerClusterFilter',
     ]
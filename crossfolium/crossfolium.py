@@ -5,15 +5,202 @@ Crossfolium
 
 """
 from jinja2 import Template
+import base64
+import hashlib
 import json
+import os
+from collections import OrderedDict
 
-from branca.element import Figure, JavascriptLink, CssLink, Div, MacroElement
+from branca.element import Figure, JavascriptLink, CssLink, Div, MacroElement, Element
+
+from crossfolium import encoding
+
+# The javascript shared by the elements, packaged as crossfolium/runtime.js.
+_runtime_path = os.path.join(os.path.dirname(__file__), 'runtime.js')
+with open(_runtime_path, 'rb') as f:
+    _runtime = u'\n<script id="crossfolium-runtime">\n{}</script>\n'.format(
+        f.read().decode('utf-8'))
+
+
+MEASURES = ('count', 'sum', 'mean', 'min', 'max', 'distinct')
+
+
+def _measures(measures):
+    """Check the `measures` of a chart.
+
+    Parameters
+    ----------
+    measures : list of tuple
+        (name, kind, column) tuples, kind being one of MEASURES. A 'count' needs no
+        column.
+
+    Returns
+    -------
+    The list of {'name', 'kind', 'column'} dicts, or None if there are no measures.
+    """
+    if not measures:
+        return None
+    out = []
+    for measure in measures:
+        name, kind, column = (tuple(measure) + (None,))[:3]
+        if kind not in MEASURES:
+            raise ValueError("The kind of measure {!r} must be one of {}, got {!r}".format(
+                name, ', '.join(MEASURES), kind))
+        if kind != 'count' and column is None:
+            raise ValueError("The measure {!r} needs a column.".format(name))
+        out.append({'name': name, 'kind': kind, 'column': column})
+    return out
+
+
+def _measure_columns(measures):
+    """The columns read by the `measures` of a chart."""
+    return [measure['column'] for measure in measures or []]
+
+
+class _Raw(Element):
+    """An Element that renders a fixed text.
+
+    Unlike Element(text), the text is not compiled as a jinja template, which
+    matters for the (large) data payload.
+    """
+    def __init__(self, text):
+        super(_Raw, self).__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+def _walk(element):
+    """Iterates over an element and all its descendants."""
+    yield element
+    for child in element._children.values():
+        for descendant in _walk(child):
+            yield descendant
+
+
+class _CrossfilterDef(MacroElement):
+    """The script that defines the data and the crossfilter of a Crossfilter."""
+    def render(self, **kwargs):
+        figure = self.get_root()
+        assert isinstance(figure, Figure), (
+            "You cannot render this Element if it's not in a Figure.")
+        script = self._template.module.__dict__.get('script')
+        figure.script.add_child(_Raw(script(self, kwargs)), name=self.get_name())
 
 
 class Crossfilter(Div):
-    def __init__(self, data, **kwargs):
+    _count_column = encoding.COUNT_COLUMN
+    _crossfilter_url = "https://cdnjs.cloudflare.com/ajax/libs/crossfilter/1.3.12/crossfilter.min.js"  # noqa
+    # Leaflet 1.x, which the map layers need (for L.canvas). It replaces the Leaflet
+    # that folium loads under the same name.
+    _leaflet_url = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"
+    _leaflet_css_url = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"
+    # crossfilter 1.3 keeps the filters of each record in a 32 bits mask.
+    max_dimensions = 32
+
+    def __init__(self, data, encoding=None, max_categories=256, dtypes=None, precision=None,
+                 columns=None, compression=None, sidecar=None, sidecar_url=None,
+                 sidecar_format='json', collapse=False, redraw_debounce=0, worker=False,
+                 store='records', share_dimensions=False, **kwargs):
         """Create a Crossfilter
 
+        Parameters
+        ----------
+        data : list of dict, pandas.DataFrame or dict of arrays
+            The data set. A DataFrame or a dict of numpy arrays is serialized
+            column by column, without building one python dict per record.
+        encoding : str, default None
+            How the data is written in the page.
+            'records' writes the list of records as is.
+            'columnar' writes one array per column and a row count, and rebuilds
+            the records in the browser. The column names are written only once.
+            If None, 'records' is used for a list of records and 'columnar' otherwise.
+        max_categories : int, default 256
+            With the columnar encoding, string columns with at most `max_categories`
+            distinct values (and pandas category columns) are written as a lookup
+            table plus integer codes, and the charts build their dimensions on the
+            codes. Set to 0 to disable.
+        dtypes : dict, default None
+            With the columnar encoding, the columns to write as base64 typed arrays,
+            with their dtype: {'lat': 'float32', 'count': 'uint16'}. Supported dtypes
+            are 'int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'float32' and
+            'float64'. The browser reads them through Float32Array & co without
+            parsing each number. For a dictionary-encoded column, the dtype applies
+            to the codes. The columns precomputed by the elements, such as the bins of
+            a BarFilter (see `column_sizes`), can be given a dtype too.
+        precision : dict, default None
+            With the columnar encoding, the number of decimals to keep in some
+            numeric columns: {'lat': 5, 'lng': 5} is about 1 meter. If the column
+            also has an integer dtype, it is written in fixed point: {'lat': 5} with
+            dtypes={'lat': 'int32'} stores round(lat * 1e5) and the browser divides
+            it back. See `column_sizes` to measure the savings.
+        columns : list of str or 'auto', default None
+            With the columnar encoding, the columns to write in the page.
+            If 'auto', only the columns read by the filters and map layers bound to
+            this Crossfilter are written (they are collected when rendering).
+            If None, all the columns are written.
+        compression : str, default None
+            With the columnar encoding, compress the payload with 'gzip' or
+            'deflate' and embed it in base64. The browser decompresses it with
+            DecompressionStream, then builds the crossfilter and renders the charts.
+        sidecar : str, default None
+            With the columnar encoding, write the payload in a file of this directory
+            instead of inlining it in the page. The file is named after the hash of
+            its content, so that pages built on the same data share it (and the
+            browser cache). The page fetches it asynchronously.
+        sidecar_url : str, default None
+            The URL of the `sidecar` directory, relative to the page.
+            If None, `sidecar` itself is used.
+        sidecar_format : str, default 'json'
+            'json' writes the JSON payload. 'binary' writes a JSON header followed
+            by all the numeric columns and codes as raw little-endian typed arrays
+            (see `encoding.binary_payload`).
+        collapse : bool, default False
+            With the columnar encoding, group the records that are identical on all
+            the written columns (see `columns`) into one record, with a count column.
+            The filters weight the records by this count, so that the totals are
+            unchanged, while crossfilter works on much fewer records.
+        redraw_debounce : int, default 0
+            The redraws of the charts and map layers are coalesced: the filter
+            changes made while a redraw is pending (brushing a BarFilter, moving the
+            map...) are all drawn in one pass. If 0, the redraw happens on the next
+            animation frame. If positive, it happens `redraw_debounce` milliseconds
+            after the last change. If None, every change is redrawn at once.
+        worker : bool, default False
+            With the columnar encoding, host the data and the crossfilter in a Web
+            Worker, so that filtering does not block the page. The charts and map
+            layers use a proxy of it: the filters are sent to the worker, which sends
+            back the group results and the filtered row ids as typed arrays, and the
+            redraws wait for them. The map layers only build the records they show.
+            Dimensions must be on columns, and filtered with values or ranges, so
+            that TableFilter, HexbinFilter, MarkerClusterFilter(clustering='grid')
+            and HeatmapFilter(aggregate=True) are not supported.
+        store : str, default 'records'
+            How the browser holds the data, with the columnar encoding.
+            'records' builds one javascript object per record.
+            'columns' keeps the columns (typed arrays for the numeric ones, of their
+            `dtypes` or else Float64Array, missing values being NaN; codes for the
+            dictionary-encoded ones), and the records are the row ids:
+            all the accessors of the charts, tables and map layers read
+            `column[i]`, and dimensions on dictionary-encoded columns read their
+            codes as they are. This takes much less memory per record, and builds
+            the dimensions faster.
+        share_dimensions : bool, default False
+            If False, each filter and map layer has its own crossfilter dimensions,
+            so that they all filter each other: selecting a slice of a PieFilter
+            filters a RowBarFilter on the same column.
+            If True, the elements on the same column share one crossfilter
+            dimension (and one group if they weigh the records the same), in which
+            each keeps its own filter: a record passes if it passes all of them, but
+            as crossfilter groups ignore the filters of their own dimension, these
+            elements no longer filter each other's charts. This saves the memory
+            and the time of building one dimension per element, and lets more
+            elements fit in `max_dimensions`. It has no effect with a worker.
+
+        Rendering raises a ValueError if the elements need more than
+        `max_dimensions` dimensions.
+
         Returns
         -------
         Folium Crossfilter Object
@@ -22,16 +209,128 @@ class Crossfilter(Div):
         super(Crossfilter, self).__init__(**kwargs)
         self._name = 'Crossfilter'
 
+        if encoding is None:
+            encoding = 'records' if isinstance(data, (list, tuple)) else 'columnar'
+        if encoding not in ('records', 'columnar'):
+            raise ValueError("encoding must be 'records' or 'columnar', "
+                             "got {!r}".format(encoding))
+
+        for name, option in (('dtypes', dtypes), ('precision', precision), ('columns', columns),
+                             ('compression', compression), ('sidecar', sidecar),
+                             ('collapse', collapse), ('worker', worker),
+                             ("store='columns'", store == 'columns')):
+            if option and encoding != 'columnar':
+                raise ValueError("{} can only be used with encoding='columnar'.".format(name))
+        if compression not in (None, 'gzip', 'deflate'):
+            raise ValueError("compression must be None, 'gzip' or 'deflate', "
+                             "got {!r}".format(compression))
+        if sidecar_format not in ('json', 'binary'):
+            raise ValueError("sidecar_format must be 'json' or 'binary', "
+                             "got {!r}".format(sidecar_format))
+        if store not in ('records', 'columns'):
+            raise ValueError("store must be 'records' or 'columns', got {!r}".format(store))
+        if redraw_debounce is not None and redraw_debounce < 0:
+            raise ValueError("redraw_debounce must be None or >= 0, "
+                             "got {!r}".format(redraw_debounce))
+
         self.data = data
+        self.encoding = encoding
+        self.redraw_debounce = redraw_debounce
+        self.worker = worker
+        self.store = store
+        self.share_dimensions = share_dimensions
+        self.max_categories = max_categories
+        self.dtypes = dtypes or {}
+        self.precision = precision or {}
+        self.columns = columns
+        self.compression = compression
+        self.sidecar = sidecar
+        self.sidecar_url = sidecar_url
+        self.sidecar_format = sidecar_format
+        self.collapse = collapse
 
-        crossfilter_def = MacroElement()
+        crossfilter_def = _CrossfilterDef()
         crossfilter_def._template = Template(("""
             {% macro script(this, kwargs) %}
-                var {{this._parent.get_name()}} = {};
-                {{this._parent.get_name()}}.data = {{this._parent.data}};
+                var {{this._parent.get_name()}} = {group: "{{this._parent.get_name()}}"};
+                {{this._parent.get_name()}}.registry = {dimensions: {}, groups: {}, shared: {{this._parent.share_dimensions|tojson}}};
+                {{this._parent.get_name()}}.store = "{{this._parent.store}}";
+                {% if this._parent.encoding == 'records' %}
+                {{this._parent.get_name()}}.count = null;
+                {{this._parent.get_name()}}.categories = {};
+                {{this._parent.get_name()}}.data = {{this._parent._records()}};
                 {{this._parent.get_name()}}.crossfilter = crossfilter({{this._parent.get_name()}}.data);
+                {% else %}
+                {% set payload, categories = this._parent._payload() %}
+                {{this._parent.get_name()}}.categories = {{categories}};
+                {{this._parent.get_name()}}.count = {% if this._parent.collapse %}"{{this._parent._count_column}}"{% else %}null{% endif %};
+                {{this._parent.get_name()}}.load = function (payload) {
+                    {{this._parent.get_name()}}.payload = payload;
+                    {{this._parent.get_name()}}.columns = payload.columns;
+                    {% if this._parent.store == 'columns' %}
+                    {{this._parent.get_name()}}.col = crossfolium.columnStore(payload);
+                    {% endif %}
+                    {% if this._parent.worker %}
+                    {% if this._parent.store == 'columns' %}
+                    {{this._parent.get_name()}}.row = function (i) {return i;};
+                    {% else %}
+                    {{this._parent.get_name()}}.row = crossfolium.rows(payload);
+                    {% endif %}
+                    {{this._parent.get_name()}}.engine.init(payload);
+                    {% elif this._parent.store == 'columns' %}
+                    {{this._parent.get_name()}}.data = crossfolium.rowIds(payload.length);
+                    {% else %}
+                    {{this._parent.get_name()}}.data = crossfolium.records(payload);
+                    {% endif %}
+                    {% if this._parent.collapse %}
+                    var counts = crossfolium.values(payload.columns["{{this._parent._count_column}}"]);
+                    {{this._parent.get_name()}}.total = 0;
+                    for (var i = 0; i < counts.length; i++) {
+                        {{this._parent.get_name()}}.total += counts[i];
+                        }
+                    {% endif %}
+                    };
+                {% if this._parent.worker %}
+                {{this._parent.get_name()}}.engine = new crossfolium.Engine({{this._parent.get_name()}},
+                    "{{this._parent._crossfilter_url}}");
+                {{this._parent.get_name()}}.crossfilter = {{this._parent.get_name()}}.engine.crossfilter();
+                {% endif %}
+                {% if this._parent._is_async() %}
+                {% if not this._parent.worker %}
+                {{this._parent.get_name()}}.data = [];
+                {{this._parent.get_name()}}.crossfilter = crossfilter({{this._parent.get_name()}}.data);
+                {% endif %}
+                {% if this._parent.sidecar %}
+                {{this._parent.get_name()}}.ready = crossfolium.fetch(
+                    "{{payload}}", "{{this._parent.sidecar_format}}",
+                    {% if this._parent.compression %}"{{this._parent.compression}}"{% else %}null{% endif %}
+                    )
+                {% else %}
+                {{this._parent.get_name()}}.ready = crossfolium.inflate(
+                    "{{payload}}", "{{this._parent.compression}}"
+                    )
+                {% endif %}
+                    .then(function (payload) {
+                        {{this._parent.get_name()}}.load(payload);
+                        {% if not this._parent.worker %}
+                        {{this._parent.get_name()}}.crossfilter.add({{this._parent.get_name()}}.data);
+                        {% endif %}
+                        });
+                {% else %}
+                {{this._parent.get_name()}}.load({{payload}});
+                {% if this._parent.worker %}
+                {{this._parent.get_name()}}.ready = Promise.resolve();
+                {% else %}
+                {{this._parent.get_name()}}.crossfilter = crossfilter({{this._parent.get_name()}}.data);
+                {% endif %}
+                {% endif %}
+                {% endif %}
                 {{this._parent.get_name()}}.allDim = {{this._parent.get_name()}}.crossfilter.dimension(
                     function(d) {return d;});
+                crossfolium.bus({{this._parent.get_name()}});
+                {% if this._parent.redraw_debounce is not none or this._parent.worker %}
+                crossfolium.schedule({{this._parent.get_name()}}.group, {{this._parent.redraw_debounce or 0}});
+                {% endif %}
             {% endmacro %}
             """))  # noqa
         self.add_child(crossfilter_def)
@@ -52,23 +351,211 @@ class Crossfilter(Div):
                 </div>
             {% endmacro %}
             {% macro script(this, kwargs) %}
-               dc.renderAll();
+               {% if this.worker %}
+               crossfolium.proxyFilters({{this.get_name()}}.group);
+               {{this.get_name()}}.ready.then(function () {
+                   return {{this.get_name()}}.engine.flush();
+                   }).then(function () {
+                       dc.renderAll({{this.get_name()}}.group);
+                       });
+               {% elif this._is_async() %}
+               {{this.get_name()}}.ready.then(function () {
+                   dc.renderAll({{this.get_name()}}.group);
+                   });
+               {% else %}
+               dc.renderAll({{this.get_name()}}.group);
+               {% endif %}
             {% endmacro %}
         """)
 
+    def _records(self):
+        """The javascript payload of the data, in records encoding."""
+        return encoding.records_payload(self.data)
+
+    def _field(self, column, record='d'):
+        """The javascript expression of the value of `column` in the record (or row id
+        with store='columns') named `record`."""
+        if self.store == 'columns':
+            return '{}.col[{}][{}]'.format(self.get_name(), json.dumps(column), record)
+        return '{}[{}]'.format(record, json.dumps(column))
+
+    def _elements(self):
+        """The elements of the figure that are bound to this Crossfilter."""
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        return [element for element in _walk(root)
+                if getattr(element, 'crossfilter', None) is self]
+
+    def _referenced_columns(self):
+        """The columns read by the elements bound to this Crossfilter."""
+        out = []
+        for element in self._elements():
+            if hasattr(element, '_referenced_columns'):
+                out += [name for name in element._referenced_columns() if name is not None]
+        return out
+
+    def _dimensions(self):
+        """The crossfilter dimensions built in the browser.
+
+        The elements list the names of their dimensions in the registry (None for
+        a dimension of their own); with `share_dimensions`, the elements on the
+        same name share one dimension, except with a worker engine. `allDim` comes
+        on top of them.
+
+        Returns
+        -------
+        A list of (name, elements) for each dimension.
+        """
+        out = OrderedDict([(('allDim', 0), [self])])
+        for element in self._elements():
+            for name in getattr(element, '_dimensions', lambda: [])():
+                if name is None or self.worker or not self.share_dimensions:
+                    out[(element.get_name(), len(out))] = [element]
+                else:
+                    out.setdefault(name, []).append(element)
+        return list(out.items())
+
+    def _check_dimensions(self):
+        dimensions = self._dimensions()
+        if len(dimensions) > self.max_dimensions:
+            if self.share_dimensions and not self.worker:
+                advice = ("The elements on the same column share a dimension: remove "
+                          "elements or bind them to the same columns.")
+            else:
+                advice = ("Remove elements, or use share_dimensions=True to have the "
+                          "elements on the same column share a dimension.")
+            raise ValueError(
+                "{} needs {} crossfilter dimensions, but crossfilter supports at most {}. "
+                "{} Dimensions: {}".format(
+                    self.get_name(), len(dimensions), self.max_dimensions, advice,
+                    ', '.join(name if isinstance(name, str) else name[0]
+                              for name, _ in dimensions)))
+
+    def _columns(self):
+        """Split the data into the columns to be written.
+
+        Returns
+        -------
+        (columns, length, options), where options are the keyword arguments of
+        `encoding.encode_columns` restricted to the kept columns.
+        """
+        names = encoding.column_names(self.data)
+        kept = names
+        if self.columns == 'auto':
+            referenced = set(self._referenced_columns())
+            kept = [name for name in names if name in referenced]
+        elif self.columns is not None:
+            unknown = set(self.columns) - set(names)
+            if unknown:
+                raise ValueError("Unknown columns: {}".format(sorted(unknown)))
+            kept = [name for name in names if name in self.columns]
+        # Elements may precompute columns (such as histogram bins) from any column:
+        # only the kept columns and the columns they read are materialized.
+        derivers = [element for element in self._elements()
+                    if hasattr(element, '_derived_columns')]
+        wanted = set(kept).union(*[element._source_columns() for element in derivers])
+        columns, length = encoding.to_columns(
+            self.data, [name for name in names if name in wanted])
+        derived = OrderedDict()
+        for element in derivers:
+            derived.update(element._derived_columns(columns))
+        if derivers:
+            columns = OrderedDict((name, columns[name]) for name in kept)
+            columns.update(derived)
+        # The options may name data columns and precomputed ones.
+        for option in ('dtypes', 'precision'):
+            unknown = set(getattr(self, option)) - set(names) - set(derived)
+            if unknown:
+                raise ValueError("Unknown columns in {}: {}".format(option, sorted(unknown)))
+        if self.collapse:
+            columns, length = encoding.collapse(columns, length)
+        options = dict(
+            max_categories=self.max_categories,
+            dtypes=dict((k, v) for k, v in self.dtypes.items() if k in columns),
+            precision=dict((k, v) for k, v in self.precision.items() if k in columns),
+            )
+        return columns, length, options
+
+    def _is_async(self):
+        """Whether the data is loaded asynchronously in the browser."""
+        return bool(self.compression or self.sidecar)
+
+    def _payload(self):
+        """The javascript payload of the data, in columnar encoding.
+
+        Returns
+        -------
+        (payload, categories): the JSON payload (compressed and base64-encoded if
+        `compression` is set, or the URL of the sidecar file if `sidecar` is set),
+        and the JSON lookup tables of its dictionary-encoded columns.
+        """
+        columns, length, options = self._columns()
+        binary = bool(self.sidecar) and self.sidecar_format == 'binary'
+        encoded = encoding.encode_columns(columns, length, binary=binary, **options)
+        categories = encoding.to_json(encoding.categories(encoded))
+        if binary:
+            payload = encoding.binary_payload(encoded, length)
+        else:
+            payload = encoding.columnar_payload(encoded, length)
+        if self.compression:
+            payload = encoding.compress(payload, self.compression)
+        if self.sidecar:
+            return self._write_sidecar(payload), categories
+        if self.compression:
+            payload = base64.b64encode(payload).decode('ascii')
+        return payload, categories
+
+    def _write_sidecar(self, payload):
+        """Writes the payload in the sidecar directory (unless it's already there).
+
+        Returns
+        -------
+        The URL of the file.
+        """
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        filename = 'crossfolium-{}.{}'.format(
+            hashlib.sha1(payload).hexdigest()[:20],
+            'bin' if self.sidecar_format == 'binary' else 'json')
+        if self.compression:
+            filename += '.' + self.compression
+        if not os.path.isdir(self.sidecar):
+            os.makedirs(self.sidecar)
+        path = os.path.join(self.sidecar, filename)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(payload)
+        url = self.sidecar_url if self.sidecar_url is not None else self.sidecar
+        url = url.replace(os.sep, '/').rstrip('/')
+        return url + '/' + filename if url else filename
+
+    def column_sizes(self):
+        """The number of bytes each column takes in the columnar payload.
+
+        Use it to set the `precision` and `dtypes` budget of a dashboard.
+
+        Returns
+        -------
+        An OrderedDict {column: bytes}.
+        """
+        columns, length, options = self._columns()
+        return encoding.column_sizes(columns, length, **options)
+
     def render(self, **kwargs):
+        self._check_dimensions()
         super(Crossfilter, self).render(**kwargs)
 
         figure = self._parent.get_root()
         assert isinstance(figure, Figure), (
             "You cannot render this Element if it's not in a Figure.")
 
+        figure.header.add_child(_Raw(_runtime), name='crossfoliumjs')
+
         figure.header.add_child(
             CssLink("https://cdnjs.cloudflare.com/ajax/libs/dc/1.7.5/dc.css"),
             name='dcjs_css')
-        figure.header.add_child(
-            CssLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.3/leaflet.css"),
-            name='leaflet_css')
+        figure.header.add_child(CssLink(self._leaflet_css_url), name='leaflet_css')
         figure.header.add_child(
             CssLink("https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap.min.css"),
             name='bootstrap_css')
@@ -76,15 +563,11 @@ class Crossfilter(Div):
         figure.header.add_child(
             JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/d3/3.5.6/d3.min.js"),
             name='d3js')
-        figure.header.add_child(
-            JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/crossfilter/1.3.12/crossfilter.min.js"),  # noqa
-            name='crossfilterjs')
+        figure.header.add_child(JavascriptLink(self._crossfilter_url), name='crossfilterjs')
         figure.header.add_child(
             JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/dc/2.0.0-beta.20/dc.js"),
             name='dcjs')
-        figure.header.add_child(
-            JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.3/leaflet.js"),
-            name='leaflet')
+        figure.header.add_child(JavascriptLink(self._leaflet_url), name='leaflet')
         figure.header.add_child(
             JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/underscore.js/1.8.3/underscore-min.js"),  # noqa
             name='underscorejs')
@@ -92,10 +575,18 @@ class Crossfilter(Div):
 
 class PieFilter(Div):
     def __init__(self, crossfilter, column, name="", width=150, height=150, inner_radius=20,
-                 weight=None, order=None, colors=None, label=None, **kwargs):
+                 weight=None, order=None, colors=None, label=None, measures=None, **kwargs):
         """TODO docstring here
         Parameters
         ----------
+        measures : list of tuple, default None
+            Several measures computed in one pass by the group of the chart, as
+            (name, kind, column) tuples, kind being 'count', 'sum', 'mean', 'min',
+            'max' or 'distinct' (the number of distinct values of the column):
+            [('rows', 'count'), ('price', 'mean', 'price'), ('top', 'max', 'price')].
+            The chart draws the first one, and its titles show them all. They are
+            updated incrementally when records enter or leave the filters. It
+            replaces `weight`.
         """
         super(PieFilter, self).__init__(width=width, height=height, **kwargs)
         self._name = 'PieFilter'
@@ -108,6 +599,9 @@ class PieFilter(Div):
         self.inner_radius = inner_radius
         self.order = order
         self.weight = weight
+        self.measures = _measures(measures)
+        if weight and self.measures:
+            raise ValueError("weight and measures cannot be used together.")
         self.colors = [x for x in colors] if colors else None
         self.label = label
 
@@ -128,45 +622,60 @@ class PieFilter(Div):
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
 
-            {{this.get_name()}}.dimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                function(d) {return d["{{this.column}}"];});
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}}, "{{this.column}}");
+            {{this.get_name()}}.decode = crossfolium.label({{this.crossfilter.get_name()}}, "{{this.column}}");
             document.getElementById("{{this.get_name()}}").innerHTML =
                 '<h4>{{this.name}} <small><a id="{{this.get_name()}}-reset">reset</a></small></h4>'
                 + '<div id="{{this.get_name()}}-chart" class="dc-chart"></div>';
 
-            {{this.get_name()}}.chart = dc.pieChart('#{{this.get_name()}}-chart')
+            {{this.get_name()}}.chart = dc.pieChart('#{{this.get_name()}}-chart', {{this.crossfilter.get_name()}}.group)
                 .width({{this.width}})
                 .height({{this.height}})
                 .dimension({{this.get_name()}}.dimension)
-                .group({{this.get_name()}}.dimension.group()
-                    {% if this.weight %}.reduceSum(function(d) {return d["{{this.weight}}"];})
-                    {% else %}.reduceCount(){% endif %}
-                    )
+                .group(crossfolium.group({{this.crossfilter.get_name()}}, {{this.get_name()}}.dimension,
+                    {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %}
+                    {%- if this.measures %}, {{this.measures|tojson}}{% endif %}))
+                {% if this.measures %}.valueAccessor(function (d) {
+                    return d.value[{{this.measures[0].name|tojson}}];
+                    }){% endif %}
                 .innerRadius({{this.inner_radius}})
-                {% if this.label %}.label({{this.label}}){% endif %}
+                {% if this.label %}.label(function (d) {
+                    return ({{this.label}})({key: {{this.get_name()}}.decode(d.key), value: d.value});
+                    })
+                {% else %}.label(function (d) {return {{this.get_name()}}.decode(d.key);}){% endif %}
+                .title(function (d) {return crossfolium.title({{this.get_name()}}.decode(d.key), d.value);})
                 {% if this.colors %}.ordinalColors({{this.colors}}){% endif %}
                 {% if this.order %}.ordering(function (d) {
                     var out = null;
                     var order={{this.order}};
                     for (var j=0;j<order.length;j++) {
-                        if (order[j]==d.key) {out = 1+j;}
+                        if (order[j]=={{this.get_name()}}.decode(d.key)) {out = 1+j;}
                         }
                     return out;}){% endif %};
             d3.selectAll('#{{this.get_name()}}-reset').on('click',function () {
                 {{this.get_name()}}.chart.filterAll();
-                dc.redrawAll();
+                dc.redrawAll({{this.crossfilter.get_name()}}.group);
                 });
         {% endmacro %}
         """)  # noqa
 
+    def _referenced_columns(self):
+        return [self.column, self.weight] + _measure_columns(self.measures)
+
+    def _dimensions(self):
+        return [self.column]
+
 
 class RowBarFilter(Div):
     """TODO docstring here
     Parameters
     ----------
+    measures : list of tuple, default None
+        (name, kind, column) measures computed by the group of the chart, which
+        draws the first one (see PieFilter).
     """
     def __init__(self, crossfilter, column, name="", width=150, height=150, inner_radius=20,
-                 weight=None, order=None, elastic_x=True, colors=None, **kwargs):
+                 weight=None, order=None, elastic_x=True, colors=None, measures=None, **kwargs):
         super(RowBarFilter, self).__init__(width=width, height=height, **kwargs)
         self._name = 'RowBarFilter'
 
@@ -178,6 +687,9 @@ class RowBarFilter(Div):
         self.inner_radius = inner_radius
         self.order = order
         self.weight = weight
+        self.measures = _measures(measures)
+        if weight and self.measures:
+            raise ValueError("weight and measures cannot be used together.")
         self.elastic_x = elastic_x
         self.colors = [x for x in colors] if colors else None
 
@@ -198,44 +710,76 @@ class RowBarFilter(Div):
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
 
-            {{this.get_name()}}.dimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                function(d) {return d["{{this.column}}"];});
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}}, "{{this.column}}");
+            {{this.get_name()}}.decode = crossfolium.label({{this.crossfilter.get_name()}}, "{{this.column}}");
             document.getElementById("{{this.get_name()}}").innerHTML =
                 '<h4>{{this.name}} <small><a id="{{this.get_name()}}-reset">reset</a></small></h4>'
                 + '<div id="{{this.get_name()}}-chart" class="dc-chart"></div>';
 
-            {{this.get_name()}}.chart = dc.rowChart('#{{this.get_name()}}-chart')
+            {{this.get_name()}}.chart = dc.rowChart('#{{this.get_name()}}-chart', {{this.crossfilter.get_name()}}.group)
                 .width({{this.width}})
                 .height({{this.height}})
                 .dimension({{this.get_name()}}.dimension)
-                .group({{this.get_name()}}.dimension.group()
-                    {% if this.weight %}.reduceSum(function(d) {return d["{{this.weight}}"];})
-                    {% else %}.reduceCount(){% endif %}
-                    )
+                .group(crossfolium.group({{this.crossfilter.get_name()}}, {{this.get_name()}}.dimension,
+                    {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %}
+                    {%- if this.measures %}, {{this.measures|tojson}}{% endif %}))
+                {% if this.measures %}.valueAccessor(function (d) {
+                    return d.value[{{this.measures[0].name|tojson}}];
+                    }){% endif %}
                 .elasticX({{this.elastic_x.__str__().lower()}})
+                .label(function (d) {return {{this.get_name()}}.decode(d.key);})
+                .title(function (d) {return crossfolium.title({{this.get_name()}}.decode(d.key), d.value);})
                 {% if this.colors %}.ordinalColors({{this.colors}}){% endif %}
                 {% if this.order %}.ordering(function (d) {
                     var out = null;
                     var order={{this.order}};
                     for (var j=0;j<order.length;j++) {
-                        if (order[j]==d.key) {out = 1+j;}
+                        if (order[j]=={{this.get_name()}}.decode(d.key)) {out = 1+j;}
                         }
                     return out;}){% endif %};
             d3.selectAll('#{{this.get_name()}}-reset').on('click',function () {
                 {{this.get_name()}}.chart.filterAll();
-                dc.redrawAll();
+                dc.redrawAll({{this.crossfilter.get_name()}}.group);
                 });
         {% endmacro %}
         """)  # noqa
 
+    def _referenced_columns(self):
+        return [self.column, self.weight] + _measure_columns(self.measures)
+
+    def _dimensions(self):
+        return [self.column]
+
 
 class BarFilter(Div):
     def __init__(self, crossfilter, column, width=150, height=150, bar_padding=0.1,
                  domain=None, groupby=None, xlabel="", ylabel="", margins=None,
-                 weight=None, elastic_y=True, xticks=None, time_format=None, **kwargs):
-        """TODO docstring here
+                 weight=None, elastic_y=True, xticks=None, time_format=None, measures=None,
+                 **kwargs):
+        """A histogram of a numeric (or datetime) column.
+
         Parameters
         ----------
+        crossfilter : Crossfilter
+            The crossfilter holding the data.
+        column : str
+            The column to bin.
+        domain : [float, float], default None
+            The range of the histogram. If None, it runs from the minimum to the
+            maximum of the column.
+        groupby : float, default None
+            The width of the bins. If None, it is chosen from the interquartile range
+            of the column (see `encoding.auto_bins`).
+        weight : str, default None
+            A column whose sum is displayed instead of the count of records.
+        measures : list of tuple, default None
+            (name, kind, column) measures computed by the group of the chart, which
+            draws the first one (see PieFilter).
+        xticks : list of float, default None
+            The tick values of the x axis. If None, d3 chooses them.
+
+        With a columnar Crossfilter, the bin of each record is computed in python and
+        written as an integer column, so that the browser reads it as it is.
         """
         super(BarFilter, self).__init__(**kwargs)
         self._name = 'BarFilter'
@@ -245,7 +789,7 @@ class BarFilter(Div):
         self.width = width
         self.height = height
         self.bar_padding = bar_padding
-        self.domain = json.dumps(domain)
+        self.domain = domain
         self.groupby = groupby
         self.xlabel = xlabel
         self.ylabel = ylabel
@@ -253,7 +797,11 @@ class BarFilter(Div):
         self.xticks = json.dumps(xticks)
         self.time_format = time_format
         self.weight = weight
+        self.measures = _measures(measures)
+        if weight and self.measures:
+            raise ValueError("weight and measures cannot be used together.")
         self.elastic_y = elastic_y
+        self._auto_bins = None
 
         self._template = Template(u"""
         {% macro header(this, kwargs) %}
@@ -270,34 +818,48 @@ class BarFilter(Div):
             <div id="{{this.get_name()}}" class="{{this.class_}}">{{this.html.render(**kwargs)}}</div>
         {% endmacro %}
         {% macro script(this, kwargs) %}
+            {% set domain, groupby = this._bins() %}
             var {{this.get_name()}} = {
-                domain : {{this.domain}},
-                groupby : {{this.groupby}},
+                domain : {{domain}},
+                groupby : {{groupby}},
                 xAxisTickValues : {{this.xticks}},
                 };
-            {{this.get_name()}}.dimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                function(d) {
+            {% if this._precomputed() %}
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                "{{this._bin_column()}}");
+            {% else %}
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                "{{this._bin_column()}}", function(d) {
                     return Math.floor(
                         (d["{{this.column}}"]-{{this.get_name()}}.domain[0])/{{this.get_name()}}.groupby)
                         +{{this.get_name()}}.domain[0]/{{this.get_name()}}.groupby;
                     });
-            {{this.get_name()}}.ticks = [];
-            for (var j=0; j<{{this.get_name()}}.xAxisTickValues.length; j++) {
-                {{this.get_name()}}.ticks[j] = {{this.get_name()}}.xAxisTickValues[j]/{{this.get_name()}}.groupby;
+            {% endif %}
+            {{this.get_name()}}.ticks = null;
+            if ({{this.get_name()}}.xAxisTickValues) {
+                {{this.get_name()}}.ticks = [];
+                for (var j=0; j<{{this.get_name()}}.xAxisTickValues.length; j++) {
+                    {{this.get_name()}}.ticks[j] = {{this.get_name()}}.xAxisTickValues[j]/{{this.get_name()}}.groupby;
+                    }
                 }
 
-            dc.barChart("#{{this.get_name()}}")
+            dc.barChart("#{{this.get_name()}}", {{this.crossfilter.get_name()}}.group)
                 .width({{this.width}})
                 .height({{this.height}})
                 .dimension({{this.get_name()}}.dimension)
-                .group({{this.get_name()}}.dimension.group()
-                    {% if this.weight %}.reduceSum(function(d) {return d["{{this.weight}}"];})
-                    {% else %}.reduceCount(){% endif %}
-                    )
+                .group(crossfolium.group({{this.crossfilter.get_name()}}, {{this.get_name()}}.dimension,
+                    {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %}
+                    {%- if this.measures %}, {{this.measures|tojson}}{% endif %}))
+                {% if this.measures %}.valueAccessor(function (d) {
+                    return d.value[{{this.measures[0].name|tojson}}];
+                    }){% endif %}
                 .x(d3.scale.linear().domain([
                     {{this.get_name()}}.domain[0]/{{this.get_name()}}.groupby,
                     {{this.get_name()}}.domain[1]/{{this.get_name()}}.groupby,
                     ]))
+                {% if this.measures %}.title(function (d) {
+                    return crossfolium.title(d.key * {{this.get_name()}}.groupby, d.value);
+                    }){% endif %}
                 .elasticY({{this.elastic_y.__str__().lower()}})
                 .centerBar(false)
                 .barPadding({{this.bar_padding}})
@@ -317,21 +879,75 @@ class BarFilter(Div):
         {% endmacro %}
         """)  # noqa
 
+    def _bins(self):
+        """The (domain, groupby) of the histogram, chosen from the data if not given."""
+        if self._auto_bins is None:
+            values = []
+            if self.domain is None or self.groupby is None:
+                values = encoding.to_columns(self.crossfilter.data, [self.column])[0][self.column]
+            self._auto_bins = encoding.auto_bins(values, self.domain, self.groupby)
+        return self._auto_bins
+
+    def _precomputed(self):
+        """Whether the bins are written in the payload by the Crossfilter."""
+        return self.crossfilter.encoding == 'columnar'
+
+    def _bin_column(self):
+        domain, groupby = self._bins()
+        return '{}:bin:{!r}:{!r}'.format(self.column, domain[0], groupby)
+
+    def _source_columns(self):
+        return [self.column]
+
+    def _derived_columns(self, columns):
+        domain, groupby = self._bins()
+        return {self._bin_column(): encoding.bin_index(columns[self.column], domain, groupby)}
+
+    def _dimensions(self):
+        return [self._bin_column()]
+
+    def _referenced_columns(self):
+        if self._precomputed():
+            return [self._bin_column(), self.weight] + _measure_columns(self.measures)
+        return [self.column, self.weight] + _measure_columns(self.measures)
+
 
 class TableFilter(Div):
-    def __init__(self, crossfilter, columns, size=10, sort_by=None, ascending=True, **kwargs):
+    def __init__(self, crossfilter, columns, size=10, sort_by=None, ascending=True,
+                 page_size=None, visible_rows=None, row_height=24, **kwargs):
         """TODO docstring here
         Parameters
         ----------
+        size : int, default 10
+            The maximum number of records shown.
+        sort_by : str, default None
+            The column the records are sorted on. The table reads its first records
+            from a dimension on this column (shared with the charts on it if the
+            Crossfilter has `share_dimensions`), and does not go through the others.
+            If None, the records are not sorted.
+        page_size : int, default None
+            The number of records per page, with buttons to move between pages. If
+            None, all the `size` records are on one page.
+        visible_rows : int, default None
+            If given, the table is `visible_rows` rows high and scrolls, only the
+            rows in view being in the DOM: this keeps large pages fast.
+        row_height : int, default 24
+            The height of the rows in pixels, with `visible_rows`.
         """
         super(TableFilter, self).__init__(**kwargs)
         self._name = 'TableFilter'
 
+        if crossfilter.worker:
+            raise ValueError("TableFilter does not support a Crossfilter with worker=True.")
+
         self.crossfilter = crossfilter
         self.columns = columns
         self.sort_by = sort_by
         self.ascending = ascending
         self.size = size
+        self.page_size = page_size
+        self.visible_rows = visible_rows
+        self.row_height = row_height
 
         self._template = Template(u"""
         {% macro header(this, kwargs) %}
@@ -342,37 +958,66 @@ class TableFilter(Div):
                 {% if this.left %}left: {{this.left[0]}}{{this.left[1]}};{% endif %}
                 {% if this.top %}top: {{this.top[0]}}{{this.top[1]}};{% endif %}
                 }
+                {% if this.visible_rows %}
+                #{{this.get_name()}} .crossfolium-table-body {
+                    height: {{(this.visible_rows + 1) * this.row_height}}px;
+                    overflow-y: auto;
+                    }
+                #{{this.get_name()}} tr {height: {{this.row_height}}px;}
+                #{{this.get_name()}} td {white-space: nowrap;}
+                #{{this.get_name()}} tr.spacer td {padding: 0; border: none;}
+                #{{this.get_name()}} thead th {position: sticky; top: 0; background: white;}
+                {% endif %}
             </style>
         {% endmacro %}
         {% macro html(this, kwargs) %}
-        <table id="{{this.get_name()}}" class="{{this.class_}}">
-            <thead>
-                <tr class="header">
-                {%for col in this.columns%}<th>{{col}}</th>{% endfor %}
-                </tr>
-            </thead>
-        </table>
+        <div id="{{this.get_name()}}" class="{{this.class_}}">
+            <div class="crossfolium-table-body">
+                <table>
+                    <thead>
+                        <tr class="header">
+                        {%for col in this.columns%}<th>{{col}}</th>{% endfor %}
+                        </tr>
+                    </thead>
+                    <tbody></tbody>
+                </table>
+            </div>
+            {% if this.page_size %}
+            <div class="crossfolium-table-pager">
+                <button class="previous">&lt;</button>
+                <span class="range"></span>
+                <button class="next">&gt;</button>
+            </div>
+            {% endif %}
+        </div>
         {% endmacro %}
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
-            {{this.get_name()}}.dataTable = dc.dataTable('#{{this.get_name()}}');
-            {{this.get_name()}}.dataTable
-                .dimension({{this.crossfilter.get_name()}}.allDim)
-                .group(function (d) { return 'dc.js extra line'; })
-                .size({{this.size}})
-                .columns([
+            {% if this.sort_by %}
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}}, "{{this.sort_by}}");
+            {% else %}
+            {{this.get_name()}}.dimension = {{this.crossfilter.get_name()}}.allDim;
+            {% endif %}
+            {{this.get_name()}}.dataTable = new crossfolium.Table(
+                document.getElementById("{{this.get_name()}}"),
+                {{this.get_name()}}.dimension,
+                [
                   {% for col in this.columns %}
-                  function (d) { return d["{{col}}"]; },
+                  function (d) { return {{this.crossfilter._field(col)}}; },
                   {% endfor %}
-                  ])
-                {%if this.sort_by %}.sortBy(dc.pluck('{this.sort_by}'))
-                {%if this.ascending %}.order(d3.ascending){% else %}.order(d3.descending){% endif %}
-                {% endif %}
-                .on('renderlet', function (table) {
-                    table.select('tr.dc-table-group').remove();
-                    });
+                ],
+                {size: {{this.size}}, ascending: {{this.ascending|tojson}},
+                 pageSize: {{this.page_size|tojson}}, visibleRows: {{this.visible_rows|tojson}},
+                 rowHeight: {{this.row_height}}});
+            dc.registerChart({{this.get_name()}}.dataTable, {{this.crossfilter.get_name()}}.group);
         {% endmacro %}
-        """)
+        """)  # noqa
+
+    def _referenced_columns(self):
+        return list(self.columns) + [self.sort_by]
+
+    def _dimensions(self):
+        return [self.sort_by] if self.sort_by else []
 
 
 class CountFilter(Div):
@@ -408,24 +1053,34 @@ class CountFilter(Div):
         {% endmacro %}
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
-            {{this.get_name()}}.dataCount = dc.dataCount("#{{this.get_name()}}")
-                .dimension({{this.crossfilter.get_name()}}.crossfilter)
-                .group({{this.crossfilter.get_name()}}.crossfilter.groupAll()
-                );
+            {{this.get_name()}}.dataCount = dc.dataCount("#{{this.get_name()}}",
+                    {{this.crossfilter.get_name()}}.group)
+                .dimension({{this.crossfilter.get_name()}}.count ?
+                    {size: function () {return {{this.crossfilter.get_name()}}.total;}} :
+                    {{this.crossfilter.get_name()}}.crossfilter)
+                .group(crossfolium.reduce({{this.crossfilter.get_name()}}.crossfilter.groupAll(),
+                    {{this.crossfilter.get_name()}}, null));
         {% endmacro %}
         """)
 
 
 class ResetFilter(Div):
-    def __init__(self, html="Reset all", **kwargs):
-        """TODO docstring here
+    def __init__(self, html="Reset all", crossfilter=None, **kwargs):
+        """A link that resets the filters.
+
         Parameters
         ----------
+        html : str, default "Reset all"
+            The text of the link.
+        crossfilter : Crossfilter, default None
+            The Crossfilter whose filters are reset. If None, the filters of all the
+            Crossfilters of the page are reset.
         """
         super(ResetFilter, self).__init__(**kwargs)
         self._name = 'ResetFilter'
 
         self.html = html
+        self.crossfilter = crossfilter
 
         self._template = Template(u"""
         {% macro header(this, kwargs) %}
@@ -442,9 +1097,16 @@ class ResetFilter(Div):
             <a id="{{this.get_name()}}" class="{{this.class_}} reset-filters">{{this.html}}</a>
         {% endmacro %}
         {% macro script(this, kwargs) %}
-            d3.selectAll('.reset-filters').on('click', function () {
-                dc.filterAll();
-                dc.renderAll();
+            d3.select('#{{this.get_name()}}').on('click', function () {
+                {% if this.crossfilter %}
+                var groups = [{{this.crossfilter.get_name()}}.group];
+                {% else %}
+                var groups = crossfolium.groups;
+                {% endif %}
+                groups.forEach(function (group) {
+                    dc.filterAll(group);
+                    dc.redrawAll(group);
+                    });
                 });
         {% endmacro %}
         """)
@@ -454,11 +1116,14 @@ class GeoChoroplethFilter(Div):
     """TODO docstring here
     Parameters
     ----------
+    measures : list of tuple, default None
+        (name, kind, column) measures computed by the group of the chart, which
+        draws the first one (see PieFilter).
     """
     def __init__(self, crossfilter, column, geojson, key_on='feature.properties.name',
                  name="", width=150, height=150, inner_radius=20,
                  weight=None, order=None, elastic_x=True, projection=None,
-                 colors=None, **kwargs):
+                 colors=None, measures=None, **kwargs):
         super(GeoChoroplethFilter, self).__init__(width=width, height=height, **kwargs)
         self._name = 'GeoChoroplethFilter'
 
@@ -473,6 +1138,9 @@ class GeoChoroplethFilter(Div):
         self.inner_radius = inner_radius
         self.order = order
         self.weight = weight
+        self.measures = _measures(measures)
+        if weight and self.measures:
+            raise ValueError("weight and measures cannot be used together.")
         self.elastic_x = elastic_x
         self.colors = colors if colors else None
 
@@ -495,35 +1163,45 @@ class GeoChoroplethFilter(Div):
 
             {{this.get_name()}}.geojson = {{this.geojson}};
 
-            {{this.get_name()}}.dimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                function(d) {return d["{{this.column}}"];});
+            {{this.get_name()}}.dimension = crossfolium.dimension({{this.crossfilter.get_name()}}, "{{this.column}}");
+            {{this.get_name()}}.decode = crossfolium.label({{this.crossfilter.get_name()}}, "{{this.column}}");
+            {{this.get_name()}}.encode = crossfolium.code({{this.crossfilter.get_name()}}, "{{this.column}}");
             document.getElementById("{{this.get_name()}}").innerHTML =
                 '<h4>{{this.name}} <small><a id="{{this.get_name()}}-reset">reset</a></small></h4>'
                 + '<div id="{{this.get_name()}}-chart" class="dc-chart"></div>';
 
-            {{this.get_name()}}.chart = dc.geoChoroplethChart('#{{this.get_name()}}-chart')
+            {{this.get_name()}}.chart = dc.geoChoroplethChart('#{{this.get_name()}}-chart', {{this.crossfilter.get_name()}}.group)
                 .width({{this.width}})
                 .height({{this.height}})
                 .dimension({{this.get_name()}}.dimension)
-                .group({{this.get_name()}}.dimension.group()
-                    {% if this.weight %}.reduceSum(function(d) {return d["{{this.weight}}"];})
-                    {% else %}.reduceCount(){% endif %}
-                    )
+                .group(crossfolium.group({{this.crossfilter.get_name()}}, {{this.get_name()}}.dimension,
+                    {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %}
+                    {%- if this.measures %}, {{this.measures|tojson}}{% endif %}))
+                {% if this.measures %}.valueAccessor(function (d) {
+                    return d.value[{{this.measures[0].name|tojson}}];
+                    }){% endif %}
                 .overlayGeoJson({{this.get_name()}}.geojson.features, "state",
-                    function (feature) {return {{this.key_on}};}
+                    function (feature) {return {{this.get_name()}}.encode({{this.key_on}});}
                     )
+                .title(function (d) {return crossfolium.title({{this.get_name()}}.decode(d.key), d.value);})
                 {% if this.projection %}.projection({{this.projection}}){% endif %}
                 {% if this.colors %}.colors({{this.colors}}){% endif %}
                 {% if this.order %}.ordering(function (d) {
                     var out = null;
                     var order={{this.order}};
                     for (var j=0;j<order.length;j++) {
-                        if (order[j]==d.key) {out = 1+j;}
+                        if (order[j]=={{this.get_name()}}.decode(d.key)) {out = 1+j;}
                         }
                     return out;}){% endif %};
             d3.selectAll('#{{this.get_name()}}-reset').on('click',function () {
                 {{this.get_name()}}.chart.filterAll();
-                dc.redrawAll();
+                dc.redrawAll({{this.crossfilter.get_name()}}.group);
                 });
         {% endmacro %}
         """)  # noqa
+
+    def _referenced_columns(self):
+        return [self.column, self.weight] + _measure_columns(self.measures)
+
+    def _dimensions(self):
+        return [self.column]
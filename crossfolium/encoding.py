@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding
+--------
+
+How crossfolium turns a data set into the javascript payload of a Crossfilter.
+"""
+import base64
+import json
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# The name of the column holding the number of records collapsed in each row.
+COUNT_COLUMN = '__count__'
+
+# The numpy dtypes that have a javascript TypedArray counterpart.
+TYPED_ARRAYS = ('int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'float32', 'float64')
+
+
+def is_dataframe(data):
+    """Tells whether `data` looks like a pandas.DataFrame (pandas is not imported)."""
+    return hasattr(data, 'columns') and hasattr(data, 'dtypes') and hasattr(data, 'to_json')
+
+
+def is_categorical(values):
+    """Tells whether `values` looks like a pandas.Categorical."""
+    return hasattr(values, 'codes') and hasattr(values, 'categories')
+
+
+def _as_array(values):
+    """Turn a sequence of values into a 1-dimensional numpy array."""
+    out = np.asarray(values)
+    if out.ndim != 1:
+        out = np.empty(len(values), dtype=object)
+        out[:] = list(values)
+    return out
+
+
+def column_names(data):
+    """The names of the columns of a data set, in order."""
+    if is_dataframe(data):
+        return [str(name) for name in data.columns]
+    if isinstance(data, dict):
+        return [str(name) for name in data]
+    names = OrderedDict()
+    for record in data:
+        for key in record:
+            names.setdefault(key, None)
+    return list(names)
+
+
+def to_columns(data, names=None):
+    """Split a data set into columns.
+
+    Parameters
+    ----------
+    data : list of dict, pandas.DataFrame or dict of arrays
+        The data set. A DataFrame or a dict of arrays is read column by column,
+        without building any record.
+    names : list of str, default None
+        The columns to keep. If None, all the columns are kept.
+
+    Returns
+    -------
+    columns : OrderedDict
+        One 1-dimensional numpy array per column (pandas categorical columns are
+        kept as pandas.Categorical).
+        Missing values of a list of records are filled with None.
+    length : int
+        The number of records.
+    """
+    if names is None:
+        names = column_names(data)
+    if is_dataframe(data):
+        labels = dict((str(label), label) for label in data.columns)
+        columns = OrderedDict()
+        for name in names:
+            values = data[labels[name]].values
+            columns[name] = values if is_categorical(values) else np.asarray(values)
+        return columns, len(data)
+    if isinstance(data, dict):
+        labels = dict((str(label), label) for label in data)
+        columns = OrderedDict((name, _as_array(data[labels[name]])) for name in names)
+        lengths = set(len(data[label]) for label in data)
+        if len(lengths) > 1:
+            raise ValueError("All the columns must have the same length, "
+                             "got lengths {}.".format(sorted(lengths)))
+        return columns, lengths.pop() if lengths else 0
+
+    columns = OrderedDict((name, _as_array([record.get(name) for record in data]))
+                          for name in names)
+    return columns, len(data)
+
+
+def _is_missing(value):
+    """Tells whether a value of an object column is missing: None, NaN, NaT or pandas.NA."""
+    return (value is None or (value != value) is True or
+            type(value).__name__ in ('NAType', 'NaTType'))
+
+
+def missing_values(values):
+    """The boolean mask of the missing values of a column.
+
+    Floats NaN, datetimes NaT, and None, NaN, NaT or pandas.NA in object columns
+    (such as string columns with gaps) are missing.
+    """
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind in 'fc':
+        return np.isnan(values)
+    if kind in 'Mm':
+        return np.isnat(values)
+    if kind == 'O' and len(values):
+        return np.frompyfunc(_is_missing, 1, 1)(values).astype(bool)
+    return np.zeros(len(values), dtype=bool)
+
+
+def factorize(values):
+    """Split a column into integer codes and a table of distinct values.
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        The index of each value in `categories`.
+    categories : numpy.ndarray
+        The distinct values, sorted. None if the values cannot be sorted (mixed types).
+        Missing values (see `missing_values`) get the code of a last None category.
+    """
+    if is_categorical(values):
+        codes = np.asarray(values.codes)
+        categories = np.asarray(values.categories)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(categories), codes)
+            categories = np.append(categories.astype(object), None)
+        return codes, categories
+    missing = missing_values(values) if values.dtype.kind == 'O' else None
+    try:
+        if missing is None or not missing.any():
+            categories, codes = np.unique(values, return_inverse=True)
+            return codes.ravel(), categories
+        categories, present = np.unique(values[~missing], return_inverse=True)
+    except TypeError:
+        return None, None
+    codes = np.full(len(values), len(categories), dtype=np.int64)
+    codes[~missing] = present.ravel()
+    return codes, np.append(categories.astype(object), None)
+
+
+def _hash_codes(values):
+    """Integer codes of the values of a column that numpy cannot sort."""
+    table = {}
+    return np.fromiter((table.setdefault(repr(value), len(table)) for value in values),
+                       dtype=np.int64, count=len(values))
+
+
+def collapse(columns, length):
+    """Group the identical rows of a data set into one row with a count.
+
+    Parameters
+    ----------
+    columns : OrderedDict
+        The columns, as returned by `to_columns`.
+    length : int
+        The number of records.
+
+    Returns
+    -------
+    (columns, length): the distinct rows, in order of first appearance, with an
+    extra COUNT_COLUMN holding the number of records each one stands for.
+    """
+    if not columns or not length:
+        out = OrderedDict(columns)
+        out[COUNT_COLUMN] = np.ones(length, dtype=np.int64)
+        return out, length
+    codes = []
+    for values in columns.values():
+        column_codes, categories = factorize(values)
+        codes.append(_hash_codes(values) if categories is None else column_codes)
+    _, first, counts = np.unique(np.stack(codes, axis=1), axis=0,
+                                 return_index=True, return_counts=True)
+    order = np.argsort(first)
+    first, counts = first[order], counts[order]
+    out = OrderedDict((name, values[first]) for name, values in columns.items())
+    out[COUNT_COLUMN] = counts
+    return out, len(first)
+
+
+def _small_int_dtype(n):
+    """The smallest unsigned integer dtype able to index `n` values."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def dictionary_encode(values, length, max_categories):
+    """Dictionary-encode a low-cardinality string (or pandas category) column.
+
+    Returns
+    -------
+    The tuple (codes, categories), or None if the column is better left as is:
+    the column is not made of strings, or it has more than `max_categories`
+    distinct values, or less than two records per distinct value.
+    """
+    if not max_categories:
+        return None
+    if not is_categorical(values) and values.dtype.kind not in 'OUS':
+        return None
+    codes, categories = factorize(values)
+    if categories is None:
+        return None
+    if not is_categorical(values) and (len(categories) > max_categories or
+                                       2 * len(categories) > length):
+        return None
+    return codes.astype(_small_int_dtype(len(categories))), categories
+
+
+def column_values(values):
+    """Turn a column into a list of JSON-serializable values.
+
+    Missing values (see `missing_values`) become null, and datetimes are written
+    as milliseconds since epoch, which is what `new Date(x)` expects in javascript.
+    """
+    values = np.asarray(values)
+    missing = missing_values(values)
+    kind = values.dtype.kind
+    if kind in 'Mm':
+        values = values.astype('{}8[ms]'.format(kind)).astype(np.int64)
+    if missing.any():
+        values = np.where(missing, None, values.astype(object))
+    return values.tolist()
+
+
+def default_dtype(values):
+    """The typed array dtype a numeric column gets in a binary payload.
+
+    Floats and datetimes are kept in float64, integers go in int32 when they fit.
+    Returns None for non-numeric columns.
+    """
+    kind = values.dtype.kind
+    if kind in 'iub':
+        if not len(values) or (values.min() >= -2 ** 31 and values.max() < 2 ** 31):
+            return 'int32'
+        return 'float64'
+    if kind in 'fMm':
+        return 'float64'
+    return None
+
+
+def typed_array(values, dtype, binary=False):
+    """Encode a numeric column as a base64 little-endian typed array.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The column.
+    dtype : str
+        One of TYPED_ARRAYS. Integer dtypes must hold the values exactly.
+    binary : bool, default False
+        If True, the little-endian array is returned as is under the "buffer" key,
+        instead of being base64-encoded (see `binary_payload`).
+
+    Returns
+    -------
+    {"dtype": dtype, "base64": data}, that the browser views through the matching
+    TypedArray (Float32Array, Int32Array...) without parsing each number.
+    """
+    if str(dtype) not in TYPED_ARRAYS:
+        raise ValueError("dtype must be one of {}, got {!r}".format(TYPED_ARRAYS, dtype))
+    if is_categorical(values):
+        values = np.asarray(values)
+    if values.dtype.kind in 'Mm':
+        values = values.astype('{}8[ms]'.format(values.dtype.kind)).astype(np.int64)
+    target = np.dtype(dtype).newbyteorder('<')
+    # No copy is made when the column already has the right dtype. Values out of
+    # the range of the dtype are caught below.
+    with np.errstate(invalid='ignore'):
+        out = np.ascontiguousarray(values, dtype=target)
+    if target.kind in 'iu' and not np.array_equal(out, values):
+        raise ValueError("The values cannot be stored exactly as {}.".format(dtype))
+    if binary:
+        return OrderedDict([('dtype', str(dtype)), ('buffer', out)])
+    return OrderedDict([
+        ('dtype', str(dtype)),
+        ('base64', base64.b64encode(memoryview(out)).decode('ascii')),
+        ])
+
+
+def to_json(obj):
+    """Dump `obj` in compact JSON that can be safely inlined in a <script> tag.
+
+    NaN and infinities are refused: JSON.parse does not read them.
+    """
+    return json.dumps(obj, separators=(',', ':'), allow_nan=False).replace('</', '<\\/')
+
+
+def records_payload(data):
+    """Encode a data set as a list of records.
+
+    A list of records is written with its python representation, a DataFrame is
+    dumped by pandas' own (vectorized) JSON writer.
+    """
+    if is_dataframe(data):
+        return data.to_json(orient='records', date_unit='ms').replace('</', '<\\/')
+    if isinstance(data, dict):
+        raise ValueError("A dict of arrays cannot be written with encoding='records', "
+                         "use encoding='columnar'.")
+    return data
+
+
+def quantize(values, decimals, dtype=None):
+    """Round a numeric column to `decimals` decimal places.
+
+    If `dtype` is an integer dtype, the values are returned in fixed point, that is
+    multiplied by 10**decimals and rounded to integers (missing values stay NaN, see
+    `missing_sentinel`).
+    """
+    if dtype is not None and np.dtype(dtype).kind in 'iu':
+        return np.round(np.asarray(values, dtype=np.float64) * 10 ** decimals)
+    return np.round(values, decimals)
+
+
+def missing_sentinel(dtype):
+    """The integer that stands for missing values in a fixed-point column of `dtype`:
+    the lowest value of signed dtypes, the highest of unsigned ones."""
+    info = np.iinfo(dtype)
+    return int(info.min if np.dtype(dtype).kind == 'i' else info.max)
+
+
+def numeric_values(values):
+    """A numeric column as float64, datetimes being milliseconds since epoch."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        missing = np.isnat(values)
+        out = values.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+        out[missing] = np.nan
+        return out
+    if values.dtype.kind == 'm':
+        return values.astype('timedelta64[ms]').astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def _nice_number(x, round_up=False):
+    """The number of the form {1, 2, 5} * 10**k closest to x on a log scale, or the
+    smallest one greater or equal to x if `round_up`."""
+    exponent = np.floor(np.log10(x))
+    candidates = [mantissa * 10 ** exponent for mantissa in (1, 2, 5, 10)]
+    if round_up:
+        return float(min(c for c in candidates if c >= x))
+    return float(min(candidates, key=lambda c: abs(np.log(c / x))))
+
+
+def auto_bins(values, domain=None, groupby=None, max_bins=100):
+    """Choose the domain and the bin width of a histogram.
+
+    The bin width follows the Freedman-Diaconis rule (twice the interquartile range
+    over the cubic root of the number of values), rounded to the nearest 1, 2 or 5
+    times a power of ten, and widened if needed to make at most `max_bins` bins.
+    The domain runs from the minimum to the maximum of the values, extended to
+    multiples of the bin width.
+    Any of `domain` and `groupby` that is given is kept as is.
+
+    Returns
+    -------
+    (domain, groupby), as python floats.
+    """
+    values = numeric_values(values)
+    values = values[~np.isnan(values)]
+    if domain is not None:
+        low, high = float(domain[0]), float(domain[1])
+    elif len(values):
+        low, high = float(values.min()), float(values.max())
+    else:
+        low, high = 0., 1.
+    if groupby is None:
+        inside = values[(values >= low) & (values <= high)]
+        width = 0.
+        if len(inside):
+            q1, q3 = np.percentile(inside, [25, 75])
+            width = 2 * (q3 - q1) / len(inside) ** (1. / 3)
+        narrowest = (high - low) / max_bins
+        groupby = _nice_number(width) if width > 0 else 0.
+        if groupby < narrowest:
+            groupby = _nice_number(narrowest, round_up=True)
+        groupby = groupby or 1.
+    groupby = float(groupby)
+    if domain is None:
+        low = np.floor(low / groupby) * groupby
+        high = (np.floor(high / groupby) + 1) * groupby
+    return [float(low), float(high)], groupby
+
+
+def bin_index(values, domain, groupby):
+    """The histogram bin of each value, that is floor((x - domain[0]) / groupby)
+    shifted by domain[0] / groupby so that bin * groupby is the left edge of the bin.
+
+    The bins are integers (in the smallest signed dtype holding them) when
+    domain[0] is a multiple of groupby, which is the case of `auto_bins` domains.
+    Missing values stay NaN.
+    """
+    values = numeric_values(values)
+    offset = domain[0] / groupby
+    # As the records path computes it in the browser, so that both agree on the edges.
+    bins = np.floor((values - domain[0]) / groupby) + offset
+    if offset != np.floor(offset) or np.isnan(bins).any():
+        return bins
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(bins) or (bins.min() >= info.min and bins.max() <= info.max):
+            return bins.astype(dtype)
+    return bins
+
+
+def encode_column(values, length, max_categories=256, dtype=None, decimals=None,
+                  binary=False):
+    """Encode one column of the payload.
+
+    Returns either the list of values, or {"categories": [...], "codes": [...]}
+    for a dictionary-encoded column.
+    If `dtype` is given, the values (or the codes) are written as a typed array
+    (see `typed_array`).
+    If `decimals` is given, the values are rounded to that many decimal places. With
+    an integer `dtype`, they are written in fixed point and the typed array gets a
+    "decimals" entry telling the browser by which power of 10 to divide them. Missing
+    values are then written as `missing_sentinel(dtype)`, given in a "missing" entry,
+    and the browser reads them as NaN.
+    If `binary` is True, all numeric values and codes are written as raw typed arrays,
+    by default with `default_dtype`.
+    """
+    if decimals is not None:
+        values = quantize(values, decimals, dtype)
+        if dtype is not None and np.dtype(dtype).kind in 'iu':
+            missing = np.isnan(values)
+            sentinel = missing_sentinel(dtype)
+            if missing.any():
+                if (values == sentinel).any():
+                    raise ValueError("The values cannot be stored as {}: {} stands for the "
+                                     "missing values.".format(dtype, sentinel))
+                values = np.where(missing, sentinel, values)
+            out = typed_array(values, dtype, binary=binary)
+            out['decimals'] = decimals
+            if missing.any():
+                out['missing'] = sentinel
+            return out
+    encoded = dictionary_encode(values, length, max_categories)
+    if encoded is None:
+        if dtype is None and binary:
+            dtype = default_dtype(values)
+        if dtype is None:
+            return column_values(values)
+        return typed_array(values, dtype, binary=binary)
+    codes, categories = encoded
+    if dtype is None and binary:
+        dtype = str(codes.dtype)
+    return OrderedDict([
+        ('categories', column_values(categories)),
+        ('codes', codes.tolist() if dtype is None else
+         typed_array(codes, dtype, binary=binary)),
+        ])
+
+
+def encode_columns(columns, length, max_categories=256, dtypes=None, precision=None,
+                   binary=False):
+    """Encode all the columns of the payload (see `encode_column`).
+
+    Parameters
+    ----------
+    columns : OrderedDict
+        The columns, as returned by `to_columns`.
+    length : int
+        The number of records.
+    max_categories : int, default 256
+        The threshold for dictionary-encoding string columns.
+    dtypes : dict, default None
+        The columns to write as typed arrays, with their dtype.
+    precision : dict, default None
+        The columns to round, with their number of decimals.
+    binary : bool, default False
+        Whether the columns are meant for `binary_payload`.
+
+    Returns
+    -------
+    An OrderedDict of encoded columns.
+    """
+    dtypes = dtypes or {}
+    precision = precision or {}
+    for name, option in (('dtypes', dtypes), ('precision', precision)):
+        missing = set(option) - set(columns)
+        if missing:
+            raise ValueError("Unknown columns in {}: {}".format(name, sorted(missing)))
+    out = OrderedDict()
+    for name, values in columns.items():
+        try:
+            out[name] = encode_column(values, length, max_categories,
+                                      dtypes.get(name), precision.get(name), binary)
+        except ValueError as error:
+            raise ValueError("Column {!r}: {}".format(name, error))
+    return out
+
+
+def columnar_payload(encoded, length):
+    """Write encoded columns into a JSON payload.
+
+    The payload is an object {"length": n, "columns": {name: values}}, so that each
+    column name is written once instead of once per record.
+
+    Parameters
+    ----------
+    encoded : OrderedDict
+        The columns, as returned by `encode_columns`.
+    length : int
+        The number of records.
+    """
+    return to_json(OrderedDict([('length', length), ('columns', encoded)]))
+
+
+def binary_payload(encoded, length):
+    """Write encoded columns into a binary payload.
+
+    The layout is:
+        - the byte length of the header, as a little-endian uint32,
+        - the header: the JSON payload (see `columnar_payload`) where each typed
+          array is replaced by {"dtype": dtype, "offset": offset, "length": n},
+        - padding to a multiple of 8 bytes,
+        - the typed arrays, each one starting at `offset` bytes after the padding,
+          itself a multiple of 8.
+
+    Parameters
+    ----------
+    encoded : OrderedDict
+        The columns, as returned by `encode_columns` with binary=True.
+    length : int
+        The number of records.
+    """
+    buffers = []
+    position = [0]
+
+    def _extract(column):
+        if not isinstance(column, dict):
+            return column
+        out = OrderedDict()
+        for key, value in column.items():
+            if key == 'buffer':
+                out['offset'] = position[0]
+                out['length'] = len(value)
+                buffers.append(value)
+                position[0] += -(-value.nbytes // 8) * 8
+            else:
+                out[key] = _extract(value)
+        return out
+
+    header = json.dumps(OrderedDict([
+        ('length', length),
+        ('columns', OrderedDict((name, _extract(column)) for name, column in encoded.items())),
+        ]), separators=(',', ':'), allow_nan=False).encode('utf-8')
+    chunks = [np.array([len(header)], dtype='<u4').tobytes(), header,
+              b'\0' * (-(4 + len(header)) % 8)]
+    for values in buffers:
+        chunks += [memoryview(values), b'\0' * (-values.nbytes % 8)]
+    return b''.join(chunks)
+
+
+def categories(encoded):
+    """The lookup tables of the dictionary-encoded columns, out of `encode_columns`."""
+    return OrderedDict((name, column['categories']) for name, column in encoded.items()
+                       if isinstance(column, dict) and 'categories' in column)
+
+
+def compress(data, compression):
+    """Compress a payload.
+
+    Parameters
+    ----------
+    data : str or bytes
+        The payload to compress. A text is encoded in UTF-8.
+    compression : str
+        'gzip' or 'deflate' (zlib format), as understood by the browsers'
+        DecompressionStream.
+
+    Returns
+    -------
+    The compressed bytes.
+    """
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'deflate':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS)
+    else:
+        raise ValueError("compression must be 'gzip' or 'deflate', got {!r}".format(compression))
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return compressor.compress(data) + compressor.flush()
+
+
+def column_sizes(columns, length, **kwargs):
+    """The number of bytes each column takes in the payload.
+
+    The keyword arguments are passed to `encode_columns`.
+    """
+    return OrderedDict((name, len(to_json(column))) for name, column in
+                       encode_columns(columns, length, **kwargs).items())
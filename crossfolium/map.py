@@ -5,18 +5,53 @@ Map
 
 All the part of crossfolium that is about drawing things in a folium.Map.
 """
+import json
+
 from jinja2 import Template
 
 from folium.map import FeatureGroup
 from folium.plugins import HeatMap
 from branca.element import Figure, JavascriptLink, CssLink
 
+from crossfolium import encoding, spatial
+
+
+def _children_columns(element):
+    """The columns read by the marker functions (and co) attached to an element."""
+    out = []
+    for child in element._children.values():
+        if hasattr(child, '_referenced_columns'):
+            out += child._referenced_columns()
+    return out
+
 
 class FeatureGroupFilter(FeatureGroup):
     def __init__(self, crossfilter, name=None, fit_bounds=False,
-                 circle_radius=None, color="#0000ff", opacity=1., **kwargs):
+                 circle_radius=None, color="#0000ff", opacity=1., incremental=True,
+                 cache_size=None, renderer=None, **kwargs):
         """
+        Parameters
+        ----------
+        incremental : bool, default True
+            If True, a filter change only adds the markers of the records that entered
+            the filter and removes those of the records that left it. If False, all
+            the markers are rebuilt.
+        cache_size : int, default None
+            The markers are made once per record and kept across filter changes.
+            cache_size bounds the number of markers kept, the least recently shown
+            being dropped first (None for no bound, 0 to disable the cache).
+            In javascript, the `invalidate()` method of the layer rebuilds all the markers,
+            for example after a style change; it is called when another marker_function
+            is set.
+        renderer : str, default None
+            If 'canvas', the circles of a CircleMarkerFunction are drawn in a canvas
+            shared by the layers of the map, rather than being one SVG element each,
+            which is much faster beyond a few thousand points. Leaflet's canvas
+            renderer finds the clicked circle itself, so that popups keep working.
+            If None, Leaflet's default renderer is used.
         """
+        if renderer not in (None, 'svg', 'canvas'):
+            raise ValueError("renderer must be None, 'svg' or 'canvas', got {!r}".format(renderer))
         super(FeatureGroupFilter, self).__init__(**kwargs)
         self._name = 'FeatureGroupFilter'
 
@@ -27,84 +62,442 @@ class FeatureGroupFilter(FeatureGroup):
         self.circle_radius = circle_radius
         self.color = color
         self.opacity = opacity
+        self.incremental = incremental
+        self.cache_size = cache_size
+        self.renderer = renderer
 
         self._template = Template(u"""
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
             {{this.get_name()}}.feature_group = new L.FeatureGroup();
+            {% if this.renderer == 'canvas' %}
+            {{this.get_name()}}.renderer = crossfolium.canvas({{this._parent.get_name()}});
+            {% endif %}
             {{this.get_name()}}.marker_function = function(d) {return L.marker([0,0]);}
-            {{this.get_name()}}.updateFun = function() {
+            {{this.get_name()}}.shown = new Map();
+            {{this.get_name()}}.invalidate = function () {
+                this.markers.clear();
+                this.feature_group.clearLayers();
+                this.shown = new Map();
+                // Draws the new markers, unless the layer is yet to be drawn.
+                if (this.drawn) {this.updateFun();}
+                };
+            crossfolium.cacheMarkers({{this.get_name()}},
+                {% if this.cache_size is none %}null{% else %}{{this.cache_size}}{% endif %});
+            {{this.get_name()}}.updateFun = function(dimVals) {
+                this.drawn = true;
+                dimVals = dimVals || crossfolium.filtered({{this.crossfilter.get_name()}});
+                {% if this.incremental %}
+                this.shown = crossfolium.syncLayers(this.feature_group, this.shown, dimVals,
+                    function (d) {return {{this.get_name()}}.markers.get(d);}, false);
+                {% else %}
                 this.feature_group.clearLayers();
-                var dimVals = {{this.crossfilter.get_name()}}.allDim.top(Infinity)
                 for (var i in dimVals) {
                 var d = dimVals[i];
-                    var marker = this.marker_function(d);
+                    var marker = this.markers.get(d);
                     this.feature_group.addLayer(marker);
                     }
+                {% endif %}
                 {{this._parent.get_name()}}.addLayer(this.feature_group);
                 {% if this.fit_bounds %}{{this._parent.get_name()}}
                     .fitBounds(this.feature_group.getBounds());{% endif %}
                 }
-            dc.dataTable('#foo')
-               .dimension({{this.crossfilter.get_name()}}.allDim)
-               .group(function (d) { return 'dc.js';})
-               .on('renderlet', function (table) { {{this.get_name()}}.updateFun();});
-            {{this.get_name()}}.updateFun();
+            {{this.crossfilter.get_name()}}.subscribe(function (records) {
+                {{this.get_name()}}.updateFun(records);
+                });
         {% endmacro %}
         """)
 
+    def _referenced_columns(self):
+        return _children_columns(self)
+
 
 class HeatmapFilter(HeatMap):
-    def __init__(self, crossfilter, name=None, fit_bounds=False, **kwargs):
+    def __init__(self, crossfilter, name=None, fit_bounds=False, lat='lat', lng='lng',
+                 weight=None, aggregate=False, min_opacity=0.5, max_zoom=18, max_val=None,
+                 radius=25, blur=15, gradient=None, **kwargs):
         """
+        Parameters
+        ----------
+        lat, lng : str, default 'lat' and 'lng'
+            The columns of the coordinates.
+        weight : str, default None
+            A column giving the intensity of each record. If None, all the records
+            weigh 1.
+        aggregate : bool, default False
+            With a columnar Crossfilter, draw one point per grid cell of about half
+            `radius` pixels, at the centroid of the filtered records of the cell, with
+            their summed weight as intensity. The cells come from a Morton code column
+            computed in python (see `spatial.parent_codes`), and the sums from a
+            crossfilter group that follows the filters, so that a redraw costs the
+            number of cells rather than the number of records.
+        max_val : float, default None
+            The intensity of the hottest color, that leaflet.heat gives to the cells
+            of its grid (of about half `radius` pixels) summing the intensities of
+            their points. If None, it is the largest intensity of the cells in view,
+            computed again on each filter change and map move, so that the colors
+            follow the scale of `weight` (and of the counts of a collapsed
+            Crossfilter). A fixed `max_val` must be scaled to the weights: the cells
+            above it saturate.
         """
         super(HeatmapFilter, self).__init__([], **kwargs)
         self._name = 'HeatmapFilter'
 
         self.crossfilter = crossfilter
         self.fit_bounds = fit_bounds
+        self.lat = lat
+        self.lng = lng
+        self.weight = weight
+        self.aggregate = aggregate
+        self.min_opacity = min_opacity
+        self.max_zoom = max_zoom
+        self.max_val = max_val
+        self.radius = radius
+        self.blur = blur
+        self.gradient = json.dumps(gradient)
+        self.spatial_level = spatial.DEFAULT_LEVEL
+        self.cluster_offset = spatial.cluster_offset(radius / 2.)
+        if aggregate and crossfilter.encoding != 'columnar':
+            raise ValueError("aggregate needs a Crossfilter with encoding='columnar'.")
+        if aggregate and crossfilter.worker:
+            raise ValueError("aggregate does not support a Crossfilter with worker=True.")
 
         self._template = Template(u"""
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
             {{this.get_name()}}.heatmap = new L.heatLayer(
-                {},
+                [],
                 {
                     minOpacity: {{this.min_opacity}},
                     maxZoom: {{this.max_zoom}},
-                    max: {{this.max_val}},
+                    max: {{this.max_val if this.max_val is not none else 1}},
                     radius: {{this.radius}},
                     blur: {{this.blur}},
                     gradient: {{this.gradient}}
                     })
                 .addTo({{this._parent.get_name()}});
+            {% if this.aggregate %}
+            {{this.get_name()}}.keyDimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                "{{this._key_column()}}");
+            {{this.get_name()}}.cells = crossfolium.gridClusters({{this.crossfilter.get_name()}},
+                {{this.get_name()}}.keyDimension, "{{this.lat}}", "{{this.lng}}",
+                {{this.spatial_level}}, {{this.cluster_offset}},
+                {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %});
             {{this.get_name()}}.updateFun = function() {
-                // this.heatmap.clearLayers();
-                var dimVals = {{this.crossfilter.get_name()}}.allDim.top(Infinity);
+                var map = {{this._parent.get_name()}};
+                var bounds = map.getBounds().pad(0.2);
+                var cells = this.cells(map.getZoom());
+                var latlngs = [];
+                for (var i = 0; i < cells.length; i++) {
+                    var cell = cells[i];
+                    if (!bounds.contains([cell.lat, cell.lng])) {continue;}
+                    latlngs.push([cell.lat, cell.lng, cell.weight]);
+                    }
+                {% if this.max_val is none %}
+                this.heatmap.setOptions({
+                    max: crossfolium.heatMax(map, latlngs, this.heatmap.options)});
+                {% endif %}
+                this.heatmap.setLatLngs(latlngs);
+                {% if this.fit_bounds %}if (latlngs.length) {
+                    map.fitBounds(L.latLngBounds(latlngs));
+                    }{% endif %}
+                }
+            {{this.crossfilter.get_name()}}.subscribe(function () {
+                {{this.get_name()}}.updateFun();
+                }, false);
+            {{this._parent.get_name()}}.on('moveend', function () {
+                {{this.get_name()}}.updateFun();
+                });
+            {% else %}
+            {% if this.max_val is none %}
+            {{this.get_name()}}.latlngs = [];
+            {{this.get_name()}}.rescale = function () {
+                this.heatmap.setOptions({max: crossfolium.heatMax(
+                    {{this._parent.get_name()}}, this.latlngs, this.heatmap.options)});
+                };
+            {{this._parent.get_name()}}.on('moveend', function () {
+                {{this.get_name()}}.rescale();
+                });
+            {% endif %}
+            {{this.get_name()}}.updateFun = function(dimVals) {
+                dimVals = dimVals || crossfolium.filtered({{this.crossfilter.get_name()}});
                 var latlngs = [];
                 for (var i in dimVals) {
                     var d = dimVals[i];
-                    latlngs.push([d.lat, d.lng]);
+                    latlngs.push([{{this.crossfilter._field(this.lat)}},
+                        {{this.crossfilter._field(this.lng)}}
+                        {% if this._intensity() %}, {{this._intensity()}}{% endif %}]);
                     }
+                {% if this.max_val is none %}
+                {{this.get_name()}}.latlngs = latlngs;
+                {{this.get_name()}}.rescale();
+                {% endif %}
                 {{this.get_name()}}.heatmap.setLatLngs(latlngs);
-                {% if this.fit_bounds %}{{this._parent.get_name()}}
-                    .fitBounds(this.heatmap.getBounds());{% endif %}
+                {% if this.fit_bounds %}if (latlngs.length) {
+                    {{this._parent.get_name()}}.fitBounds(L.latLngBounds(latlngs));
+                    }{% endif %}
                 }
-            dc.dataTable('#foo')
-               .dimension({{this.crossfilter.get_name()}}.allDim)
-               .group(function (d) { return 'dc.js';})
-               .on('renderlet', function (table) { {{this.get_name()}}.updateFun();});
-            {{this.get_name()}}.updateFun();
+            {{this.crossfilter.get_name()}}.subscribe(function (records) {
+                {{this.get_name()}}.updateFun(records);
+                });
+            {% endif %}
         {% endmacro %}
-        """)
+        """)  # noqa
+
+    def _key_column(self):
+        return '{}:{}:morton:{}'.format(self.lat, self.lng, self.spatial_level)
+
+    def _intensity(self):
+        """The javascript expression of the intensity of a record `d`: its weight
+        times the number of records it stands for with a collapsed Crossfilter.
+        None if all the records weigh 1."""
+        factors = [column for column in (
+            self.weight, self.crossfilter._count_column if self.crossfilter.collapse else None)
+            if column]
+        return ' * '.join(self.crossfilter._field(column) for column in factors) or None
+
+    def _source_columns(self):
+        return [self.lat, self.lng] if self.aggregate else []
+
+    def _derived_columns(self, columns):
+        if not self.aggregate:
+            return {}
+        return {self._key_column(): spatial.morton_codes(
+            columns[self.lat], columns[self.lng], self.spatial_level)}
+
+    def _dimensions(self):
+        return [self._key_column()] if self.aggregate else []
+
+    def _referenced_columns(self):
+        out = [self.lat, self.lng, self.weight]
+        if self.aggregate:
+            out.append(self._key_column())
+        return out
+
+
+class HexbinFilter(FeatureGroup):
+    def __init__(self, crossfilter, lat='lat', lng='lng', weight=None, zooms=None,
+                 radius=20, colors=('#ffeda0', '#f03b20'), opacity=0.7, **kwargs):
+        """A layer of hexagons colored by the number (or the weight) of the filtered
+        records they contain. Clicking hexagons filters the other charts on them.
+
+        Parameters
+        ----------
+        crossfilter : Crossfilter
+            A Crossfilter with encoding='columnar'.
+        lat, lng : str, default 'lat' and 'lng'
+            The columns of the coordinates.
+        weight : str, default None
+            A column to sum in each hexagon. If None, the records are counted.
+        zooms : list of int, default None
+            The map zooms for which the hexagons are computed (one id column each).
+            The layer uses the largest one not above the map zoom (or the smallest
+            one). If None, one zoom is chosen, at which the data spans about
+            800 pixels.
+        radius : int, default 20
+            The size of the hexagons, in pixels at their zoom.
+        colors : (str, str), default ('#ffeda0', '#f03b20')
+            The colors of the empty and of the fullest hexagons.
+        opacity : float, default 0.7
+            The fill opacity of the hexagons (a third of it for the hexagons out of
+            the selection).
+
+        The hexagon of each record is computed in python (see `spatial.hex_ids`),
+        and the browser draws one polygon per occupied hexagon from a crossfilter
+        group on it. The selection is cleared when the zoom changes the hexagons.
+        """
+        super(HexbinFilter, self).__init__(**kwargs)
+        self._name = 'HexbinFilter'
+
+        if crossfilter.encoding != 'columnar':
+            raise ValueError("HexbinFilter needs a Crossfilter with encoding='columnar'.")
+        if crossfilter.worker:
+            raise ValueError("HexbinFilter does not support a Crossfilter with worker=True.")
+        self.crossfilter = crossfilter
+        self.lat = lat
+        self.lng = lng
+        self.weight = weight
+        self.zooms = zooms
+        self.radius = radius
+        self.colors = json.dumps(list(colors))
+        self.opacity = opacity
+        self._auto_zooms = None
+
+        self._template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{this.get_name()}} = {
+                layer: L.layerGroup().addTo({{this._parent.get_name()}}),
+                resolutions: [
+                    {% for zoom, size, column in this._resolutions() %}
+                    {zoom: {{zoom}}, size: {{size}}, column: "{{column}}"},
+                    {% endfor %}
+                    ],
+                resolution: null,
+                dimension: null,
+                selected: {}
+                };
+            {{this.get_name()}}.select = function (zoom) {
+                // The resolution of the hexagons shown at a map zoom.
+                var out = this.resolutions[0];
+                this.resolutions.forEach(function (r) {if (r.zoom <= zoom) {out = r;}});
+                return out;
+                };
+            {{this.get_name()}}.filter = function () {
+                var selected = this.selected;
+                if (Object.keys(selected).length) {
+                    this.dimension.filterFunction(function (key) {return selected[key];});
+                } else {
+                    this.dimension.filterAll();
+                    }
+                };
+            {{this.get_name()}}.toggle = function (key) {
+                if (this.selected[key]) {delete this.selected[key];} else {this.selected[key] = true;}
+                this.filter();
+                dc.redrawAll({{this.crossfilter.get_name()}}.group);
+                };
+            {{this.get_name()}}.updateFun = function () {
+                var map = {{this._parent.get_name()}}, self = this;
+                var resolution = this.select(map.getZoom());
+                if (resolution !== this.resolution) {
+                    var cleared = Object.keys(this.selected).length > 0;
+                    if (this.dimension !== null) {
+                        this.dimension.filterAll();
+                        (this.dimension.dispose || this.dimension.remove).call(this.dimension);
+                        }
+                    this.selected = {};
+                    this.dimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
+                        crossfolium.key({{this.crossfilter.get_name()}}, resolution.column));
+                    this.group = crossfolium.reduce(this.dimension.group(),
+                        {{this.crossfilter.get_name()}},
+                        {% if this.weight %}"{{this.weight}}"{% else %}null{% endif %});
+                    this.resolution = resolution;
+                    if (cleared) {
+                        dc.redrawAll({{this.crossfilter.get_name()}}.group);
+                        return;
+                        }
+                    }
+                var hexagons = this.group.all().filter(function (g) {
+                    return g.key >= 0 && g.value > 0;
+                    });
+                var max = d3.max(hexagons, function (g) {return g.value;}) || 1;
+                var color = d3.scale.linear().domain([0, max]).range({{this.colors}});
+                var bounds = map.getBounds().pad(0.2);
+                var any = Object.keys(this.selected).length > 0;
+                this.layer.clearLayers();
+                hexagons.forEach(function (g) {
+                    var corners = crossfolium.hexagon(g.key, resolution.size);
+                    if (!bounds.intersects(L.latLngBounds(corners))) {return;}
+                    var polygon = L.polygon(corners, {
+                        weight: 1, color: color(g.value), fillColor: color(g.value),
+                        fillOpacity: any && !self.selected[g.key] ?
+                            {{this.opacity}} / 3 : {{this.opacity}}
+                        });
+                    polygon.on('click', function () {self.toggle(g.key);});
+                    self.layer.addLayer(polygon);
+                    });
+                };
+            {{this.get_name()}}.chart = {
+                render: function () {
+                    {{this.get_name()}}.updateFun();
+                    },
+                filterAll: function () {
+                    {{this.get_name()}}.selected = {};
+                    if ({{this.get_name()}}.dimension) {
+                        {{this.get_name()}}.filter();
+                        }
+                    }
+                };
+            {{this.get_name()}}.chart.redraw = {{this.get_name()}}.chart.render;
+            dc.registerChart({{this.get_name()}}.chart, {{this.crossfilter.get_name()}}.group);
+            {{this._parent.get_name()}}.on('moveend', function () {
+                {{this.get_name()}}.updateFun();
+                });
+        {% endmacro %}
+        """)  # noqa
+
+    def _zooms(self):
+        if self.zooms is not None:
+            return sorted(self.zooms)
+        if self._auto_zooms is None:
+            columns, _ = encoding.to_columns(self.crossfilter.data, [self.lat, self.lng])
+            self._auto_zooms = [spatial.auto_zoom(columns[self.lat], columns[self.lng])]
+        return self._auto_zooms
+
+    def _resolutions(self):
+        """The (zoom, hexagon size, id column) of each resolution."""
+        return [(zoom, spatial.hex_size(zoom, self.radius),
+                 '{}:{}:hex:{}:{}'.format(self.lat, self.lng, zoom, self.radius))
+                for zoom in self._zooms()]
+
+    def _source_columns(self):
+        return [self.lat, self.lng]
+
+    def _derived_columns(self, columns):
+        return dict((column, spatial.hex_ids(columns[self.lat], columns[self.lng], size))
+                    for _, size, column in self._resolutions())
+
+    def _dimensions(self):
+        # The dimension of the current resolution, which is replaced on zoom.
+        return [None]
+
+    def _referenced_columns(self):
+        return ([self.lat, self.lng, self.weight] +
+                [column for _, _, column in self._resolutions()])
 
 
 class MarkerClusterFilter(FeatureGroup):
     def __init__(self, crossfilter, lat='lat', lng='lng', name=None, fit_bounds=False,
                  max_cluster_radius=None, geofilter=True,
-                 circle_radius=None, color="#0000ff", opacity=1., **kwargs):
+                 circle_radius=None, color="#0000ff", opacity=1., incremental=True,
+                 cache_size=None, spatial_index=False, spatial_slack=0, clustering='browser',
+                 **kwargs):
         """
+        Parameters
+        ----------
+        incremental : bool, default True
+            If True, a filter change only adds (with addLayers) the markers of the
+            records that entered the filter and removes (with removeLayers) those of
+            the records that left it. If False, all the markers are rebuilt.
+        cache_size : int, default None
+            The markers are made once per record and kept across filter changes.
+            cache_size bounds the number of markers kept, the least recently shown
+            being dropped first (None for no bound, 0 to disable the cache).
+            In javascript, the `invalidate()` method of the layer rebuilds all the markers,
+            for example after a style change; it is called when another marker_function
+            is set.
+        spatial_index : bool, default False
+            With geofilter and a columnar Crossfilter, filter the records on the map
+            bounds with one dimension on a precomputed Morton code column (see
+            `spatial.morton_codes`) instead of two dimensions on lat and lng. The
+            bounds are covered by a few ranges of codes, with tiles at most 1/32 of
+            the bounds wide, so that records up to that far outside the bounds pass
+            the filter.
+        spatial_slack : float, default 0
+            With spatial_index, the dimension is filtered on the one range from the
+            first to the last code of the cover if it holds at most 1 + spatial_slack
+            times as many tiles as the cover: crossfilter updates such a range filter
+            with the records that enter or leave it, while the exact cover needs a
+            filter function called on every record at each move of the map.
+            With 0, the range is only used when it is the cover itself, so that the
+            filter is exact. A positive slack makes moving the map cheaper, but it is
+            an approximate filter: the records of the tiles between the ranges of the
+            cover pass it, although they are off the map, and all the other charts
+            count them. See benchmarks/spatial_filter.py.
+        clustering : str, default 'browser'
+            'browser' lets Leaflet.markercluster build the clusters of the filtered
+            markers, from scratch on each filter change.
+            'grid' (with a columnar Crossfilter) clusters the records on a grid of
+            cells of about `max_cluster_radius` pixels (80 by default) at each zoom,
+            from a Morton code column computed in python (see
+            `spatial.parent_codes`). The browser only sums the filtered records of
+            each cell at the current zoom, in a crossfilter group that follows the
+            filters, and draws one marker per cell (or the record's own marker for
+            a cell of one record).
         """
+        if clustering not in ('browser', 'grid'):
+            raise ValueError("clustering must be 'browser' or 'grid', got {!r}".format(clustering))
+        if spatial_slack < 0:
+            raise ValueError("spatial_slack must be >= 0, got {!r}".format(spatial_slack))
         super(MarkerClusterFilter, self).__init__(**kwargs)
         self._name = 'MarkerClusterFilter'
 
@@ -119,50 +512,152 @@ class MarkerClusterFilter(FeatureGroup):
         self.opacity = opacity
         self.max_cluster_radius = max_cluster_radius
         self.geofilter = geofilter
+        self.incremental = incremental
+        self.cache_size = cache_size
+        self.spatial_index = spatial_index
+        self.spatial_slack = spatial_slack
+        self.spatial_level = spatial.DEFAULT_LEVEL
+        self.clustering = clustering
+        self.cluster_offset = spatial.cluster_offset(max_cluster_radius or 80)
+        for name, option in (('spatial_index', spatial_index),
+                             ("clustering='grid'", clustering == 'grid')):
+            if option and crossfilter.encoding != 'columnar':
+                raise ValueError("{} needs a Crossfilter with encoding='columnar'.".format(name))
+        if clustering == 'grid' and crossfilter.worker:
+            raise ValueError("clustering='grid' does not support a Crossfilter with worker=True.")
 
         self._template = Template(u"""
         {% macro script(this, kwargs) %}
             var {{this.get_name()}} = {};
-            {{this.get_name()}}.marker_function = function(p) {return L.marker([p["{{this.lat}}"],p["{{this.lng}}"]]);}
+            {{this.get_name()}}.marker_function = function(p) {
+                return L.marker([{{this.crossfilter._field(this.lat, 'p')}},{{this.crossfilter._field(this.lng, 'p')}}]);
+                }
+            {% if this.clustering == 'grid' %}
+            {{this.get_name()}}.chart = L.layerGroup();
+            {% else %}
             {{this.get_name()}}.chart = new L.markerClusterGroup({
                 {%if this.max_cluster_radius %}maxClusterRadius:{{this.max_cluster_radius}},{%endif%}
                 });
-                
-            {% if this.geofilter %}
-                {{this.get_name()}}.latDimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                    function(p) { return p["{{this.lat}}"]; });
-                {{this.get_name()}}.lngDimension = {{this.crossfilter.get_name()}}.crossfilter.dimension(
-                    function(p) { return p["{{this.lng}}"]; });
+            {% endif %}
+            {% if this._uses_key() %}
+            {{this.get_name()}}.keyDimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                "{{this._key_column()}}");
+            {% endif %}
+
+            {% if this.geofilter and this.spatial_index %}
+                {{this._parent.get_name()}}.on('moveend', function(){
+                    var ranges = crossfolium.mortonCover(
+                        {{this._parent.get_name()}}.getBounds(), {{this.spatial_level}}, 32);
+                    crossfolium.filterRanges({{this.get_name()}}.keyDimension, ranges,
+                        {{this.spatial_slack}});
+                    dc.redrawAll({{this.crossfilter.get_name()}}.group);
+                    });
+            {% elif this.geofilter %}
+                {{this.get_name()}}.latDimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                    "{{this.lat}}");
+                {{this.get_name()}}.lngDimension = crossfolium.dimension({{this.crossfilter.get_name()}},
+                    "{{this.lng}}");
 
                 {{this._parent.get_name()}}.on('moveend', function(){
                     var bounds = {{this._parent.get_name()}}.getBounds();
-                    {{this.get_name()}}.latDimension.filterRange([bounds._southWest.lat,bounds._northEast.lat]);
-                    {{this.get_name()}}.lngDimension.filterRange([bounds._southWest.lng,bounds._northEast.lng]);
-                    //dc.filterAll();
-                    dc.renderAll();
+                    {{this.get_name()}}.latDimension.filterRange([bounds.getSouth(), bounds.getNorth()]);
+                    {{this.get_name()}}.lngDimension.filterRange([bounds.getWest(), bounds.getEast()]);
+                    dc.redrawAll({{this.crossfilter.get_name()}}.group);
                     });
             {% endif %}
 
+            {{this.get_name()}}.shown = new Map();
+            {{this.get_name()}}.invalidate = function () {
+                this.markers.clear();
+                this.chart.clearLayers();
+                this.shown = new Map();
+                // Draws the new markers, unless the layer is yet to be drawn.
+                if (this.drawn) {this.updateFun();}
+                };
+            crossfolium.cacheMarkers({{this.get_name()}},
+                {% if this.cache_size is none %}null{% else %}{{this.cache_size}}{% endif %});
+            {% if this.clustering == 'grid' %}
+            {{this.get_name()}}.clusters = crossfolium.gridClusters({{this.crossfilter.get_name()}},
+                {{this.get_name()}}.keyDimension, "{{this.lat}}", "{{this.lng}}",
+                {{this.spatial_level}}, {{this.cluster_offset}});
             {{this.get_name()}}.updateFun = function() {
+                this.drawn = true;
+                var map = {{this._parent.get_name()}};
+                var bounds = map.getBounds().pad(0.2);
+                this.chart.clearLayers();
+                var clusters = this.clusters(map.getZoom());
+                for (var i = 0; i < clusters.length; i++) {
+                    var cluster = clusters[i];
+                    if (!bounds.contains([cluster.lat, cluster.lng])) {continue;}
+                    this.chart.addLayer(cluster.record ? this.markers.get(cluster.record) :
+                        crossfolium.clusterMarker(cluster, map));
+                    }
+                map.addLayer(this.chart);
+                }
+            {{this.crossfilter.get_name()}}.subscribe(function () {
+                {{this.get_name()}}.updateFun();
+                }, false);
+            {% if not this.geofilter %}
+            {{this._parent.get_name()}}.on('moveend', function () {
+                {{this.get_name()}}.updateFun();
+                });
+            {% endif %}
+            {% else %}
+            {{this.get_name()}}.updateFun = function(dimVals) {
+                this.drawn = true;
+                dimVals = dimVals || crossfolium.filtered({{this.crossfilter.get_name()}});
+                {% if this.incremental %}
+                this.shown = crossfolium.syncLayers(this.chart, this.shown, dimVals,
+                    function (d) {return {{this.get_name()}}.markers.get(d);}, true);
+                {% else %}
                 this.chart.clearLayers();
-                var dimVals = {{this.crossfilter.get_name()}}.allDim.top(Infinity)
                 for (var i in dimVals) {
                     var d = dimVals[i];
-                    var marker = this.marker_function(d);
+                    var marker = this.markers.get(d);
                     this.chart.addLayer(marker);
                     }
+                {% endif %}
                 {{this._parent.get_name()}}.addLayer(this.chart);
                 {% if this.fit_bounds %}{{this._parent.get_name()}}
                     .fitBounds(this.chart.getBounds());{% endif %}
                 }
-            dc.dataTable('#{{this.get_name()}}footable')
-               .dimension({{this.crossfilter.get_name()}}.allDim)
-               .group(function (d) { return 'dc.js';})
-               .on('renderlet', function (table) { {{this.get_name()}}.updateFun();});
-            {{this.get_name()}}.updateFun();
+            {{this.crossfilter.get_name()}}.subscribe(function (records) {
+                {{this.get_name()}}.updateFun(records);
+                });
+            {% endif %}
         {% endmacro %}
         """)  # noqa
 
+    def _uses_key(self):
+        """Whether the layer reads the Morton code column."""
+        return (self.geofilter and self.spatial_index) or self.clustering == 'grid'
+
+    def _key_column(self):
+        return '{}:{}:morton:{}'.format(self.lat, self.lng, self.spatial_level)
+
+    def _source_columns(self):
+        return [self.lat, self.lng] if self._uses_key() else []
+
+    def _derived_columns(self, columns):
+        if not self._uses_key():
+            return {}
+        return {self._key_column(): spatial.morton_codes(
+            columns[self.lat], columns[self.lng], self.spatial_level)}
+
+    def _dimensions(self):
+        out = []
+        if self.geofilter and not self.spatial_index:
+            out += [self.lat, self.lng]
+        if self._uses_key():
+            out.append(self._key_column())
+        return out
+
+    def _referenced_columns(self):
+        out = [self.lat, self.lng] + _children_columns(self)
+        if self._uses_key():
+            out.append(self._key_column())
+        return out
+
     def render(self, **kwargs):
         super(MarkerClusterFilter, self).render(**kwargs)
 
@@ -171,13 +666,13 @@ class MarkerClusterFilter(FeatureGroup):
                                             "if it's not in a Figure.")
 
         figure.header.add_children(
-            JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/0.4.0/leaflet.markercluster.js"),  # noqa
+            JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/leaflet.markercluster.js"),  # noqa
             name='markerclusterjs')
 
         figure.header.add_children(
-            CssLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/0.4.0/MarkerCluster.css"),  # noqa
+            CssLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.css"),  # noqa
             name='markerclustercss')
 
         figure.header.add_children(
-            CssLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/0.4.0/MarkerCluster.Default.css"),  # noqa
+            CssLink("https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.Default.css"),  # noqa
             name='markerclusterdefaultcss')
@@ -11,6 +11,21 @@ import json
 from branca.element import MacroElement
 
 
+def _field(self, column):
+    """The javascript expression of the value of `column` in the record `d`, as read
+    by the Crossfilter of the map layer (see Crossfilter.store)."""
+    crossfilter = getattr(self._parent, 'crossfilter', None)
+    if crossfilter is None:
+        return 'd[{}]'.format(json.dumps(column))
+    return crossfilter._field(column)
+
+
+def _feature_columns(*values):
+    """The columns referenced by 'feature.<column>' style values."""
+    return [value[8:] for value in values
+            if isinstance(value, str) and value.startswith('feature.')]
+
+
 class MarkerFunction(MacroElement):
     """A simple marker with no flourish.
 
@@ -34,12 +49,17 @@ class MarkerFunction(MacroElement):
         self._template = Template(
             '{% macro script(this, kwargs) %}'
             '{{this._parent.get_name()}}.marker_function = function (d) {'
-            'return L.marker([d["{{this.lat}}"], d["{{this.lng}}"]])'
-            '{% if this.popup %}.bindPopup(d["{{this.popup}}"]){% endif %}'
+            'return L.marker([{{this._field(this.lat)}}, {{this._field(this.lng)}}])'
+            '{% if this.popup %}.bindPopup({{this._field(this.popup)}}){% endif %}'
             ';}'
             '{% endmacro %}'
             )
 
+    _field = _field
+
+    def _referenced_columns(self):
+        return [self.lat, self.lng, self.popup]
+
 
 class CircleMarkerFunction(MacroElement):
     """A circleMarker with radius specified in pixels (or in meters).
@@ -61,6 +81,9 @@ class CircleMarkerFunction(MacroElement):
     **kwargs:
         You can add eventually other arguments to style the markers.
         See `http://leafletjs.com/reference.html#path-options`.
+
+    In a FeatureGroupFilter with renderer='canvas', the circles are drawn in the
+    canvas of the layer instead of being one SVG element each.
     """
     def __init__(self, lat='lat', lng='lng', popup=None,
                  radius=None, radius_meter=False, **kwargs):
@@ -78,67 +101,75 @@ class CircleMarkerFunction(MacroElement):
         self._template = Template(
             '{% macro script(this, kwargs) %}'
             '{{this._parent.get_name()}}.marker_function = function (d) {return L.'
-            '{% if this.radius_meter %}circle([d["{{this.lat}}"], d["{{this.lng}}"]],{{this.radius}}'  # noqa
-            '{% else %}circleMarker([d["{{this.lat}}"], d["{{this.lng}}"]]'
+            '{% if this.radius_meter %}circle([{{this._field(this.lat)}}, {{this._field(this.lng)}}],{{this.radius}}'  # noqa
+            '{% else %}circleMarker([{{this._field(this.lat)}}, {{this._field(this.lng)}}]'
             '{% endif %},{ '
             '    {% if "stroke" in this.kwargs.keys() %}stroke: '
             '        {% if this.kwargs.get("stroke").__str__().startswith("feature.") %}'
-            '            d["{{this.kwargs.get("stroke")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("stroke")[8:])}}'
             '        {% else %}{{this.kwargs.get("stroke").__str__().lower()}}{% endif %},'
             '    {% endif %}'
 
             '    {% if "color" in this.kwargs.keys() %}color: '
             '        {% if this.kwargs.get("color").startswith("feature.") %}'
-            '            d["{{this.kwargs.get("color")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("color")[8:])}}'
             '        {% else %}"{{this.kwargs.get("color")}}"{% endif %},'
             '    {% endif %}'
 
             '    {% if "weight" in this.kwargs.keys() %}weight: '
             '        {% if this.kwargs.get("weight").__str__().startswith("feature.") %}'
-            '            d["{{this.kwargs.get("weight")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("weight")[8:])}}'
             '        {% else %}{{this.kwargs.get("weight")}}{% endif %},'
             '    {% endif %}'
 
             '    {% if "opacity" in this.kwargs.keys() %}opacity: '
             '        {% if this.kwargs.get("opacity").__str__().startswith("feature.") %}'
-            '            d["{{this.kwargs.get("opacity")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("opacity")[8:])}}'
             '        {% else %}{{this.kwargs.get("opacity")}}{% endif %},'
             '    {% endif %}'
 
             '    {% if "fill" in this.kwargs.keys() %}fill: '
             '        {% if this.kwargs.get("fill").__str__().startswith("feature.") %}'
-            '            d["{{this.kwargs.get("fill")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("fill")[8:])}}'
             '        {% else %}{{this.kwargs.get("fill").__str__().lower()}}{% endif %},'
             '    {% endif %}'
 
             '    {% if "fillColor" in this.kwargs.keys() %}fillColor: '
             '        {% if this.kwargs.get("fillColor").startswith("feature.") %}'
-            '            d["{{this.kwargs.get("fillColor")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("fillColor")[8:])}}'
             '        {% else %}"{{this.kwargs.get("fillColor")}}"{% endif %},'
             '    {% endif %}'
 
             '    {% if "fillOpacity" in this.kwargs.keys() %}fillOpacity: '
             '        {% if this.kwargs.get("fillOpacity").__str__().startswith("feature.") %}'
-            '            d["{{this.kwargs.get("fillOpacity")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("fillOpacity")[8:])}}'
             '        {% else %}{{this.kwargs.get("fillOpacity")}}{% endif %},'
             '    {% endif %}'
 
             '    {% if "fillRule" in this.kwargs.keys() %}fillRule: '
             '        {% if this.kwargs.get("fillRule").startswith("feature.") %}'
-            '            d["{{this.kwargs.get("fillRule")[8:]}}"]'
+            '            {{this._field(this.kwargs.get("fillRule")[8:])}}'
             '        {% else %}"{{this.kwargs.get("fillRule")}}"{% endif %},'
             '    {% endif %}'
 
+            '    {% if this._parent.renderer == "canvas" %}'
+            'renderer: {{this._parent.get_name()}}.renderer,{% endif %}'
             '    })'
             '{% if this.radius %}.setRadius('
-            '{% if this.radius.__str__().startswith("feature.") %}d["{{this.radius[8:]}}"]'  # noqa
+            '{% if this.radius.__str__().startswith("feature.") %}{{this._field(this.radius[8:])}}'  # noqa
             '            {% else %}{{this.radius}}{% endif %}'
             '){% endif %}'
-            '{% if this.popup %}.bindPopup(d["{{this.popup}}"]){% endif %}'
+            '{% if this.popup %}.bindPopup({{this._field(this.popup)}}){% endif %}'
             ';}'
             '{% endmacro %}'
             )
 
+    _field = _field
+
+    def _referenced_columns(self):
+        return ([self.lat, self.lng, self.popup] +
+                _feature_columns(self.radius, *self.kwargs.values()))
+
 
 class AwesomeMarkerFunction(MacroElement):
     """A circleMarker with radius specified in pixels (or in meters).
@@ -182,24 +213,24 @@ class AwesomeMarkerFunction(MacroElement):
         self._template = Template(
             '{% macro script(this, kwargs) %}'
             '{{this._parent.get_name()}}.marker_function = function (d) {'
-            '    var marker = L.marker([d["{{this.lat}}"], d["{{this.lng}}"]], { '
+            '    var marker = L.marker([{{this._field(this.lat)}}, {{this._field(this.lng)}}], { '
             '        opacity : {% if this.opacity.__str__().startswith("feature.") %}'
-            '            d["{{this.opacity[8:]}}"]{% else %}{{this.opacity}}{% endif %},'
+            '            {{this._field(this.opacity[8:])}}{% else %}{{this.opacity}}{% endif %},'
             '        })'
-            '        {% if this.popup %}.bindPopup(d["{{this.popup}}"]){% endif %}'
+            '        {% if this.popup %}.bindPopup({{this._field(this.popup)}}){% endif %}'
             '    ;'
             '    var icon = L.AwesomeMarkers.icon({'
-            '        icon : {% if this.icon.startswith("feature.") %}d["{{this.icon[8:]}}"]'
+            '        icon : {% if this.icon.startswith("feature.") %}{{this._field(this.icon[8:])}}'
             '            {% else %}"{{this.icon}}"{% endif %},'
-            '        prefix : {% if this.prefix.startswith("feature.") %}d["{{this.prefix[8:]}}"]'
+            '        prefix : {% if this.prefix.startswith("feature.") %}{{this._field(this.prefix[8:])}}'  # noqa
             '            {% else %}"{{this.prefix}}"{% endif %},'
-            '        markerColor : {% if this.marker_color.startswith("feature.") %}d["{{this.marker_color[8:]}}"]'  # noqa
+            '        markerColor : {% if this.marker_color.startswith("feature.") %}{{this._field(this.marker_color[8:])}}'  # noqa
             '            {% else %}"{{this.marker_color}}"{% endif %},'
-            '        iconColor : {% if this.icon_color.startswith("feature.") %}d["{{this.icon_color[8:]}}"]'  # noqa
+            '        iconColor : {% if this.icon_color.startswith("feature.") %}{{this._field(this.icon_color[8:])}}'  # noqa
             '            {% else %}"{{this.icon_color}}"{% endif %},'
-            '        spin : {% if this.spin.__str__().startswith("feature.") %}d["{{this.spin[8:]}}"]'  # noqa
+            '        spin : {% if this.spin.__str__().startswith("feature.") %}{{this._field(this.spin[8:])}}'  # noqa
             '            {% else %}{{this.spin.__str__().lower()}}{% endif %},'
-            '        extraClasses : {% if this.extra_classes.startswith("feature.") %}d["{{this.extra_classes[8:]}}"]'  # noqa
+            '        extraClasses : {% if this.extra_classes.startswith("feature.") %}{{this._field(this.extra_classes[8:])}}'  # noqa
             '            {% else %}"{{this.extra_classes}}"{% endif %},'
             '        });'
             '    marker.setIcon(icon);'
@@ -207,3 +238,10 @@ class AwesomeMarkerFunction(MacroElement):
             '    };'
             '{% endmacro %}'
             )  # noqa
+
+    _field = _field
+
+    def _referenced_columns(self):
+        return ([self.lat, self.lng, self.popup] +
+                _feature_columns(self.opacity, self.icon, self.prefix, self.marker_color,
+                                 self.icon_color, self.spin, self.extra_classes))
@@ -0,0 +1,1214 @@
+var crossfolium = crossfolium || {};
+
+crossfolium.typedArrays = {
+    int8: Int8Array, uint8: Uint8Array, int16: Int16Array, uint16: Uint16Array,
+    int32: Int32Array, uint32: Uint32Array, float32: Float32Array, float64: Float64Array
+    };
+
+crossfolium.bytes = function (text) {
+    // Decodes a base64 string into an Uint8Array.
+    var binary = atob(text);
+    var out = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) {out[i] = binary.charCodeAt(i);}
+    return out;
+    };
+
+crossfolium.values = function (column) {
+    // The array of values of a payload column.
+    var values = column.array;
+    if (column.base64 !== undefined) {
+        values = new crossfolium.typedArrays[column.dtype](
+            crossfolium.bytes(column.base64).buffer);
+        }
+    if (values !== undefined) {
+        if (!column.decimals && column.missing === undefined) {return values;}
+        // Fixed-point values (with 0 decimals too), column.missing standing for NaN.
+        var scaled = new Float64Array(values.length);
+        var factor = Math.pow(10, column.decimals || 0);
+        for (var j = 0; j < values.length; j++) {
+            scaled[j] = values[j] === column.missing ? NaN : values[j] / factor;
+            }
+        return scaled;
+        }
+    if (!column.codes) {return column;}
+    var codes = crossfolium.values(column.codes);
+    var out = new Array(codes.length);
+    for (var i = 0; i < out.length; i++) {
+        out[i] = column.categories[codes[i]];
+        }
+    return out;
+    };
+
+crossfolium.inflate = function (text, format) {
+    // Decompresses a base64 payload with the browser's DecompressionStream.
+    // Returns a Promise of the payload object.
+    var stream = new Blob([crossfolium.bytes(text)]).stream()
+        .pipeThrough(new DecompressionStream(format));
+    return new Response(stream).text().then(JSON.parse);
+    };
+
+crossfolium.unpack = function (buffer) {
+    // Reads a binary payload: a JSON header followed by the typed arrays.
+    var size = new DataView(buffer).getUint32(0, true);
+    var payload = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, size)));
+    var start = 4 + size + (8 - (4 + size) % 8) % 8;
+    var view = function (column) {
+        if (column === null || typeof column !== 'object' || Array.isArray(column)) {
+            return column;
+            }
+        if (column.offset !== undefined) {
+            column.array = new crossfolium.typedArrays[column.dtype](
+                buffer, start + column.offset, column.length);
+            }
+        if (column.codes) {column.codes = view(column.codes);}
+        return column;
+        };
+    for (var name in payload.columns) {payload.columns[name] = view(payload.columns[name]);}
+    return payload;
+    };
+
+crossfolium.fetch = function (url, format, compression) {
+    // Fetches a sidecar payload. Returns a Promise of the payload object.
+    return fetch(url).then(function (response) {
+        if (!response.ok) {throw new Error('Cannot load ' + url + ': ' + response.status);}
+        var stream = response.body;
+        if (compression) {stream = stream.pipeThrough(new DecompressionStream(compression));}
+        return new Response(stream).arrayBuffer();
+        }).then(function (buffer) {
+            if (format === 'binary') {return crossfolium.unpack(buffer);}
+            return JSON.parse(new TextDecoder().decode(buffer));
+            });
+    };
+
+crossfolium.records = function (payload) {
+    var names = Object.keys(payload.columns);
+    var values = names.map(function (name) {
+        return crossfolium.values(payload.columns[name]);
+        });
+    var data = new Array(payload.length);
+    for (var i = 0; i < payload.length; i++) {
+        var d = {};
+        for (var j = 0; j < names.length; j++) {
+            d[names[j]] = values[j][i];
+            }
+        data[i] = d;
+        }
+    return data;
+    };
+
+crossfolium.numbers = function (values) {
+    // A plain array of numbers (and nulls) as a Float64Array, the nulls being NaN.
+    // Other arrays are returned as they are.
+    if (!Array.isArray(values)) {return values;}
+    for (var i = 0; i < values.length; i++) {
+        if (values[i] !== null && typeof values[i] !== 'number') {return values;}
+        }
+    return Float64Array.from(values, function (v) {return v === null ? NaN : v;});
+    };
+
+crossfolium.columnStore = function (payload) {
+    // The columns of a payload by name, for store='columns': each column is
+    // decoded when first read, the numeric ones into typed arrays (Float64Array
+    // unless the payload has a narrower dtype).
+    var store = {};
+    Object.keys(payload.columns).forEach(function (name) {
+        Object.defineProperty(store, name, {
+            configurable: true,
+            enumerable: true,
+            get: function () {
+                var values = crossfolium.numbers(crossfolium.values(payload.columns[name]));
+                Object.defineProperty(store, name, {value: values, enumerable: true});
+                return values;
+                }
+            });
+        });
+    return store;
+    };
+
+crossfolium.rowIds = function (length) {
+    // The records of store='columns': the row ids 0 .. length - 1.
+    var ids = new Array(length);
+    for (var i = 0; i < length; i++) {ids[i] = i;}
+    return ids;
+    };
+
+crossfolium.field = function (cf, column) {
+    // The accessor record -> value of a column: d[column], or the value of the
+    // column at the row id with store='columns'.
+    if (cf.store !== 'columns') {return function (d) {return d[column];};}
+    var values = null;
+    return function (i) {
+        if (values === null) {values = cf.col[column];}
+        return values[i];
+        };
+    };
+
+crossfolium.rows = function (payload) {
+    // A function row id -> record, for the worker engine: the records are only
+    // built when first asked for (by the map layers), then kept.
+    var names = Object.keys(payload.columns), values = null;
+    var rows = new Array(payload.length);
+    return function (i) {
+        if (rows[i] === undefined) {
+            if (values === null) {
+                values = names.map(function (name) {
+                    return crossfolium.values(payload.columns[name]);
+                    });
+                }
+            var d = {};
+            for (var j = 0; j < names.length; j++) {d[names[j]] = values[j][i];}
+            rows[i] = d;
+            }
+        return rows[i];
+        };
+    };
+
+crossfolium.reduce = function (group, cf, weight, measures) {
+    // Sets the reducer of a group: the sum of the `weight` column (if any) times
+    // the record counts (if the rows were collapsed), or the number of records.
+    // If `measures` are given, the group computes them (see crossfolium.measures).
+    var count = cf.count;
+    if (group.reduceColumns) {return group.reduceColumns(weight, count, measures);}
+    if (measures) {
+        return crossfolium.measures(group, measures, function (column, kind) {
+            return kind === 'distinct' ? crossfolium.key(cf, column) :
+                crossfolium.field(cf, column);
+            }, count ? crossfolium.field(cf, count) : null);
+        }
+    if (weight && count) {
+        var w = crossfolium.field(cf, weight), c = crossfolium.field(cf, count);
+        return group.reduceSum(function (d) {return w(d) * c(d);});
+        }
+    if (weight || count) {
+        return group.reduceSum(crossfolium.field(cf, weight || count));
+        }
+    return group.reduceCount();
+    };
+
+crossfolium.Heap = function (less) {
+    // A binary heap, whose top is the least item by `less`.
+    this.items = [];
+    this.less = less;
+    };
+crossfolium.Heap.prototype.size = function () {return this.items.length;};
+crossfolium.Heap.prototype.peek = function () {return this.items[0];};
+crossfolium.Heap.prototype.push = function (item) {
+    var items = this.items, i = items.length;
+    items.push(item);
+    while (i > 0) {
+        var parent = (i - 1) >> 1;
+        if (!this.less(items[i], items[parent])) {break;}
+        items[i] = items[parent];
+        items[parent] = item;
+        i = parent;
+        }
+    };
+crossfolium.Heap.prototype.pop = function () {
+    var items = this.items, top = items[0], last = items.pop();
+    if (items.length) {
+        items[0] = last;
+        var i = 0;
+        while (true) {
+            var left = 2 * i + 1, right = left + 1, least = i;
+            if (left < items.length && this.less(items[left], items[least])) {least = left;}
+            if (right < items.length && this.less(items[right], items[least])) {least = right;}
+            if (least === i) {break;}
+            items[i] = items[least];
+            items[least] = last;
+            i = least;
+            }
+        }
+    return top;
+    };
+
+crossfolium.measures = function (group, measures, read, count) {
+    // Reduces a group to several measures in one pass: `measures` is a list of
+    // {name, kind, column}, kind being 'count', 'sum', 'mean', 'min', 'max' or
+    // 'distinct'. read(column, kind) gives the accessor record -> value of a
+    // column, and `count` the one of the record counts (null if the rows were not
+    // collapsed). The value of a key is {name: measure}, updated as the records
+    // enter and leave the filters: min and max keep a heap of the values and
+    // their multiplicities, distinct the multiplicities, so that removing a
+    // record does not scan the others. Missing values are skipped.
+    var accessors = measures.map(function (m) {
+        return m.kind === 'count' ? null : read(m.column, m.kind);
+        });
+    var less = function (a, b) {return a < b;};
+    var more = function (a, b) {return a > b;};
+    var init = function () {
+        var p = {};
+        var state = measures.map(function (m) {
+            p[m.name] = m.kind === 'min' || m.kind === 'max' ? null : 0;
+            if (m.kind === 'mean') {return {sum: 0, count: 0};}
+            if (m.kind === 'distinct') {return new Map();}
+            if (m.kind === 'min' || m.kind === 'max') {
+                return {counts: new Map(), heaped: new Set(),
+                        heap: new crossfolium.Heap(m.kind === 'min' ? less : more)};
+                }
+            return null;
+            });
+        // Not enumerable: the charts (and the worker's messages) only see the measures.
+        Object.defineProperty(p, 'state', {value: state});
+        return p;
+        };
+    var update = function (p, d, sign) {
+        var c = count ? count(d) : 1;
+        for (var j = 0; j < measures.length; j++) {
+            var m = measures[j], s = p.state[j];
+            if (m.kind === 'count') {
+                p[m.name] += sign * c;
+                continue;
+                }
+            var v = accessors[j](d);
+            if (v === null || v === undefined || v !== v) {continue;}
+            if (m.kind === 'sum') {
+                p[m.name] += sign * c * v;
+            } else if (m.kind === 'mean') {
+                s.sum += sign * c * v;
+                s.count += sign * c;
+                p[m.name] = s.count ? s.sum / s.count : 0;
+            } else if (m.kind === 'distinct') {
+                var k = (s.get(v) || 0) + sign;
+                if (k > 0) {s.set(v, k);} else {s.delete(v);}
+                p[m.name] = s.size;
+            } else {
+                var n = (s.counts.get(v) || 0) + sign;
+                if (n > 0) {s.counts.set(v, n);} else {s.counts.delete(v);}
+                if (n > 0 && !s.heaped.has(v)) {
+                    s.heap.push(v);
+                    s.heaped.add(v);
+                    }
+                // The values that left are only dropped when they come on top.
+                while (s.heap.size() && !s.counts.has(s.heap.peek())) {
+                    s.heaped.delete(s.heap.pop());
+                    }
+                p[m.name] = s.heap.size() ? s.heap.peek() : null;
+                }
+            }
+        return p;
+        };
+    var first = measures[0].name;
+    return group.reduce(function (p, d) {return update(p, d, 1);},
+                        function (p, d) {return update(p, d, -1);},
+                        init)
+        .order(function (p) {return p[first];});
+    };
+
+crossfolium.title = function (label, value) {
+    // The title of a chart element: "label: value", or one line per measure.
+    if (value === null || typeof value !== 'object') {return label + ': ' + value;}
+    return [label].concat(Object.keys(value).map(function (name) {
+        return name + ': ' + value[name];
+        })).join('\n');
+    };
+
+crossfolium.key = function (cf, column) {
+    // The dimension accessor of a column: the integer code of dictionary-encoded
+    // columns, and the value itself otherwise. Its `column` attribute tells the
+    // worker engine which column to read.
+    var accessor;
+    if (cf.store === 'columns') {
+        // The codes of a dictionary-encoded column are read as they are.
+        var codes = null;
+        accessor = function (i) {
+            if (codes === null) {
+                var encoded = cf.payload.columns[column];
+                codes = encoded.codes ? crossfolium.values(encoded.codes) : cf.col[column];
+                }
+            return codes[i];
+            };
+    } else if (!cf.categories[column]) {
+        accessor = function (d) {return d[column];};
+    } else {
+        var encode = crossfolium.code(cf, column);
+        accessor = function (d) {return encode(d[column]);};
+        }
+    accessor.column = column;
+    return accessor;
+    };
+
+crossfolium.dimension = function (cf, name, accessor) {
+    // The dimension of an element on the column `name`, read with crossfolium.key
+    // unless `accessor` is given. Each element has its own dimension, unless
+    // cf.registry.shared (share_dimensions): the elements on the same column then
+    // share the one dimension registered under `name`, each filtering it through
+    // its own view, and a record passes if it passes the filters of all the views.
+    // As crossfilter groups ignore the filters of their dimension, these elements
+    // don't filter each other's charts. With a worker engine, each element has its
+    // own dimension.
+    var make = function () {
+        return cf.crossfilter.dimension(accessor || crossfolium.key(cf, name));
+        };
+    if (cf.engine || !cf.registry.shared) {return make();}
+    var entry = cf.registry.dimensions[name];
+    if (entry === undefined) {
+        entry = cf.registry.dimensions[name] = {name: name, dimension: make(), views: []};
+        }
+    var view = new crossfolium.DimensionView(entry);
+    entry.views.push(view);
+    return view;
+    };
+
+crossfolium.group = function (cf, dimension, weight, measures) {
+    // The group of a registry dimension reduced by crossfolium.reduce, shared by
+    // the elements on the same dimension with the same weight and measures.
+    if (!dimension.entry) {
+        return crossfolium.reduce(dimension.group(), cf, weight, measures);
+        }
+    var key = JSON.stringify([dimension.entry.name, weight || null, measures || null]);
+    if (cf.registry.groups[key] === undefined) {
+        cf.registry.groups[key] = crossfolium.reduce(dimension.group(), cf, weight, measures);
+        }
+    return cf.registry.groups[key];
+    };
+
+crossfolium.DimensionView = function (entry) {
+    this.entry = entry;
+    this.call = null;  // The filter of the view: [method, argument] of the dimension.
+    this.test = null;  // The same filter, as a function of the key.
+    };
+crossfolium.DimensionView.prototype.apply = function (method, argument, test) {
+    // Sets the filter of the view, then filters the dimension on the filters of
+    // all its views: the one filter as it is (crossfilter's filterExact and
+    // filterRange are faster than a filterFunction), or all of them at once.
+    this.call = method === null ? null : [method, argument];
+    this.test = test;
+    var active = this.entry.views.filter(function (view) {return view.call !== null;});
+    var dimension = this.entry.dimension;
+    if (active.length === 0) {
+        dimension.filterAll();
+    } else if (active.length === 1) {
+        dimension[active[0].call[0]](active[0].call[1]);
+    } else {
+        dimension.filterFunction(function (key) {
+            for (var j = 0; j < active.length; j++) {
+                if (!active[j].test(key)) {return false;}
+                }
+            return true;
+            });
+        }
+    return this;
+    };
+crossfolium.DimensionView.prototype.filter = function (filter) {
+    if (filter === null || filter === undefined) {return this.filterAll();}
+    if (Array.isArray(filter)) {return this.filterRange(filter);}
+    if (typeof filter === 'function') {return this.filterFunction(filter);}
+    return this.filterExact(filter);
+    };
+crossfolium.DimensionView.prototype.filterAll = function () {
+    return this.apply(null, null, null);
+    };
+crossfolium.DimensionView.prototype.filterExact = function (value) {
+    return this.apply('filterExact', value, function (key) {return key === value;});
+    };
+crossfolium.DimensionView.prototype.filterRange = function (range) {
+    return this.apply('filterRange', range, function (key) {
+        return key >= range[0] && key < range[1];
+        });
+    };
+crossfolium.DimensionView.prototype.filterFunction = function (f) {
+    return this.apply('filterFunction', f, f);
+    };
+crossfolium.DimensionView.prototype.filterRanges = function (ranges, slack) {
+    var span = crossfolium.rangeSpan(ranges, slack);
+    if (span !== null) {return this.filterRange(span);}
+    return this.filterFunction(crossfolium.inRanges(ranges));
+    };
+crossfolium.DimensionView.prototype.group = function (key) {
+    return this.entry.dimension.group(key);
+    };
+crossfolium.DimensionView.prototype.top = function (k) {
+    return this.entry.dimension.top(k);
+    };
+crossfolium.DimensionView.prototype.bottom = function (k) {
+    return this.entry.dimension.bottom(k);
+    };
+
+crossfolium.code = function (cf, column) {
+    // Maps a value of a column to its dimension key.
+    var categories = cf.categories[column];
+    if (!categories) {return function (value) {return value;};}
+    var codes = {};
+    for (var i = 0; i < categories.length; i++) {codes[categories[i]] = i;}
+    return function (value) {return codes[value];};
+    };
+
+crossfolium.label = function (cf, column) {
+    // Maps a dimension key of a column back to its value.
+    var categories = cf.categories[column];
+    if (!categories) {return function (key) {return key;};}
+    return function (key) {return categories[key];};
+    };
+
+crossfolium.syncLayers = function (layer, shown, records, make, batch) {
+    // Makes `layer` hold one marker per record, adding and removing only the
+    // records that entered or left since the previous call. `shown` is the
+    // Map record -> marker returned by the previous call. With `batch`, the
+    // changes go through addLayers/removeLayers (as in L.MarkerClusterGroup).
+    var next = new Map(), added = [], removed = [];
+    for (var i = 0; i < records.length; i++) {
+        var d = records[i], marker = shown.get(d);
+        if (marker === undefined) {
+            marker = make(d);
+            added.push(marker);
+        } else {
+            shown.delete(d);
+            }
+        next.set(d, marker);
+        }
+    shown.forEach(function (marker) {removed.push(marker);});
+    if (batch) {
+        if (removed.length) {layer.removeLayers(removed);}
+        if (added.length) {layer.addLayers(added);}
+    } else {
+        for (var j = 0; j < removed.length; j++) {layer.removeLayer(removed[j]);}
+        for (var k = 0; k < added.length; k++) {layer.addLayer(added[k]);}
+        }
+    return next;
+    };
+
+crossfolium.filtered = function (cf) {
+    // The records that pass all the filters.
+    if (cf.engine) {return cf.engine.records();}
+    if (cf.crossfilter.allFiltered) {return cf.crossfilter.allFiltered();}
+    return cf.allDim.top(Infinity);
+    };
+
+// The dc chart groups of the Crossfilters of the page: each Crossfilter has its
+// charts in the group named after it.
+crossfolium.groups = crossfolium.groups || [];
+
+crossfolium.bus = function (cf) {
+    // Lets map layers (and co) follow the filters: cf.subscribe(listener) has
+    // listener(records) called with the filtered records on each dc render or
+    // redraw, the records being computed once for all the listeners.
+    // cf.subscribe(listener, false) has listener() called without the records,
+    // which are then not computed for it.
+    var listeners = [], last = null, rendered = false;
+    cf.subscribe = function (listener, records) {
+        listeners.push({call: listener, records: records !== false});
+        if (records !== false && cf.engine) {cf.engine.track();}
+        if (rendered) {listener(records !== false ? crossfolium.filtered(cf) : undefined);}
+        };
+    cf.notify = function () {
+        rendered = true;
+        last = null;
+        for (var i = 0; i < listeners.length; i++) {
+            if (listeners[i].records && last === null) {last = crossfolium.filtered(cf);}
+            listeners[i].call(listeners[i].records ? last : undefined);
+            }
+        };
+    dc.registerChart({render: cf.notify, redraw: cf.notify, filterAll: function () {}},
+                     cf.group);
+    crossfolium.groups.push(cf.group);
+    };
+
+crossfolium.schedule = function (group, delay) {
+    // Coalesces the redraws of a dc chart group: dc.redrawAll(group), which dc
+    // charts call on each filter change, only schedules one redraw. It happens on
+    // the next animation frame if delay is 0, and `delay` ms after the last
+    // call otherwise. While the group is held (see crossfolium.hold), the
+    // redraws wait for it to be released.
+    if (!crossfolium.redrawNow) {
+        crossfolium.redrawNow = dc.redrawAll;
+        crossfolium.delays = {};
+        dc.redrawAll = function (group) {
+            var state = crossfolium.delays[group];
+            if (state === undefined) {return crossfolium.redrawNow(group);}
+            if (!state.held) {crossfolium.requestRedraw(group);}
+            };
+        }
+    crossfolium.delays[group] = {delay: delay, pending: null, held: false};
+    };
+
+crossfolium.hold = function (group, held) {
+    // Holds (or releases) the redraws of a scheduled chart group, while a worker
+    // engine computes the results of a filter change. Releasing it redraws.
+    var state = crossfolium.delays[group];
+    state.held = held;
+    if (!held) {crossfolium.requestRedraw(group);}
+    };
+
+crossfolium.requestRedraw = function (group) {
+    var state = crossfolium.delays[group];
+    var redraw = function () {
+        state.pending = null;
+        crossfolium.redrawNow(group);
+        };
+    if (state.delay > 0) {
+        clearTimeout(state.pending);
+        state.pending = setTimeout(redraw, state.delay);
+    } else if (state.pending === null) {
+        state.pending = typeof requestAnimationFrame === 'function' ?
+            requestAnimationFrame(redraw) : setTimeout(redraw, 16);
+        }
+    };
+
+crossfolium.mercator = function (lat, lng) {
+    // Web mercator coordinates in [0, 1], as in crossfolium.spatial.mercator.
+    lat = Math.max(-85.0511287798, Math.min(85.0511287798, lat));
+    var y = 0.5 - Math.log(Math.tan(Math.PI / 4 + lat * Math.PI / 360)) / (2 * Math.PI);
+    return [(lng + 180) / 360, y];
+    };
+
+crossfolium.mortonCover = function (bounds, level, cells) {
+    // The sorted ranges [start, end) of the Morton codes (see
+    // crossfolium.spatial.morton_codes) of the tiles that cover a
+    // L.LatLngBounds. The tiles are at most 1 / `cells` of the bounds wide, so
+    // that the cover exceeds the bounds by at most that much.
+    var sw = crossfolium.mercator(bounds.getSouth(), Math.max(bounds.getWest(), -180));
+    var ne = crossfolium.mercator(bounds.getNorth(), Math.min(bounds.getEast(), 180));
+    var span = Math.max(ne[0] - sw[0], sw[1] - ne[1], 1e-12);
+    var zoom = Math.max(0, Math.min(level, Math.floor(Math.log(cells / span) / Math.LN2)));
+    var size = Math.pow(2, zoom), last = size - 1;
+    var x0 = Math.max(0, Math.floor(sw[0] * size));
+    var x1 = Math.min(last, Math.floor(ne[0] * size));
+    var y0 = Math.max(0, Math.floor(ne[1] * size));
+    var y1 = Math.min(last, Math.floor(sw[1] * size));
+    var ranges = [];
+    var visit = function (x, y, z, code) {
+        // The tile (x, y) at zoom z spans [x * k, (x + 1) * k) tiles at `zoom`.
+        var k = Math.pow(2, zoom - z);
+        if (x * k > x1 || (x + 1) * k - 1 < x0 || y * k > y1 || (y + 1) * k - 1 < y0) {
+            return;
+            }
+        var inside = x * k >= x0 && (x + 1) * k - 1 <= x1 &&
+            y * k >= y0 && (y + 1) * k - 1 <= y1;
+        if (inside || z === zoom) {
+            var width = Math.pow(4, level - z), start = code * width;
+            var previous = ranges[ranges.length - 1];
+            if (previous && previous[1] === start) {
+                previous[1] = start + width;
+            } else {
+                ranges.push([start, start + width]);
+                }
+            return;
+            }
+        for (var child = 0; child < 4; child++) {
+            visit(2 * x + child % 2, 2 * y + (child >> 1), z + 1, 4 * code + child);
+            }
+        };
+    visit(0, 0, 0, 0);
+    return ranges;
+    };
+
+crossfolium.inRanges = function (ranges) {
+    // A filter function keeping the values in the sorted ranges [start, end).
+    return function (value) {
+        var low = 0, high = ranges.length - 1;
+        while (low <= high) {
+            var mid = (low + high) >> 1;
+            if (value < ranges[mid][0]) {
+                high = mid - 1;
+            } else if (value >= ranges[mid][1]) {
+                low = mid + 1;
+            } else {
+                return true;
+                }
+            }
+        return false;
+        };
+    };
+
+crossfolium.rangeSpan = function (ranges, slack) {
+    // The range [start, end) from the first to the last of the sorted ranges, if
+    // it is at most (1 + slack) times as long as all of them together, and
+    // null otherwise.
+    if (!ranges.length) {return null;}
+    var length = 0;
+    for (var i = 0; i < ranges.length; i++) {length += ranges[i][1] - ranges[i][0];}
+    var span = [ranges[0][0], ranges[ranges.length - 1][1]];
+    return span[1] - span[0] <= (1 + (slack || 0)) * length ? span : null;
+    };
+
+crossfolium.filterRanges = function (dimension, ranges, slack) {
+    // Filters a dimension on the sorted ranges [start, end) of its keys. If
+    // their span is short enough (see crossfolium.rangeSpan), the dimension is
+    // filtered on the span with filterRange, which crossfilter updates with
+    // the records that enter or leave it. Otherwise it takes a filter
+    // function, which crossfilter calls on every record at each change.
+    if (dimension.filterRanges) {return dimension.filterRanges(ranges, slack);}
+    var span = crossfolium.rangeSpan(ranges, slack);
+    if (span !== null) {return dimension.filterRange(span);}
+    return dimension.filterFunction(crossfolium.inRanges(ranges));
+    };
+
+crossfolium.gridClusters = function (cf, dimension, lat, lng, level, offset, weight) {
+    // Clusters the records on the grid of their Morton codes (the keys of
+    // `dimension`, at zoom `level`): at map zoom z, the records whose tiles at
+    // zoom z + offset are the same (see crossfolium.spatial.parent_codes).
+    // Returns a function zoom -> [{count, weight, lat, lng, record}], count being
+    // the number of records (times the count column of collapsed rows), weight
+    // the sum of the `weight` column (if any, else the count), lat/lng the
+    // centroid, and record the only record of the cluster (if so). The clusters
+    // are reduced by one crossfilter group, which follows the filters, for the
+    // last zoom asked.
+    var group = null, current = null, ids = null;
+    var count = cf.count ? crossfolium.field(cf, cf.count) : null;
+    var w = weight ? crossfolium.field(cf, weight) : null;
+    var y = crossfolium.field(cf, lat), x = crossfolium.field(cf, lng);
+    var update = function (p, d, sign) {
+        var c = count ? count(d) : 1;
+        p.n += sign; p.count += sign * c;
+        p.weight += sign * (w ? c * w(d) : c);
+        p.lat += sign * c * y(d); p.lng += sign * c * x(d);
+        p.id ^= ids.get(d);
+        return p;
+        };
+    var add = function (p, d) {return update(p, d, 1);};
+    var remove = function (p, d) {return update(p, d, -1);};
+    var init = function () {return {n: 0, count: 0, weight: 0, lat: 0, lng: 0, id: 0};};
+    return function (zoom) {
+        var z = Math.min(level, zoom + offset);
+        if (z !== current) {
+            if (ids === null && cf.store === 'columns') {
+                ids = {get: function (i) {return i;}};
+            } else if (ids === null) {
+                // The index of each record: with the xor of the indices of its
+                // records, a cluster of one record knows which one it is.
+                ids = new Map();
+                cf.data.forEach(function (d, i) {ids.set(d, i);});
+                }
+            if (group !== null) {(group.dispose || group.remove).call(group);}
+            var size = Math.pow(4, level - z);
+            group = dimension.group(function (code) {return Math.floor(code / size);})
+                .reduce(add, remove, init);
+            current = z;
+            }
+        var out = [];
+        group.all().forEach(function (g) {
+            var p = g.value;
+            if (g.key < 0 || p.n <= 0) {return;}
+            out.push({count: p.count, weight: p.weight, lat: p.lat / p.count,
+                      lng: p.lng / p.count, record: p.n === 1 ? cf.data[p.id] : null});
+            });
+        return out;
+        };
+    };
+
+crossfolium.clusterMarker = function (cluster, map) {
+    // A marker showing the count of a cluster, in the style of Leaflet.markercluster.
+    var size = cluster.count < 10 ? 'small' : cluster.count < 100 ? 'medium' : 'large';
+    var marker = L.marker([cluster.lat, cluster.lng], {icon: L.divIcon({
+        html: '<div><span>' + cluster.count + '</span></div>',
+        className: 'marker-cluster marker-cluster-' + size,
+        iconSize: L.point(40, 40)
+        })});
+    marker.on('click', function () {map.setView(marker.getLatLng(), map.getZoom() + 2);});
+    return marker;
+    };
+
+crossfolium.heatMax = function (map, latlngs, options) {
+    // The largest intensity of the cells of a leaflet.heat layer with these
+    // options, for the points [lat, lng, intensity] in the map bounds. Like
+    // leaflet.heat, the points are summed on a grid of (radius + blur) / 2
+    // pixels, their intensity (1 if none) halved for each zoom below maxZoom (up
+    // to 12 times). Setting it as the `max` of the layer scales its colors to the
+    // data, rather than saturating the cells above 1.
+    var zoom = map.getZoom(), bounds = map.getBounds(), size = (options.radius + options.blur) / 2;
+    var scale = 1 / Math.pow(2, Math.max(0, Math.min(options.maxZoom - zoom, 12)));
+    var cells = {}, max = 0;
+    for (var i = 0; i < latlngs.length; i++) {
+        var ll = latlngs[i];
+        if (!bounds.contains([ll[0], ll[1]])) {continue;}
+        var p = map.project([ll[0], ll[1]], zoom);
+        var key = Math.floor(p.x / size) + ':' + Math.floor(p.y / size);
+        var sum = (cells[key] || 0) + scale * (ll.length > 2 ? +ll[2] : 1);
+        cells[key] = sum;
+        if (sum > max) {max = sum;}
+        }
+    return max || 1;
+    };
+
+crossfolium.hexagon = function (id, size) {
+    // The corners [lat, lng] of a hexagon of crossfolium.spatial.hex_ids.
+    var stride = 67108864;  // crossfolium.spatial.HEX_STRIDE
+    var r = Math.floor(id / stride), q = id - r * stride - stride / 2;
+    var x = size * Math.sqrt(3) * (q + r / 2), y = size * 1.5 * r;
+    var corners = [];
+    for (var k = 0; k < 6; k++) {
+        var angle = Math.PI / 3 * k - Math.PI / 6;
+        var cx = x + size * Math.cos(angle), cy = y + size * Math.sin(angle);
+        var lat = Math.atan(Math.sinh(Math.PI * (1 - 2 * cy))) * 180 / Math.PI;
+        corners.push([lat, cx * 360 - 180]);
+        }
+    return corners;
+    };
+
+crossfolium.canvas = function (map) {
+    // The canvas renderer shared by the layers of a map. Without one (Leaflet
+    // before 1.0), the layers keep Leaflet's default renderer.
+    if (!L.canvas) {return undefined;}
+    if (!map._crossfoliumCanvas) {map._crossfoliumCanvas = L.canvas();}
+    return map._crossfoliumCanvas;
+    };
+
+crossfolium.MarkerCache = function (make, size) {
+    // The markers made by `make`, one per record, the least recently used being
+    // dropped beyond `size` markers (null for no bound).
+    this.make = make;
+    this.size = size;
+    this.markers = new Map();
+    };
+crossfolium.MarkerCache.prototype.get = function (d) {
+    var marker = this.markers.get(d);
+    if (marker === undefined) {
+        marker = this.make(d);
+    } else {
+        this.markers.delete(d);
+        }
+    this.markers.set(d, marker);
+    if (this.size !== null && this.markers.size > this.size) {
+        this.markers.delete(this.markers.keys().next().value);
+        }
+    return marker;
+    };
+crossfolium.MarkerCache.prototype.clear = function () {
+    this.markers.clear();
+    };
+
+crossfolium.cacheMarkers = function (layer, size) {
+    // Gives a map layer a cache (layer.markers) of the markers made by its
+    // marker_function. Assigning another marker_function calls layer.invalidate.
+    var make = layer.marker_function;
+    layer.markers = new crossfolium.MarkerCache(function (d) {return make(d);}, size);
+    Object.defineProperty(layer, 'marker_function', {
+        get: function () {return make;},
+        set: function (f) {make = f; layer.invalidate();}
+        });
+    };
+
+crossfolium.Table = function (root, dimension, columns, options) {
+    // A dc chart showing the first options.size records of a dimension that pass
+    // the filters, in the order of its keys. The records are read with
+    // dimension.bottom(k) (or top(k) if not options.ascending), k going up to
+    // the end of the current page: options.pageSize records per page. With
+    // options.visibleRows, the page scrolls and only the rows in view (of
+    // options.rowHeight pixels) are in the DOM.
+    var self = this;
+    this.dimension = dimension;
+    this.columns = columns;
+    this.size = options.size;
+    this.ascending = options.ascending;
+    this.pageSize = Math.min(options.pageSize || options.size, options.size);
+    this.visibleRows = options.visibleRows || null;
+    this.rowHeight = options.rowHeight;
+    this.page = 0;
+    this.rows = [];
+    this.more = false;
+    this.pending = false;
+    this.body = root.querySelector('tbody');
+    this.scroller = root.querySelector('.crossfolium-table-body');
+    this.pager = root.querySelector('.crossfolium-table-pager');
+    if (this.visibleRows !== null) {
+        this.scroller.addEventListener('scroll', function () {
+            if (self.pending) {return;}
+            self.pending = true;
+            requestAnimationFrame(function () {
+                self.pending = false;
+                self.update();
+                });
+            });
+        }
+    if (this.pager) {
+        this.pager.querySelector('.previous').addEventListener('click', function () {
+            self.show(self.page - 1);
+            });
+        this.pager.querySelector('.next').addEventListener('click', function () {
+            self.show(self.page + 1);
+            });
+        }
+    };
+crossfolium.Table.prototype.render = function () {
+    // One more record than the page tells whether there is a next page.
+    var end = (this.page + 1) * this.pageSize;
+    var k = Math.min(this.size, end + 1);
+    this.rows = this.ascending ? this.dimension.bottom(k) : this.dimension.top(k);
+    this.more = this.rows.length > end && end < this.size;
+    this.rows = this.rows.slice(this.page * this.pageSize, end);
+    if (this.rows.length === 0 && this.page > 0) {return this.show(0);}
+    this.update();
+    };
+crossfolium.Table.prototype.redraw = crossfolium.Table.prototype.render;
+crossfolium.Table.prototype.filterAll = function () {};
+crossfolium.Table.prototype.show = function (page) {
+    this.page = Math.max(0, page);
+    if (this.scroller) {this.scroller.scrollTop = 0;}
+    this.render();
+    };
+crossfolium.Table.prototype.update = function () {
+    // Writes the rows in view, between two spacer rows of the height of the
+    // rows out of view.
+    var first = 0, last = this.rows.length;
+    if (this.visibleRows !== null) {
+        first = Math.max(0, Math.floor(this.scroller.scrollTop / this.rowHeight) - 2);
+        last = Math.min(this.rows.length, first + this.visibleRows + 4);
+        }
+    var body = this.body;
+    while (body.firstChild) {body.removeChild(body.firstChild);}
+    var spacer = function (rows) {
+        if (rows <= 0) {return;}
+        var tr = document.createElement('tr'), td = document.createElement('td');
+        tr.className = 'spacer';
+        td.colSpan = this.columns.length;
+        td.style.height = rows * this.rowHeight + 'px';
+        tr.appendChild(td);
+        body.appendChild(tr);
+        }.bind(this);
+    spacer(first);
+    for (var i = first; i < last; i++) {
+        var tr = document.createElement('tr');
+        for (var j = 0; j < this.columns.length; j++) {
+            var td = document.createElement('td'), value = this.columns[j](this.rows[i]);
+            td.textContent = value === null || value === undefined ? '' : value;
+            tr.appendChild(td);
+            }
+        body.appendChild(tr);
+        }
+    spacer(this.rows.length - last);
+    if (this.pager) {
+        var start = this.page * this.pageSize;
+        this.pager.querySelector('.range').textContent = this.rows.length ?
+            (start + 1) + '-' + (start + this.rows.length) : '0';
+        this.pager.querySelector('.previous').disabled = this.page === 0;
+        this.pager.querySelector('.next').disabled = !this.more;
+        }
+    };
+
+crossfolium.workerMain = function () {
+    // The Web Worker of crossfolium.Engine, run after crossfilter and this runtime
+    // are imported. The records of its crossfilter are the row ids, which the
+    // dimensions and reducers read the payload columns with.
+    var ndx = crossfilter([]), rows = ndx.dimension(function (i) {return i;});
+    var columns = {}, keys = {}, dimensions = {}, groups = {}, track = false;
+    var reader = function (name) {
+        // The accessor row id -> key of a column (its code if dictionary-encoded).
+        var values = null;
+        return function (i) {
+            if (values === null) {
+                if (keys[name] === undefined) {
+                    var column = columns[name];
+                    keys[name] = crossfolium.values(column.codes || column);
+                    }
+                values = keys[name];
+                }
+            return values[i];
+            };
+        };
+    var matcher = function (filters) {
+        // Keeps the keys equal to one of the {value} or in one of the {range}.
+        return function (key) {
+            for (var j = 0; j < filters.length; j++) {
+                var f = filters[j];
+                if (f.range ? key >= f.range[0] && key < f.range[1] : key === f.value) {
+                    return true;
+                    }
+                }
+            return false;
+            };
+        };
+    var results = function (seq) {
+        // Posts the results of all the groups, and the filtered row ids if tracked.
+        var out = {type: 'results', seq: seq, size: ndx.size(), groups: {}}, transfer = [];
+        Object.keys(groups).forEach(function (id) {
+            var group = groups[id];
+            if (!group.all) {
+                out.groups[id] = group.value();
+                return;
+                }
+            var all = group.all();
+            var numeric = all.every(function (g) {return typeof g.key === 'number';});
+            // The values are objects with measures (see crossfolium.measures).
+            var scalar = all.every(function (g) {return typeof g.value === 'number';});
+            var k = numeric ? new Float64Array(all.length) : new Array(all.length);
+            var v = scalar ? new Float64Array(all.length) : new Array(all.length);
+            for (var j = 0; j < all.length; j++) {
+                k[j] = all[j].key;
+                v[j] = all[j].value;
+                }
+            out.groups[id] = {keys: k, values: v};
+            if (scalar) {transfer.push(v.buffer);}
+            if (numeric) {transfer.push(k.buffer);}
+            });
+        if (track) {
+            out.filtered = new Uint32Array(rows.top(Infinity));
+            transfer.push(out.filtered.buffer);
+            }
+        self.postMessage(out, transfer);
+        };
+    var dispose = function (x) {(x.dispose || x.remove).call(x);};
+    var handlers = {
+        init: function (m) {
+            columns = m.payload.columns;
+            var ids = new Array(m.payload.length);
+            for (var i = 0; i < ids.length; i++) {ids[i] = i;}
+            ndx.add(ids);
+            },
+        dimension: function (m) {
+            dimensions[m.id] = m.column === null ? rows : ndx.dimension(reader(m.column));
+            },
+        group: function (m) {
+            if (groups[m.id]) {dispose(groups[m.id]);}
+            var group = m.dimension === null ? ndx.groupAll() : dimensions[m.dimension].group();
+            var weight = m.weight ? reader(m.weight) : null;
+            var count = m.count ? reader(m.count) : null;
+            if (m.measures) {
+                crossfolium.measures(group, m.measures, reader, count);
+            } else if (weight || count) {
+                group.reduceSum(function (i) {
+                    return (weight ? weight(i) : 1) * (count ? count(i) : 1);
+                    });
+            } else {
+                group.reduceCount();
+                }
+            groups[m.id] = group;
+            },
+        filter: function (m) {
+            var dimension = dimensions[m.dimension];
+            var single = m.filters && m.filters.length === 1 ? m.filters[0] : null;
+            if (m.filters === null) {
+                dimension.filterAll();
+            } else if (m.sorted) {
+                crossfolium.filterRanges(dimension, m.filters, m.slack);
+            } else if (single && single.range) {
+                dimension.filterRange(single.range);
+            } else if (single) {
+                dimension.filterExact(single.value);
+            } else {
+                dimension.filterFunction(matcher(m.filters));
+                }
+            },
+        dispose: function (m) {
+            if (m.group !== undefined) {
+                dispose(groups[m.group]);
+                delete groups[m.group];
+            } else {
+                dispose(dimensions[m.dimension]);
+                delete dimensions[m.dimension];
+                }
+            },
+        track: function () {track = true;},
+        flush: function (m) {results(m.seq);}
+        };
+    self.onmessage = function (event) {handlers[event.data.type](event.data);};
+    };
+
+crossfolium.Engine = function (cf, url) {
+    // Hosts the crossfilter of `cf` in a Web Worker, which imports crossfilter
+    // from `url`. engine.crossfilter() is the proxy the charts and map layers use:
+    // the filters are sent to the worker, and the group results (and the filtered
+    // row ids) come back as typed arrays, the redraws of the chart group waiting
+    // for them.
+    var source = 'importScripts(' + JSON.stringify(url) + ');\n' +
+        document.getElementById('crossfolium-runtime').textContent +
+        '\n(' + crossfolium.workerMain.toString() + ')();';
+    var engine = this;
+    this.cf = cf;
+    this.ids = 0;
+    this.groups = {};
+    this.size = 0;
+    this.rows = new Uint32Array(0);
+    this.filtered = [];
+    this.tracked = false;
+    this.seq = 0;
+    this.waiting = [];
+    this.changing = false;
+    this.changeSeq = 0;
+    this.worker = new Worker(URL.createObjectURL(
+        new Blob([source], {type: 'application/javascript'})));
+    this.worker.onmessage = function (event) {engine.receive(event.data);};
+    };
+crossfolium.Engine.prototype.send = function (message) {
+    this.worker.postMessage(message);
+    };
+crossfolium.Engine.prototype.init = function (payload) {
+    this.send({type: 'init', payload: payload});
+    };
+crossfolium.Engine.prototype.track = function () {
+    // Asks the worker to send the filtered row ids along with the results.
+    if (!this.tracked) {
+        this.tracked = true;
+        this.send({type: 'track'});
+        }
+    };
+crossfolium.Engine.prototype.flush = function () {
+    // Returns a Promise resolved when the results of the commands sent so far
+    // have come back.
+    var engine = this, seq = ++this.seq;
+    this.send({type: 'flush', seq: seq});
+    return new Promise(function (resolve) {
+        engine.waiting.push({seq: seq, resolve: resolve});
+        });
+    };
+crossfolium.Engine.prototype.receive = function (m) {
+    this.size = m.size;
+    for (var id in m.groups) {
+        if (this.groups[id]) {this.groups[id].receive(m.groups[id]);}
+        }
+    if (m.filtered) {
+        this.rows = m.filtered;
+        this.filtered = null;
+        }
+    this.waiting = this.waiting.filter(function (w) {
+        if (w.seq > m.seq) {return true;}
+        w.resolve();
+        return false;
+        });
+    };
+crossfolium.Engine.prototype.changed = function () {
+    // Called on each filter command: the results of all the commands sent in the
+    // same task are asked at once, and the redraws held until the results of the
+    // last change come back (whatever flushes were asked after it).
+    if (this.changing) {return;}
+    var engine = this, group = this.cf.group;
+    this.changing = true;
+    crossfolium.hold(group, true);
+    Promise.resolve().then(function () {
+        engine.changing = false;
+        var flushed = engine.flush(), seq = engine.changeSeq = engine.seq;
+        return flushed.then(function () {
+            if (engine.changeSeq === seq) {crossfolium.hold(group, false);}
+            });
+        });
+    };
+crossfolium.Engine.prototype.records = function () {
+    // The filtered records, built from the row ids of the last results.
+    if (this.filtered === null) {
+        this.filtered = new Array(this.rows.length);
+        for (var i = 0; i < this.rows.length; i++) {
+            this.filtered[i] = this.cf.row(this.rows[i]);
+            }
+        }
+    return this.filtered;
+    };
+crossfolium.Engine.prototype.crossfilter = function () {
+    // The proxy of the crossfilter: its dimensions are on the `column` of their
+    // accessor (see crossfolium.key), or on the row ids if it has none.
+    var engine = this;
+    return {
+        size: function () {return engine.size;},
+        dimension: function (accessor) {
+            return new crossfolium.DimensionProxy(engine, accessor.column);
+            },
+        groupAll: function () {return new crossfolium.GroupProxy(engine, null);}
+        };
+    };
+
+crossfolium.DimensionProxy = function (engine, column) {
+    this.engine = engine;
+    this.id = engine.ids++;
+    engine.send({type: 'dimension', id: this.id, column: column === undefined ? null : column});
+    };
+crossfolium.DimensionProxy.prototype.send = function (filters, sorted, slack) {
+    this.engine.send({type: 'filter', dimension: this.id, filters: filters, sorted: sorted,
+                      slack: slack});
+    this.engine.changed();
+    return this;
+    };
+crossfolium.DimensionProxy.prototype.filter = function (filter) {
+    if (filter === null || filter === undefined) {return this.filterAll();}
+    if (Array.isArray(filter)) {return this.filterRange(filter);}
+    return this.filterExact(filter);
+    };
+crossfolium.DimensionProxy.prototype.filterExact = function (value) {
+    return this.send([{value: value}], false);
+    };
+crossfolium.DimensionProxy.prototype.filterRange = function (range) {
+    return this.send([{range: [range[0], range[1]]}], false);
+    };
+crossfolium.DimensionProxy.prototype.filterRanges = function (ranges, slack) {
+    return this.send(ranges, true, slack);
+    };
+crossfolium.DimensionProxy.prototype.filterValues = function (filters) {
+    // Filters on a list of dc filters: values and dc.filters.RangedFilter.
+    return this.send(filters.map(function (f) {
+        return f.filterType === 'RangedFilter' ? {range: [f[0], f[1]]} : {value: f};
+        }), false);
+    };
+crossfolium.DimensionProxy.prototype.filterAll = function () {
+    return this.send(null, false);
+    };
+crossfolium.DimensionProxy.prototype.filterFunction = function () {
+    throw new Error('The worker engine cannot run filter functions: ' +
+                    'use filterExact, filterRange or filterRanges.');
+    };
+crossfolium.DimensionProxy.prototype.group = function () {
+    return new crossfolium.GroupProxy(this.engine, this.id);
+    };
+crossfolium.DimensionProxy.prototype.dispose = function () {
+    this.engine.send({type: 'dispose', dimension: this.id});
+    };
+crossfolium.DimensionProxy.prototype.remove = crossfolium.DimensionProxy.prototype.dispose;
+
+crossfolium.GroupProxy = function (engine, dimension) {
+    // A group of a dimension proxy (the groupAll if dimension is null), whose
+    // results are those of the last results of the engine.
+    this.engine = engine;
+    this.dimension = dimension;
+    this.id = engine.ids++;
+    this.result = dimension === null ? 0 : [];
+    engine.groups[this.id] = this;
+    this.reduceColumns(null, null);
+    };
+crossfolium.GroupProxy.prototype.reduceColumns = function (weight, count, measures) {
+    // Reduces the sum of the `weight` column times the `count` column (each
+    // being 1 if null), or the `measures`, see crossfolium.reduce.
+    this.engine.send({type: 'group', id: this.id, dimension: this.dimension,
+                      weight: weight, count: count, measures: measures || null});
+    this.ordering = measures ? function (p) {return p[measures[0].name];} : null;
+    return this;
+    };
+crossfolium.GroupProxy.prototype.receive = function (result) {
+    if (this.dimension === null) {
+        this.result = result;
+        return;
+        }
+    var out = new Array(result.values.length);
+    for (var j = 0; j < out.length; j++) {
+        out[j] = {key: result.keys[j], value: result.values[j]};
+        }
+    this.result = out;
+    };
+crossfolium.GroupProxy.prototype.all = function () {return this.result;};
+crossfolium.GroupProxy.prototype.value = function () {return this.result;};
+crossfolium.GroupProxy.prototype.size = function () {return this.result.length;};
+crossfolium.GroupProxy.prototype.top = function (k) {
+    var ordering = this.ordering || function (value) {return value;};
+    return this.result.slice().sort(function (a, b) {
+        return ordering(b.value) - ordering(a.value);
+        }).slice(0, k);
+    };
+crossfolium.GroupProxy.prototype.order = function (ordering) {
+    this.ordering = ordering;
+    return this;
+    };
+crossfolium.GroupProxy.prototype.orderNatural = function () {
+    this.ordering = null;
+    return this;
+    };
+crossfolium.GroupProxy.prototype.dispose = function () {
+    delete this.engine.groups[this.id];
+    this.engine.send({type: 'dispose', group: this.id});
+    };
+crossfolium.GroupProxy.prototype.remove = crossfolium.GroupProxy.prototype.dispose;
+
+crossfolium.filterHandler = function (dimension, filters) {
+    // The dc filterHandler of the charts on a dimension proxy, which sends the
+    // filters themselves rather than a filter function.
+    if (filters.length) {
+        dimension.filterValues(filters);
+    } else {
+        dimension.filterAll();
+        }
+    return filters;
+    };
+
+crossfolium.proxyFilters = function (group) {
+    // Sets crossfolium.filterHandler on the charts of a group on dimension proxies.
+    dc.chartRegistry.list(group).forEach(function (chart) {
+        var dimension = chart.dimension && chart.dimension();
+        if (dimension && dimension.filterValues) {
+            chart.filterHandler(crossfolium.filterHandler);
+            }
+        });
+    };
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial
+-------
+
+Spatial keys computed in python for the map layers: the position of each record in
+the web mercator grid of the map tiles.
+"""
+import numpy as np
+
+# The zoom level of the Morton codes: 2**20 cells around the world, that is about
+# 40 meters at the equator. The codes are below 2**40, exact in javascript numbers.
+DEFAULT_LEVEL = 20
+
+MAX_LATITUDE = 85.0511287798
+
+
+def mercator(lat, lng):
+    """The web mercator coordinates of points, in [0, 1] (x to the east, y to the south).
+
+    Returns
+    -------
+    (x, y), two float64 arrays. Missing coordinates give NaN.
+    """
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    lng = np.asarray(lng, dtype=np.float64)
+    x = (lng + 180.) / 360.
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return x, y
+
+
+def tiles(lat, lng, level):
+    """The tile (x, y) that contain points at a zoom level, as int64 arrays.
+
+    Points with missing coordinates get the tile (-1, -1).
+    """
+    x, y = mercator(lat, lng)
+    size = 2 ** level
+    missing = np.isnan(x) | np.isnan(y)
+    x = np.clip(np.floor(np.where(missing, 0, x) * size), 0, size - 1).astype(np.int64)
+    y = np.clip(np.floor(np.where(missing, 0, y) * size), 0, size - 1).astype(np.int64)
+    x[missing] = -1
+    y[missing] = -1
+    return x, y
+
+
+def _spread(v):
+    """Insert a zero bit between the (up to 32) bits of each integer."""
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                        (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                        (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_codes(lat, lng, level=DEFAULT_LEVEL):
+    """The Morton (Z-order) code of the tile of each point at a zoom level.
+
+    The bits of the tile x are the even bits of the code, those of the tile y the odd
+    ones, so that the code of a tile at zoom z is the code of its parent at zoom
+    z - 1 times 4, plus 0 to 3; and the codes of all the points of a tile form one
+    range. Points with missing coordinates get the code -1.
+
+    Returns
+    -------
+    An int64 array.
+    """
+    if not 0 <= level <= 26:
+        raise ValueError("level must be between 0 and 26, got {!r}".format(level))
+    x, y = tiles(lat, lng, level)
+    codes = (_spread(x) | (_spread(y) << np.uint64(1))).astype(np.int64)
+    codes[x < 0] = -1
+    return codes
+
+
+def parent_codes(codes, level, zoom):
+    """The Morton codes at `zoom` of the tiles containing tiles of codes at `level`.
+
+    Missing codes (-1) stay -1.
+    """
+    if zoom >= level:
+        return codes
+    out = codes // 4 ** (level - zoom)
+    out[codes < 0] = -1
+    return out
+
+
+def cluster_offset(radius):
+    """The number of zoom levels between the map and the grid of clusters of about
+    `radius` pixels wide, the tiles being 256 pixels wide."""
+    return max(0, int(round(np.log2(256. / radius))))
+
+
+# The hexagon ids pack the axial coordinates (q, r) as r * HEX_STRIDE + q + HEX_STRIDE / 2.
+HEX_STRIDE = 2 ** 26
+
+
+def hex_size(zoom, radius):
+    """The size (center to corner) of hexagons `radius` pixels wide at a map zoom, in
+    web mercator units."""
+    return radius / (256. * 2 ** zoom)
+
+
+def hex_ids(lat, lng, size):
+    """The id of the pointy-top hexagon of `size` (in web mercator units) that
+    contains each point.
+
+    The hexagons are laid out in axial coordinates (q, r) on the web mercator plane,
+    so that they look regular on the map; the id is r * HEX_STRIDE + q + HEX_STRIDE / 2.
+    Points with missing coordinates get the id -1.
+
+    Returns
+    -------
+    An int64 array.
+    """
+    if 2. / (3 * size) >= HEX_STRIDE / 2:
+        raise ValueError("Hexagons of size {!r} are too small.".format(size))
+    x, y = mercator(lat, lng)
+    missing = np.isnan(x) | np.isnan(y)
+    x = np.where(missing, 0, x)
+    y = np.where(missing, 0, y)
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = 2. / 3 * y / size
+    # Round the cube coordinates (q, -q - r, r) to the nearest hexagon.
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    ids = (rr * HEX_STRIDE + rq + HEX_STRIDE // 2).astype(np.int64)
+    ids[missing] = -1
+    return ids
+
+
+def auto_zoom(lat, lng, pixels=800, max_zoom=18):
+    """The map zoom at which the points span about `pixels` pixels."""
+    x, y = mercator(lat, lng)
+    span = max(np.nanmax(x) - np.nanmin(x), np.nanmax(y) - np.nanmin(y)) if len(x) else 0
+    if not span > 0:
+        return max_zoom
+    return int(np.clip(np.floor(np.log2(pixels / (256. * span))), 0, max_zoom))
@@ -34,7 +34,7 @@ def extract_version(module='crossfolium'):
                 break
     return version
 
-pkg_data = {'': []}
+pkg_data = {'crossfolium': ['runtime.js']}
 pkgs = [
     'crossfolium',
     ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures running the crossfolium javascript runtime in node.
+"""
+import io
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from crossfolium.crossfolium import _runtime_path
+
+NODE = shutil.which('node')
+
+# What node lacks of a browser, for the parts of the runtime that don't touch the DOM.
+PRELUDE = u"""
+var atob = function (s) {return Buffer.from(s, 'base64').toString('binary');};
+var requestAnimationFrame = function (f) {return setTimeout(f, 0);};
+"""
+
+
+def _source(part):
+    """The javascript of a part: a snippet, or the script of a branca element."""
+    if isinstance(part, str):
+        return part
+    return part._template.module.__dict__['script'](part, {})
+
+
+@pytest.fixture
+def run_js(tmpdir):
+    """Runs javascript in node after the crossfolium runtime.
+
+    run_js(*parts) joins the parts (snippets, or branca elements whose script is
+    rendered), runs them, and returns the JSON printed on the last line of the
+    output. The test is skipped if node is not installed.
+    """
+    if NODE is None:
+        pytest.skip("node is not installed")
+    with io.open(_runtime_path, encoding='utf-8') as f:
+        runtime = f.read()
+
+    def run(*parts):
+        path = tmpdir.join('run.js')
+        path.write_text(u'\n'.join([PRELUDE, runtime] + [_source(part) for part in parts]),
+                        encoding='utf-8')
+        process = subprocess.Popen([NODE, str(path)], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        if process.returncode:
+            raise AssertionError(err.decode('utf-8'))
+        return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+    return run
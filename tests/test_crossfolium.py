@@ -3,9 +3,957 @@
 CrossFolium Test Module
 -----------------------
 """
+import branca
+import folium
+import numpy as np
+import pytest
 import crossfolium as cf
 
 
 def test_true():
     c = cf.Crossfilter([])
     c._repr_html_()
+
+
+def test_columnar_encoding():
+    f = branca.element.Figure()
+    data = [{'a': 1, 'b': 'x'}, {'a': 2}]
+    cf.Crossfilter(data, encoding='columnar').add_to(f)
+    out = f.render()
+    assert '{"length":2,"columns":{"a":[1,2],"b":["x",null]}}' in out
+    assert 'crossfolium.records(' in out
+    assert "'a': 1" not in out
+
+
+def test_dataframe_input():
+    import pandas as pd
+
+    df = pd.DataFrame({
+        'a': [1.5, np.nan],
+        'b': ['x', 'y'],
+        'date': pd.to_datetime(['1970-01-01', '1970-01-02']),
+        })
+    f = branca.element.Figure()
+    c = cf.Crossfilter(df).add_to(f)
+    assert c.encoding == 'columnar'
+    out = f.render()
+    assert '"columns":{"a":[1.5,null],"b":["x","y"],"date":[0,86400000]}' in out
+
+    f = branca.element.Figure()
+    cf.Crossfilter(df[['b']], encoding='records').add_to(f)
+    assert '[{"b":"x"},{"b":"y"}]' in f.render()
+
+
+def test_dict_of_arrays_input():
+    f = branca.element.Figure()
+    cf.Crossfilter({'a': np.arange(3), 'b': np.array([0.5, 1., 2.])}).add_to(f)
+    out = f.render()
+    assert '{"length":3,"columns":{"a":[0,1,2],"b":[0.5,1.0,2.0]}}' in out
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter({'a': np.arange(3), 'b': np.arange(2)})._payload()
+
+
+def test_categorical_columns():
+    import pandas as pd
+
+    df = pd.DataFrame({
+        'a': ['Beta', 'Alpha', 'Beta', 'Beta'],
+        'b': pd.Categorical(['x', None, 'x', 'y']),
+        'c': ['u', 'v', 'w', 'z'],
+        'd': pd.Series(['Beta', None, 'Beta', np.nan], dtype=object),
+        })
+    f = branca.element.Figure()
+    c = cf.Crossfilter(df).add_to(f)
+    cf.PieFilter(c, 'a').add_to(c)
+    out = f.render()
+    assert '"a":{"categories":["Alpha","Beta"],"codes":[1,0,1,1]}' in out
+    assert '"b":{"categories":["x","y",null],"codes":[0,2,0,1]}' in out
+    assert '"c":["u","v","w","z"]' in out
+    assert '"d":{"categories":["Beta",null],"codes":[0,1,0,1]}' in out
+    codes, categories = cf.encoding.factorize(np.array(['b', None, 'a', 'b'], dtype=object))
+    assert codes.tolist() == [1, 2, 0, 1] and categories.tolist() == ['a', 'b', None]
+    assert 'crossfolium.dimension({}, "a")'.format(c.get_name()) in out
+
+    f = branca.element.Figure()
+    cf.Crossfilter(df, max_categories=0).add_to(f)
+    assert '"a":["Beta","Alpha","Beta","Beta"]' in f.render()
+
+
+def test_typed_array_columns():
+    import base64
+
+    data = {
+        'lat': np.array([0.5, 1.25]),
+        'n': np.array([1, 70000]),
+        'a': np.array(['x', 'x', ]),
+        }
+    f = branca.element.Figure()
+    cf.Crossfilter(data, dtypes={'lat': 'float32', 'n': 'uint32', 'a': 'uint8'}).add_to(f)
+    out = f.render()
+    lat = base64.b64encode(np.array([0.5, 1.25], dtype='<f4').tobytes()).decode('ascii')
+    assert '"lat":{"dtype":"float32","base64":"%s"}' % lat in out
+    assert '"a":{"categories":["x"],"codes":{"dtype":"uint8","base64":"AAA="}}' in out
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter(data, dtypes={'n': 'uint16'})._payload()
+    with pytest.raises(ValueError):
+        cf.Crossfilter(data, dtypes={'lat': 'float16'})._payload()
+    with pytest.raises(ValueError):
+        cf.Crossfilter([], dtypes={'lat': 'float32'})
+
+
+def test_precision():
+    import base64
+
+    data = {'lat': np.array([48.853412345, -0.000004]), 'lng': np.array([2.3488, 0.5])}
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, precision={'lat': 5, 'lng': 3},
+                       dtypes={'lng': 'int32'}).add_to(f)
+    out = f.render()
+    assert '"lat":[48.85341,-0.0]' in out
+    lng = base64.b64encode(np.array([2349, 500], dtype='<i4').tobytes()).decode('ascii')
+    assert '"lng":{"dtype":"int32","base64":"%s","decimals":3}' % lng in out
+
+    sizes = c.column_sizes()
+    assert list(sizes) == ['lat', 'lng']
+    assert sizes['lat'] < cf.Crossfilter(data).column_sizes()['lat']
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter(data, precision={'foo': 2})._payload()
+
+    # Missing values get the lowest int32, that the browser reads as NaN.
+    data = {'lat': np.array([48.85, np.nan])}
+    column = cf.encoding.encode_column(data['lat'], 2, dtype='int32', decimals=2)
+    assert column['missing'] == -2 ** 31
+    assert np.frombuffer(base64.b64decode(column['base64']), dtype='<i4').tolist() == [
+        4885, -2 ** 31]
+    assert 'scaled[j] = values[j] === column.missing ? NaN' in out
+    with pytest.raises(ValueError) as error:
+        cf.Crossfilter(data, precision={'lat': 9}, dtypes={'lat': 'int32'})._payload()
+    assert "Column 'lat'" in str(error.value)
+
+
+def test_fixed_point_decoding(run_js):
+    # The browser reads the missing values of fixed-point columns as NaN (null in
+    # JSON), with 0 decimals too.
+    import json
+
+    values = np.array([3., np.nan, -1.])
+    columns = [cf.encoding.encode_column(values, 3, dtype='int32', decimals=0),
+               cf.encoding.encode_column(values, 3, dtype='int16', decimals=1),
+               cf.encoding.encode_column(np.array([3., 4.]), 2, dtype='int8', decimals=0)]
+    assert run_js(u"""
+        console.log(JSON.stringify(%s.map(function (column) {
+            return Array.from(crossfolium.values(column));
+            })));
+        """ % json.dumps(columns)) == [[3, None, -1], [3, None, -1], [3, 4]]
+
+
+def test_auto_columns():
+    data = {
+        'lat': np.zeros(2), 'lng': np.zeros(2), 'a': np.array(['x', 'y']),
+        'color': np.array(['red', 'blue']), 'w': np.ones(2), 'unused': np.arange(2),
+        }
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, columns='auto', dtypes={'unused': 'int8'}).add_to(f)
+    cf.PieFilter(c, 'a', weight='w').add_to(c)
+    m = folium.Map().add_to(c)
+    g = cf.FeatureGroupFilter(c).add_to(m)
+    cf.marker_function.CircleMarkerFunction(fillColor='feature.color').add_to(g)
+    assert list(c.column_sizes()) == ['lat', 'lng', 'a', 'color', 'w']
+    assert '"unused"' not in f.render()
+
+    c = cf.Crossfilter(data, columns=['a'])
+    assert list(c.column_sizes()) == ['a']
+    with pytest.raises(ValueError):
+        cf.Crossfilter(data, columns=['foo']).column_sizes()
+
+
+def test_compression():
+    import base64
+    import json
+    import re
+    import zlib
+
+    data = {'a': np.array(['x', 'y', 'x', 'x'])}
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, compression='gzip').add_to(f)
+    out = f.render()
+    assert '{}.categories = {{"a":["x","y"]}};'.format(c.get_name()) in out
+    assert 'dc.renderAll({}.group);'.format(c.get_name()) in out
+    assert '{}.ready.then(function () {{'.format(c.get_name()) in out
+    blob = re.search(r'crossfolium.inflate\(\s*"([^"]*)", "gzip"', out).group(1)
+    payload = zlib.decompress(base64.b64decode(blob), 16 + zlib.MAX_WBITS)
+    assert json.loads(payload.decode('utf-8')) == {
+        'length': 4, 'columns': {'a': {'categories': ['x', 'y'], 'codes': [0, 1, 0, 0]}}}
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter(data, compression='brotli')
+
+
+def test_sidecar(tmpdir):
+    import json
+    import os
+
+    data = {'a': np.array(['x', 'y', 'x', 'x']), 'v': np.array([0.5, 1., 2., 4.])}
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, sidecar=str(tmpdir), sidecar_url='data').add_to(f)
+    out = f.render()
+    filenames = os.listdir(str(tmpdir))
+    assert len(filenames) == 1 and filenames[0].endswith('.json')
+    assert 'crossfolium.fetch("data/{}","json",null)'.format(filenames[0]) in ''.join(out.split())
+    assert 'dc.renderAll({}.group);'.format(c.get_name()) in out
+    assert '{}.ready.then(function () {{'.format(c.get_name()) in out
+    with open(os.path.join(str(tmpdir), filenames[0])) as fid:
+        assert json.load(fid)['columns']['v'] == [0.5, 1., 2., 4.]
+
+    # The same data goes in the same file.
+    cf.Crossfilter(data, sidecar=str(tmpdir))._payload()
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    url, _ = cf.Crossfilter(data, sidecar=str(tmpdir), sidecar_format='binary')._payload()
+    with open(os.path.join(str(tmpdir), url.split('/')[-1]), 'rb') as fid:
+        payload = fid.read()
+    size = int(np.frombuffer(payload[:4], dtype='<u4')[0])
+    header = json.loads(payload[4:4 + size].decode('utf-8'))
+    assert header['columns']['v'] == {'dtype': 'float64', 'offset': 8, 'length': 4}
+    start = 4 + size + (-(4 + size) % 8)
+    v = np.frombuffer(payload[start + 8:start + 40], dtype='<f8')
+    assert v.tolist() == [0.5, 1., 2., 4.]
+
+
+def test_missing_values(tmpdir):
+    import base64
+    import json
+    import os
+    import re
+    import zlib
+    import pandas as pd
+
+    def strict(text):
+        def refuse(constant):
+            raise ValueError("{} is not JSON".format(constant))
+        return json.loads(text, parse_constant=refuse)
+
+    df = pd.DataFrame({
+        's': pd.Series(['x', None, 'y', np.nan], dtype='str'),
+        'o': pd.Series(['x', np.nan, None, pd.NA], dtype=object),
+        'f': [0.5, np.nan, 1., 2.],
+        'd': pd.to_timedelta([1, None, 2, 3], unit='s'),
+        })
+    f = branca.element.Figure()
+    cf.Crossfilter(df, compression='gzip', max_categories=0).add_to(f)
+    blob = re.search(r'crossfolium.inflate\(\s*"([^"]*)", "gzip"', f.render()).group(1)
+    payload = zlib.decompress(base64.b64decode(blob), 16 + zlib.MAX_WBITS).decode('utf-8')
+    assert 'NaN' not in payload
+    columns = strict(payload)['columns']
+    assert columns['s'] == ['x', None, 'y', None]
+    assert columns['o'] == ['x', None, None, None]
+    assert columns['f'] == [0.5, None, 1., 2.]
+    assert columns['d'] == [1000, None, 2000, 3000]
+
+    url, _ = cf.Crossfilter(df, sidecar=str(tmpdir), max_categories=0)._payload()
+    with open(os.path.join(str(tmpdir), url.split('/')[-1])) as fid:
+        assert strict(fid.read())['columns'] == columns
+
+    with pytest.raises(ValueError):
+        cf.encoding.to_json([float('nan')])
+
+
+def test_collapse():
+    data = {
+        'a': np.array(['x', 'y', 'x', 'x', 'y']),
+        'day': np.array([1, 1, 1, 2, 1]),
+        'unused': np.arange(5),
+        }
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, columns='auto', collapse=True).add_to(f)
+    cf.PieFilter(c, 'a').add_to(c)
+    cf.BarFilter(c, 'day', domain=[0, 3], groupby=1, weight='day').add_to(c)
+    cf.CountFilter(c).add_to(c)
+    out = f.render()
+    assert ('{"length":3,"columns":{"a":["x","y","x"],"day":[1,1,2],'
+            '"day:bin:0.0:1.0":[1,1,2],"__count__":[2,2,1]}}') in out
+    assert '{}.count = "__count__";'.format(c.get_name()) in out
+    assert 'crossfolium.reduce(' in out
+
+
+def test_bar_filter_bins(monkeypatch):
+    data = {'v': np.array([0.5, 1.5, 2.5, 9.5, np.nan]), 'w': np.arange(5)}
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, columns='auto').add_to(f)
+    bar = cf.BarFilter(c, 'v', domain=[0, 10], groupby=2).add_to(c)
+    cf.BarFilter(c, 'w').add_to(c)
+    out = f.render()
+    assert '"v:bin:0.0:2.0":[0.0,0.0,1.0,4.0,null]' in out
+    assert 'crossfolium.dimension({},"v:bin:0.0:2.0");'.format(c.get_name()) in ''.join(out.split())
+    assert '"v":' not in out
+    assert bar._bins() == ([0., 10.], 2.)
+
+    # Only the kept columns and the sources of the bins are materialized.
+    records = [{'v': 1., 'w': 2, 'a': 'x', 'b': 'y'}, {'v': 3., 'w': 4, 'a': 'z', 'b': 'y'}]
+    c = cf.Crossfilter(records, encoding='columnar', columns='auto')
+    cf.BarFilter(c, 'v', domain=[0, 10], groupby=2).add_to(c)
+    cf.PieFilter(c, 'a').add_to(c)
+    read = []
+    to_columns = cf.encoding.to_columns
+    monkeypatch.setattr(cf.encoding, 'to_columns',
+                        lambda data, names=None: read.append(names) or to_columns(data, names))
+    assert list(c._columns()[0]) == ['a', 'v:bin:0.0:2.0']
+    assert read == [['v', 'a']]
+
+    domain, groupby = cf.encoding.auto_bins(np.arange(1000))
+    assert groupby == 100.
+    assert domain == [0., 1000.]
+    bins = cf.encoding.bin_index(np.arange(1000), domain, groupby)
+    assert bins.dtype == np.int8
+    assert bins.max() == 9
+
+    # The Freedman-Diaconis width is rounded to the nearest nice number.
+    assert cf.encoding.auto_bins(np.arange(100.)) == ([0., 100.], 20.)
+    uniform = np.random.RandomState(0).uniform(size=500)
+    assert cf.encoding.auto_bins(uniform) == ([0., 1.], 0.1)
+    assert cf.encoding.auto_bins(np.arange(1000), max_bins=5)[1] == 200.
+
+    # The bins can be written in a narrow typed array.
+    c = cf.Crossfilter({'v': np.array([0.5, 9.5])}, dtypes={'v:bin:0.0:2.0': 'int8'})
+    cf.BarFilter(c, 'v', domain=[0, 10], groupby=2).add_to(c)
+    assert '"v:bin:0.0:2.0":{"dtype":"int8","base64":"AAQ="}' in c._payload()[0]
+
+
+def test_bar_filter_bin_edges(run_js):
+    # The bins precomputed from the columns are those the records path computes in
+    # the browser, for values on the edges of the bins too.
+    import json
+    import re
+
+    values = np.array([0., 0.2, 0.6, 1., 2., 3., 3.8, 4.1])
+    for domain, groupby in [([0., 4.], 0.2), ([0., 5.], 0.1), ([-1., 4.], 0.5)]:
+        f = branca.element.Figure()
+        c = cf.Crossfilter([{'v': v} for v in values]).add_to(f)
+        bar = cf.BarFilter(c, 'v', domain=domain, groupby=groupby).add_to(c)
+        accessor = re.search(r'crossfolium\.dimension\(\w+,\s*"[^"]*", (function\(d\) \{.*?\})\);',
+                             f.render(), re.S).group(1)
+        records = run_js(u"""
+            var %s = {domain: %s, groupby: %s};
+            console.log(JSON.stringify(%s.map(function (v) {return (%s)({v: v});})));
+            """ % (bar.get_name(), json.dumps(domain), groupby, json.dumps(values.tolist()),
+                   accessor))
+        columns = cf.encoding.bin_index(values, domain, groupby)
+        assert columns.tolist() == records
+    assert cf.encoding.bin_index(np.array([1., 2., 3.]), [0., 4.], 0.2).tolist() == [5, 10, 15]
+
+
+def test_chart_groups():
+    f = branca.element.Figure()
+    c1 = cf.Crossfilter([{'a': 'x', 'v': 1}]).add_to(f)
+    c2 = cf.Crossfilter([{'a': 'y', 'v': 2}]).add_to(f)
+    pie = cf.PieFilter(c1, 'a').add_to(c1)
+    bar = cf.BarFilter(c2, 'v', domain=[0, 3], groupby=1).add_to(c2)
+    reset = cf.ResetFilter(crossfilter=c2).add_to(c2)
+    reset_all = cf.ResetFilter().add_to(f)
+    out = f.render()
+    assert 'var {0} = {{group: "{0}"}};'.format(c1.get_name()) in out
+    assert "dc.pieChart('#{}-chart', {}.group)".format(pie.get_name(), c1.get_name()) in out
+    assert 'dc.barChart("#{}", {}.group)'.format(bar.get_name(), c2.get_name()) in out
+    assert 'dc.renderAll({}.group);'.format(c2.get_name()) in out
+    assert 'dc.renderAll();' not in out
+    assert "d3.select('#{}')".format(reset.get_name()) in out
+    assert 'var groups = [{}.group];'.format(c2.get_name()) in out
+    assert "d3.select('#{}')".format(reset_all.get_name()) in out
+    assert 'var groups = crossfolium.groups;' in out
+
+
+def test_redraw_scheduler():
+    f = branca.element.Figure()
+    c1 = cf.Crossfilter([{'v': 1}]).add_to(f)
+    c2 = cf.Crossfilter([{'v': 1}], redraw_debounce=200).add_to(f)
+    c3 = cf.Crossfilter([{'v': 1}], redraw_debounce=None).add_to(f)
+    out = f.render()
+    assert 'crossfolium.schedule({}.group, 0);'.format(c1.get_name()) in out
+    assert 'crossfolium.schedule({}.group, 200);'.format(c2.get_name()) in out
+    assert 'crossfolium.schedule({}.group'.format(c3.get_name()) not in out
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter([{'v': 1}], redraw_debounce=-1)
+
+
+def test_worker_engine():
+    f = branca.element.Figure()
+    c = cf.Crossfilter({'v': np.array([1, 2]), 'c': np.array(['a', 'b'])},
+                       worker=True, redraw_debounce=None).add_to(f)
+    cf.PieFilter(c, 'c').add_to(c)
+    cf.CountFilter(c).add_to(c)
+    out = f.render()
+    name = c.get_name()
+    assert '<script id="crossfolium-runtime">' in out
+    assert 'crossfolium.Engine = function' in out
+    assert '{0}.engine = new crossfolium.Engine({0},'.format(name) in out
+    assert '{0}.crossfilter = {0}.engine.crossfilter();'.format(name) in out
+    assert '{}.engine.init(payload);'.format(name) in out
+    assert 'crossfilter({}.data)'.format(name) not in out
+    assert 'crossfolium.proxyFilters({}.group);'.format(name) in out
+    assert 'return {}.engine.flush();'.format(name) in out
+    # The redraws must wait for the worker, so they are always scheduled.
+    assert 'crossfolium.schedule({}.group, 0);'.format(name) in out
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter([{'v': 1}], worker=True)
+    with pytest.raises(ValueError):
+        cf.TableFilter(c, ['v'])
+
+
+# A crossfilter 1.3 scanning all the records at each call, which logs the filter calls.
+NAIVE_CROSSFILTER = u"""
+var filterCalls = [];
+var crossfilter = function (initial) {
+    var records = initial.slice(), dimensions = [];
+    var passes = function (d, except) {
+        return dimensions.every(function (dim) {return dim === except || dim.test(dim.key(d));});
+        };
+    var group = function (key, except) {
+        var add = function (p) {return p + 1;}, init = function () {return 0;};
+        var g = {
+            reduceCount: function () {add = function (p) {return p + 1;}; return g;},
+            reduceSum: function (f) {add = function (p, d) {return p + f(d);}; return g;},
+            reduce: function (a, r, i) {add = a; init = i; return g;},
+            order: function () {return g;},
+            all: function () {
+                var values = new Map();
+                records.forEach(function (d) {
+                    var k = key(d), p = values.has(k) ? values.get(k) : init();
+                    values.set(k, passes(d, except) ? add(p, d) : p);
+                    });
+                return Array.from(values.keys()).sort().map(function (k) {
+                    return {key: k, value: values.get(k)};
+                    });
+                },
+            value: function () {
+                return records.filter(function (d) {return passes(d);}).reduce(add, init());
+                },
+            dispose: function () {}
+            };
+        return g;
+        };
+    var filter = function (dim, name, test) {
+        filterCalls.push(name);
+        dim.test = test;
+        return dim;
+        };
+    return {
+        add: function (rows) {records = records.concat(rows);},
+        size: function () {return records.length;},
+        groupAll: function () {
+            var g = group(function () {return null;}, null);
+            delete g.all;
+            return g;
+            },
+        dimension: function (key) {
+            var dim = {key: key, test: function () {return true;}};
+            dim.filterAll = function () {
+                return filter(dim, 'filterAll', function () {return true;});
+                };
+            dim.filterExact = function (v) {
+                return filter(dim, 'filterExact', function (k) {return k === v;});
+                };
+            dim.filterRange = function (r) {
+                return filter(dim, 'filterRange', function (k) {return k >= r[0] && k < r[1];});
+                };
+            dim.filterFunction = function (f) {return filter(dim, 'filterFunction', f);};
+            dim.top = function (k) {
+                return records.filter(function (d) {return passes(d);}).sort(function (a, b) {
+                    return key(b) - key(a);
+                    }).slice(0, k);
+                };
+            dim.group = function () {return group(key, dim);};
+            dim.dispose = function () {dimensions.splice(dimensions.indexOf(dim), 1);};
+            dimensions.push(dim);
+            return dim;
+            }
+        };
+    };
+"""
+
+
+# crossfolium.workerMain run in-process by a Worker passing structured clones of the
+# messages on later tasks, with a dc counting the redraws.
+FAKE_WORKER = u"""
+var log = [], redraws = 0;
+var document = {getElementById: function () {return {textContent: ''};}};
+var dc = {redrawAll: function () {redraws++;}};
+var main = null;
+var self = {postMessage: function (m) {
+    log.push('results ' + m.seq + ': ' + Object.keys(m.groups).join(','));
+    var data = structuredClone(m);
+    setTimeout(function () {main.onmessage({data: data});}, 0);
+    }};
+var Worker = function () {
+    main = this;
+    this.postMessage = function (m) {
+        log.push(m.type);
+        var data = structuredClone(m);
+        setTimeout(function () {self.onmessage({data: data});}, 0);
+        };
+    crossfolium.workerMain();
+    };
+var wait = function () {return new Promise(function (r) {setTimeout(r, 20);});};
+var column = function (name) {
+    var accessor = function () {};
+    accessor.column = name;
+    return accessor;
+    };
+"""
+
+
+def test_worker_messages(run_js):
+    # The engine and its proxies against crossfolium.workerMain.
+    out = run_js(NAIVE_CROSSFILTER, FAKE_WORKER, u"""
+        var cf = {group: 'G', count: null};
+        cf.engine = new crossfolium.Engine(cf, 'crossfilter.js');
+        crossfolium.schedule(cf.group, 0);
+        var ndx = cf.engine.crossfilter();
+        var cat = ndx.dimension(column('cat')), v = ndx.dimension(column('v'));
+        var byCat = crossfolium.reduce(cat.group(), cf, 'v');
+        var all = crossfolium.reduce(ndx.groupAll(), cf, null);
+        cf.engine.init({length: 5, columns: {
+            cat: {categories: ['a', 'b'], codes: [0, 1, 0, 1, 0]}, v: [1, 2, 3, 4, 5]}});
+        cf.engine.track();
+        var out = [];
+        var state = function () {
+            return [ndx.size(), all.value(), byCat.all(), Array.from(cf.engine.rows),
+                    cf.engine.seq, crossfolium.delays.G.held, redraws, filterCalls.splice(0)];
+            };
+        cf.engine.flush().then(function () {
+            out.push(log.splice(0), state());
+            v.filterRange([2, 4]);
+            // A chart redraw, held until the results come back.
+            dc.redrawAll(cf.group);
+            out.push(state());
+            return wait();
+        }).then(function () {
+            out.push(log.splice(0), state());
+            var range = [1, 3];
+            range.filterType = 'RangedFilter';
+            crossfolium.filterHandler(cat, [0]);
+            crossfolium.filterHandler(v, [range, 5]);
+            return wait();
+        }).then(function () {
+            out.push(log.splice(0), state());
+            crossfolium.filterRanges(v, [[1, 2], [4, 6]], 0);
+            crossfolium.filterHandler(cat, []);
+            return wait();
+        }).then(function () {
+            out.push(state());
+            try {
+                v.filterFunction(function () {return true;});
+            } catch (e) {
+                out.push(e.message);
+                }
+            // The results of older flushes don't resolve the later ones.
+            var first = cf.engine.flush(), second = cf.engine.flush();
+            cf.engine.receive({size: 5, groups: {}, seq: cf.engine.seq - 1});
+            out.push(cf.engine.waiting.map(function (w) {return w.seq;}));
+            return Promise.all([first, second]);
+        }).then(function () {
+            out.push(cf.engine.waiting.length);
+            byCat.dispose();
+            return cf.engine.flush();
+        }).then(function () {
+            out.push(log.splice(-3), Object.keys(cf.engine.groups));
+            byCat.receive({keys: new Float64Array([0, 1]), values: [{n: 2}, {n: 5}]});
+            all.receive(7);
+            out.push([byCat.order(function (p) {return p.n;}).top(1), all.value()]);
+            console.log(JSON.stringify(out));
+            });
+        """)
+    assert out[0] == ['dimension', 'dimension', 'group', 'group', 'group', 'group', 'init',
+                      'track', 'flush', 'results 1: 2,3']
+    groups = [{'key': 0, 'value': 9}, {'key': 1, 'value': 6}]
+    assert out[1] == [5, 5, groups, [4, 3, 2, 1, 0], 1, False, 0, []]
+    # Held as soon as a filter is sent, redrawn once when released.
+    assert out[2][5:7] == [True, 0]
+    assert out[3] == ['filter', 'flush', 'results 2: 2,3']
+    groups = [{'key': 0, 'value': 3}, {'key': 1, 'value': 2}]
+    assert out[4] == [5, 2, groups, [2, 1], 2, False, 1, ['filterRange']]
+    # The filters sent in the same task are flushed at once.
+    assert out[5] == ['filter', 'filter', 'flush', 'results 3: 2,3']
+    groups = [{'key': 0, 'value': 6}, {'key': 1, 'value': 2}]
+    assert out[6] == [5, 2, groups, [4, 0], 3, False, 2, ['filterExact', 'filterFunction']]
+    groups = [{'key': 0, 'value': 6}, {'key': 1, 'value': 4}]
+    assert out[7] == [5, 3, groups, [4, 3, 0], 4, False, 3, ['filterFunction', 'filterAll']]
+    assert out[8].startswith('The worker engine cannot run filter functions')
+    assert out[9] == [6]
+    assert out[10] == 0
+    assert out[11] == ['dispose', 'flush', 'results 7: 3']
+    assert out[12] == ['3']
+    assert out[13] == [[{'key': 1, 'value': {'n': 5}}], 7]
+
+
+def test_worker_overlapping_changes(run_js):
+    # Filter changes overlapping each other and other flushes: the redraws are held
+    # until the results of the last change come back, then released once.
+    out = run_js(NAIVE_CROSSFILTER, FAKE_WORKER, u"""
+        var cf = {group: 'G', count: null};
+        cf.engine = new crossfolium.Engine(cf, 'crossfilter.js');
+        crossfolium.schedule(cf.group, 0);
+        var ndx = cf.engine.crossfilter();
+        var cat = ndx.dimension(column('cat')), v = ndx.dimension(column('v'));
+        var all = crossfolium.reduce(ndx.groupAll(), cf, null);
+        cf.engine.init({length: 5, columns: {
+            cat: {categories: ['a', 'b'], codes: [0, 1, 0, 1, 0]}, v: [1, 2, 3, 4, 5]}});
+        var out = [];
+        var receive = cf.engine.receive;
+        cf.engine.receive = function (m) {
+            receive.call(this, m);
+            Promise.resolve().then(function () {
+                out.push([m.seq, all.value(), crossfolium.delays.G.held, redraws]);
+                });
+            };
+        cf.engine.flush().then(function () {
+            v.filterRange([2, 4]);
+            dc.redrawAll(cf.group);
+            // A second change before the results of the first come back, followed
+            // by a flush asked by something else.
+            setTimeout(function () {
+                cat.filterExact(0);
+                dc.redrawAll(cf.group);
+                Promise.resolve().then(function () {cf.engine.flush();});
+                }, 0);
+            return wait();
+        }).then(function () {
+            out.push([crossfolium.delays.G.held, redraws]);
+            console.log(JSON.stringify(out));
+            });
+        """)
+    assert out[0] == [1, 5, True, 0]
+    # Still held when the results of the first change come back, released by the
+    # ones of the second, though a later flush was asked.
+    assert out[1] == [2, 2, True, 0]
+    assert out[2] == [3, 1, False, 0]
+    assert out[3] == [4, 1, False, 0]
+    assert out[4] == [False, 1]
+
+
+def test_column_store():
+    f = branca.element.Figure()
+    c = cf.Crossfilter({'v': np.array([1., 2.]), 'c': np.array(['a', 'b'])},
+                       store='columns').add_to(f)
+    cf.PieFilter(c, 'c', weight='v').add_to(c)
+    cf.TableFilter(c, ['c']).add_to(c)
+    out = f.render()
+    name = c.get_name()
+    assert '{}.store = "columns";'.format(name) in out
+    assert '{}.col = crossfolium.columnStore(payload);'.format(name) in out
+    assert '{}.data = crossfolium.rowIds(payload.length);'.format(name) in out
+    assert 'crossfolium.records(payload)' not in out
+    assert 'return {}.col["c"][d];'.format(name) in out
+    assert c._field('lat', 'p') == '{}.col["lat"][p]'.format(name)
+    assert cf.Crossfilter([{'v': 1}])._field('v') == 'd["v"]'
+
+    with pytest.raises(ValueError):
+        cf.Crossfilter([{'v': 1}], store='columns')
+    with pytest.raises(ValueError):
+        cf.Crossfilter({'v': np.array([1])}, store='rows')
+
+
+def test_column_store_arrays(run_js):
+    # The numeric columns are typed arrays in the browser, without dtypes too.
+    data = {'n': np.array([1, 2, 3]), 'v': np.array([0.5, np.nan, 2.]),
+            's': np.array(['x', 'y', 'z']), 'b': np.array([1, 2, 3])}
+    payload, _ = cf.Crossfilter(data, store='columns', dtypes={'b': 'int8'})._payload()
+    assert run_js(u"""
+        var store = crossfolium.columnStore(%s);
+        console.log(JSON.stringify(['n', 'v', 's', 'b'].map(function (name) {
+            return [store[name].constructor.name, Array.from(store[name])];
+            })));
+        """ % payload) == [['Float64Array', [1, 2, 3]], ['Float64Array', [0.5, None, 2]],
+                           ['Array', ['x', 'y', 'z']], ['Int8Array', [1, 2, 3]]]
+
+
+def test_dimension_registry():
+    data = {'r': np.array(['a', 'b']), 'v': np.array([1, 2])}
+    c = cf.Crossfilter(data)
+    cf.PieFilter(c, 'r').add_to(c)
+    cf.RowBarFilter(c, 'r').add_to(c)
+    assert [len(elements) for _, elements in c._dimensions()] == [1, 1, 1]
+
+    f = branca.element.Figure()
+    c = cf.Crossfilter(data, share_dimensions=True).add_to(f)
+    p1 = cf.PieFilter(c, 'r').add_to(c)
+    p2 = cf.RowBarFilter(c, 'r').add_to(c)
+    cf.PieFilter(c, 'v', weight='v').add_to(c)
+    assert [(name, len(elements)) for name, elements in c._dimensions()] == [
+        (('allDim', 0), 1), ('r', 2), ('v', 1)]
+    out = f.render()
+    for chart in (p1, p2):
+        assert '{}.dimension = crossfolium.dimension({}, "r");'.format(
+            chart.get_name(), c.get_name()) in out
+        assert '.group(crossfolium.group({0}, {1}.dimension,'.format(
+            c.get_name(), chart.get_name()) in out
+    assert '{}.registry = {{dimensions: {{}}, groups: {{}}, shared: true}};'.format(
+        c.get_name()) in out
+
+    w = cf.Crossfilter({'r': np.array(['a'])}, worker=True, share_dimensions=True)
+    cf.PieFilter(w, 'r').add_to(w)
+    cf.PieFilter(w, 'r').add_to(w)
+    assert len(w._dimensions()) == 3
+
+    f = branca.element.Figure()
+    data = dict(('c{}'.format(i), np.arange(2)) for i in range(40))
+    c = cf.Crossfilter(data).add_to(f)
+    for i in range(c.max_dimensions):
+        cf.PieFilter(c, 'c{}'.format(i)).add_to(c)
+    with pytest.raises(ValueError) as error:
+        f.render()
+    assert 'needs 33 crossfilter dimensions' in str(error.value)
+    assert 'share_dimensions=True' in str(error.value)
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_shared_dimensions(run_js, shared):
+    # Two charts on the same column: with their own dimensions, the filter of one
+    # filters the group of the other. Sharing a dimension, it doesn't, as crossfilter
+    # groups ignore the filters of their dimension.
+    out = run_js(NAIVE_CROSSFILTER, u"""
+        var cf = {registry: {dimensions: {}, groups: {}, shared: %s}, categories: {},
+                  count: null, crossfilter: crossfilter(['a', 'b', 'a'].map(function (r) {
+                      return {r: r};
+                      }))};
+        var pie = crossfolium.dimension(cf, 'r'), row = crossfolium.dimension(cf, 'r');
+        var pieGroup = crossfolium.group(cf, pie, null);
+        var rowGroup = crossfolium.group(cf, row, null);
+        pie.filterExact('a');
+        console.log(JSON.stringify([rowGroup.all(), cf.crossfilter.groupAll().value(),
+                                    pieGroup === rowGroup]));
+        """ % ('true' if shared else 'false'))
+    if shared:
+        assert out == [[{'key': 'a', 'value': 2}, {'key': 'b', 'value': 1}], 2, True]
+    else:
+        assert out == [[{'key': 'a', 'value': 2}, {'key': 'b', 'value': 0}], 2, False]
+
+
+def test_chart_measures():
+    f = branca.element.Figure()
+    c = cf.Crossfilter({'r': np.array(['a', 'b']), 'v': np.array([1, 2]),
+                        'u': np.array([3, 4])}, columns='auto').add_to(f)
+    pie = cf.PieFilter(c, 'r', measures=[('n', 'count'), ('avg', 'mean', 'v'),
+                                         ('users', 'distinct', 'u')]).add_to(c)
+    out = f.render()
+    assert 'crossfolium.measures = function' in out
+    assert ('.group(crossfolium.group({0}, {1}.dimension, null, [{{"column": null, '
+            '"kind": "count", "name": "n"}}, {{"column": "v", "kind": "mean", "name": "avg"}}, '
+            '{{"column": "u", "kind": "distinct", "name": "users"}}]))'.format(
+                c.get_name(), pie.get_name())) in ' '.join(out.split())
+    assert '.valueAccessor(function (d) { return d.value["n"]; })' in ' '.join(out.split())
+    assert sorted(c._referenced_columns()) == ['r', 'u', 'v']
+
+    with pytest.raises(ValueError):
+        cf.PieFilter(c, 'r', measures=[('m', 'median', 'v')])
+    with pytest.raises(ValueError):
+        cf.PieFilter(c, 'r', measures=[('m', 'sum')])
+    with pytest.raises(ValueError):
+        cf.PieFilter(c, 'r', weight='v', measures=[('n', 'count')])
+
+
+def test_measures_reducer(run_js):
+    # The reducers of crossfolium.measures, against the measures of the records
+    # inside, as random records of collapsed rows enter and leave the filters.
+    out = run_js(u"""
+        var seed = 7;
+        var random = function () {
+            seed = (seed * 16807) % 2147483647;
+            return seed / 2147483647;
+            };
+        var records = [];
+        for (var i = 0; i < 300; i++) {
+            records.push({k: i % 3, v: random() < 0.05 ? null : Math.floor(random() * 50),
+                          u: Math.floor(random() * 20), c: 1 + Math.floor(random() * 3)});
+            }
+        var measures = [
+            {name: 'n', kind: 'count'}, {name: 'avg', kind: 'mean', column: 'v'},
+            {name: 'lo', kind: 'min', column: 'v'}, {name: 'hi', kind: 'max', column: 'v'},
+            {name: 'users', kind: 'distinct', column: 'u'},
+            {name: 'total', kind: 'sum', column: 'v'}];
+        var reducer = null;
+        var group = {
+            reduce: function (add, remove, init) {
+                reducer = {add: add, remove: remove, init: init};
+                return group;
+                },
+            order: function (f) {group.ordering = f; return group;}
+            };
+        crossfolium.reduce(group, {count: 'c', categories: {}}, null, measures);
+        var expected = function (rs) {
+            var vs = rs.filter(function (r) {return r.v !== null;}).map(function (r) {return r.v;});
+            var sum = 0, count = 0;
+            rs.forEach(function (r) {
+                if (r.v !== null) {sum += r.c * r.v; count += r.c;}
+                });
+            return {
+                n: rs.reduce(function (a, r) {return a + r.c;}, 0),
+                avg: count ? sum / count : 0,
+                lo: vs.length ? Math.min.apply(null, vs) : null,
+                hi: vs.length ? Math.max.apply(null, vs) : null,
+                users: new Set(rs.map(function (r) {return r.u;})).size,
+                total: sum
+                };
+            };
+        var state = [reducer.init(), reducer.init(), reducer.init()];
+        var inside = records.map(function () {return false;});
+        var wrong = [], heap = 0;
+        for (var step = 0; step < 5000; step++) {
+            var j = Math.floor(random() * records.length), d = records[j];
+            if (inside[j]) {
+                reducer.remove(state[d.k], d);
+            } else {
+                reducer.add(state[d.k], d);
+                }
+            inside[j] = !inside[j];
+            var want = expected(records.filter(function (r, i) {
+                return inside[i] && r.k === d.k;
+                }));
+            for (var name in want) {
+                if (Math.abs(state[d.k][name] - want[name]) > 1e-9 ||
+                        (state[d.k][name] === null) !== (want[name] === null)) {
+                    wrong.push([step, name, state[d.k][name], want[name]]);
+                    }
+                }
+            heap = Math.max(heap, state[d.k].state[2].heap.size());
+            }
+        console.log(JSON.stringify([wrong, heap, Object.keys(state[0]),
+                                    group.ordering({n: 4})]));
+        """)
+    wrong, heap, names, ordered = out
+    assert wrong == []
+    # The heaps hold each distinct value once, and drop the ones that left.
+    assert heap <= 50
+    assert names == ['n', 'avg', 'lo', 'hi', 'users', 'total']
+    assert ordered == 4
+
+
+def test_table_filter():
+    f = branca.element.Figure()
+    c = cf.Crossfilter({'k': np.arange(3), 'v': np.arange(3)}).add_to(f)
+    table = cf.TableFilter(c, ['v'], size=5000, sort_by='k', ascending=False, page_size=500,
+                           visible_rows=20).add_to(c)
+    pie = cf.PieFilter(c, 'k').add_to(c)
+    out = f.render()
+    flat = ''.join(out.split())
+    assert '{this.sort_by}' not in out and 'dc.dataTable' not in out
+    for chart in (table, pie):
+        assert '{}.dimension=crossfolium.dimension({},"k");'.format(
+            chart.get_name(), c.get_name()) in flat
+    assert '{size:5000,ascending:false,pageSize:500,visibleRows:20,rowHeight:24}' in flat
+    assert 'dc.registerChart({}.dataTable,{}.group);'.format(
+        table.get_name(), c.get_name()) in flat
+    assert 'height:504px;' in flat
+    assert 'class="crossfolium-table-pager"' in out
+    assert len(c._dimensions()) == 3
+
+    plain = cf.TableFilter(c, ['v'])
+    assert plain._dimensions() == []
+    plain.add_to(c)
+    out = f.render()
+    assert '{0}.dimension = {1}.allDim;'.format(plain.get_name(), c.get_name()) in out
+
+
+def test_table_paging(run_js):
+    # crossfolium.Table on a fake DOM: what it reads from the dimension, and the rows
+    # it writes, as it pages and scrolls.
+    out = run_js(u"""
+        var El = function (tag) {
+            this.tagName = tag;
+            this.children = [];
+            this.style = {};
+            this.listeners = {};
+            this.scrollTop = 0;
+            this.textContent = '';
+            };
+        El.prototype.appendChild = function (child) {this.children.push(child); return child;};
+        El.prototype.removeChild = function (child) {
+            this.children.splice(this.children.indexOf(child), 1);
+            };
+        Object.defineProperty(El.prototype, 'firstChild', {
+            get: function () {return this.children[0] || null;}
+            });
+        El.prototype.addEventListener = function (event, f) {this.listeners[event] = f;};
+        var document = {createElement: function (tag) {return new El(tag);}};
+        var frames = [];
+        var requestAnimationFrame = function (f) {frames.push(f);};
+
+        var elements = {tbody: new El('tbody'), '.crossfolium-table-body': new El('div'),
+                        '.crossfolium-table-pager': new El('div'), '.previous': new El('button'),
+                        '.next': new El('button'), '.range': new El('span')};
+        var select = function (selector) {return elements[selector];};
+        elements['.crossfolium-table-pager'].querySelector = select;
+        var body = elements.tbody, scroller = elements['.crossfolium-table-body'];
+        var data = [], calls = [];
+        for (var i = 0; i < 1050; i++) {data.push(i);}
+        var dimension = {
+            top: function (k) {calls.push(['top', k]); return data.slice().reverse().slice(0, k);},
+            bottom: function (k) {calls.push(['bottom', k]); return data.slice(0, k);}
+            };
+        var height = function (tr) {
+            return tr && tr.className === 'spacer' ? tr.children[0].style.height : null;
+            };
+        var state = function () {
+            // The dimension calls, the spacers and the rows in the DOM, and the pager.
+            var rows = body.children.filter(function (tr) {return tr.className !== 'spacer';});
+            var first = rows.length ? rows[0].children.map(function (td) {
+                return td.textContent;
+                }) : null;
+            return [calls.splice(0), height(body.children[0]), rows.length, first,
+                    height(body.children[body.children.length - 1]),
+                    elements['.range'].textContent, elements['.previous'].disabled,
+                    elements['.next'].disabled];
+            };
+        var table = new crossfolium.Table(
+            {querySelector: select}, dimension,
+            [function (d) {return d;}, function (d) {return d % 2 ? null : 'x';}],
+            {size: 1000, ascending: false, pageSize: 100, visibleRows: 10, rowHeight: 24});
+        var out = [];
+        table.render();
+        out.push(state());
+        // The scroll events of a frame update the rows once, without reading the dimension.
+        scroller.scrollTop = 24 * 50;
+        scroller.listeners.scroll();
+        scroller.listeners.scroll();
+        out.push(frames.length);
+        frames.pop()();
+        out.push(state());
+        elements['.next'].listeners.click();
+        out.push(state(), scroller.scrollTop);
+        for (var page = 0; page < 8; page++) {elements['.next'].listeners.click();}
+        calls = calls.slice(-1);
+        out.push(state(), table.page);
+        // Filtered down to fewer pages: back to the first one.
+        data = data.slice(0, 150);
+        table.redraw();
+        out.push(state(), table.page);
+        data = [];
+        table.redraw();
+        out.push(state());
+
+        data = [3, 4, 5];
+        var small = new crossfolium.Table(
+            {querySelector: function (selector) {return selector === 'tbody' ? body : null;}},
+            dimension, [function (d) {return d;}], {size: 3, ascending: true, pageSize: 2});
+        small.render();
+        out.push(calls.splice(0), body.children.map(function (tr) {
+            return tr.children[0].textContent;
+            }));
+        console.log(JSON.stringify(out));
+        """)
+    assert out[0] == [[['top', 101]], None, 14, [1049, ''], '2064px', '1-100', True, False]
+    assert out[1] == 1
+    assert out[2] == [[], '1152px', 14, [1001, ''], '912px', '1-100', True, False]
+    assert out[3] == [[['top', 201]], None, 14, [949, ''], '2064px', '101-200', False, False]
+    assert out[4] == 0
+    assert out[5] == [[['top', 1000]], None, 14, [149, ''], '2064px', '901-1000', False, True]
+    assert out[6] == 9
+    assert out[7] == [[['top', 1000], ['top', 101]], None, 14, [149, ''], '2064px', '1-100',
+                      True, False]
+    assert out[8] == 0
+    assert out[9] == [[['top', 101]], None, 0, None, None, '0', True, True]
+    assert out[10:] == [[['bottom', 3]], [3, 4]]
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+import branca
+import folium
+import numpy as np
+import pytest
+import crossfolium
+
+
+def _render(*layers, **kwargs):
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter([{'lat': 0, 'lng': 0}], **kwargs).add_to(f)
+    m = folium.Map().add_to(c)
+    out = [layer(c, **layer_kwargs).add_to(m) for layer, layer_kwargs in layers]
+    return f.render(), c, out
+
+
+def test_incremental_layers():
+    out, _, _ = _render((crossfolium.FeatureGroupFilter, {}),
+                        (crossfolium.MarkerClusterFilter, {}))
+    assert 'crossfolium.syncLayers = function' in out
+    assert 'crossfolium.syncLayers(this.feature_group, this.shown, dimVals,' in out
+    assert 'crossfolium.syncLayers(this.chart, this.shown, dimVals,' in out
+    assert out.count('clearLayers();') == 2  # in invalidate
+
+    out, _, _ = _render((crossfolium.FeatureGroupFilter, {'incremental': False}),
+                        (crossfolium.MarkerClusterFilter, {'incremental': False}))
+    assert out.count('clearLayers();') == 4
+
+
+def test_marker_cache():
+    out, _, (fg, mc) = _render((crossfolium.FeatureGroupFilter, {'cache_size': 1000}),
+                               (crossfolium.MarkerClusterFilter, {}))
+    assert 'crossfolium.MarkerCache = function' in out
+    out = ''.join(out.split())
+    assert 'crossfolium.cacheMarkers({},null);'.format(mc.get_name()) in out
+    assert 'crossfolium.cacheMarkers({},1000);'.format(fg.get_name()) in out
+    assert 'return{}.markers.get(d);'.format(fg.get_name()) in out
+
+
+def test_canvas_renderer():
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter([{'lat': 0, 'lng': 0, 'c': 'red'}]).add_to(f)
+    m = folium.Map().add_to(c)
+    fg = crossfolium.FeatureGroupFilter(c, renderer='canvas').add_to(m)
+    crossfolium.marker_function.CircleMarkerFunction(fillColor='feature.c').add_to(fg)
+    out = ''.join(f.render().split())
+    assert '{}.renderer=crossfolium.canvas({});'.format(fg.get_name(), m.get_name()) in out
+    assert ('{fillColor:d["c"],renderer:' + fg.get_name() + '.renderer,})') in out
+
+    with pytest.raises(ValueError):
+        crossfolium.FeatureGroupFilter(c, renderer='webgl')
+
+
+def test_leaflet_version(run_js):
+    # L.canvas, and the leaflet.markercluster loaded with it, come with Leaflet 1.0.
+    out, _, _ = _render((crossfolium.FeatureGroupFilter, {'renderer': 'canvas'}),
+                        (crossfolium.MarkerClusterFilter, {}))
+    scripts = re.findall(r'<script src="([^"]*)"', out)
+    leaflets = [url for url in scripts if re.search(r'/leaflet(\.min)?\.js$', url)]
+    assert len(leaflets) == 1
+    assert int(re.search(r'leaflet[@/](\d+)\.', leaflets[0]).group(1)) >= 1
+    clusters = [url for url in scripts if 'leaflet.markercluster' in url]
+    assert len(clusters) == 1
+    assert int(re.search(r'markercluster/(\d+)\.', clusters[0]).group(1)) >= 1
+
+    # Without a canvas renderer, the layers keep the default one instead of failing.
+    assert run_js(u"""
+        var L = {}, map = {};
+        var before = crossfolium.canvas(map);
+        L.canvas = function () {return {canvas: true};};
+        var shared = crossfolium.canvas(map) === crossfolium.canvas(map);
+        console.log(JSON.stringify([before === undefined, shared]));
+        """) == [True, True]
+
+
+def test_change_bus():
+    out, c, layers = _render((crossfolium.FeatureGroupFilter, {}),
+                             (crossfolium.HeatmapFilter, {}),
+                             (crossfolium.MarkerClusterFilter, {}))
+    assert 'dc.dataTable' not in out
+    assert out.count('crossfolium.bus({});'.format(c.get_name())) == 1
+    for layer in layers:
+        assert '{}.subscribe(function (records) {{'.format(c.get_name()) in out
+        assert '{}.updateFun(records);'.format(layer.get_name()) in out
+
+
+def test_spatial_index():
+    data = {'lat': np.array([0., 0.001, np.nan]), 'lng': np.array([0., 0.001, 1.])}
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter(data, columns='auto').add_to(f)
+    m = folium.Map().add_to(c)
+    mc = crossfolium.MarkerClusterFilter(c, spatial_index=True).add_to(m)
+    out = f.render()
+    codes = crossfolium.spatial.morton_codes(data['lat'], data['lng'], 20)
+    assert codes[2] == -1
+    assert '"lat:lng:morton:20":{}'.format(
+        str(codes.tolist()).replace(' ', '')) in out
+    assert 'crossfolium.dimension({},"lat:lng:morton:20");'.format(c.get_name()) in ''.join(
+        out.split())
+    # The viewport filter is exact unless a slack is given.
+    assert 'crossfolium.filterRanges({}.keyDimension,ranges,0);'.format(
+        mc.get_name()) in ''.join(out.split())
+    approximate = crossfolium.MarkerClusterFilter(c, spatial_index=True, spatial_slack=0.5)
+    approximate.add_to(m)
+    assert 'crossfolium.filterRanges({}.keyDimension,ranges,0.5);'.format(
+        approximate.get_name()) in ''.join(f.render().split())
+    with pytest.raises(ValueError):
+        crossfolium.MarkerClusterFilter(c, spatial_index=True, spatial_slack=-1)
+    assert 'latDimension' not in out
+
+    # Tile codes nest: the code of a tile is its parent's times 4 plus 0 to 3.
+    assert (codes[:2] // 4 == crossfolium.spatial.morton_codes(
+        data['lat'][:2], data['lng'][:2], 19)).all()
+
+    records = crossfolium.Crossfilter([{'lat': 0, 'lng': 0}])
+    with pytest.raises(ValueError):
+        crossfolium.MarkerClusterFilter(records, spatial_index=True)
+
+
+def test_filter_ranges(run_js):
+    # A cover whose span is short enough is filtered with one incremental filterRange.
+    assert run_js(u"""
+        var calls = [];
+        var dimension = {
+            filterRange: function (r) {calls.push(['range', r]);},
+            filterFunction: function (f) {
+                calls.push(['function', [2, 50, 101, 104].map(f)]);
+                }
+            };
+        crossfolium.filterRanges(dimension, [[0, 4], [5, 8]], 0.5);
+        crossfolium.filterRanges(dimension, [[0, 4], [5, 8]], 0);
+        crossfolium.filterRanges(dimension, [[0, 4], [100, 104]], 0.5);
+        crossfolium.filterRanges(dimension, [[3, 9]]);
+        crossfolium.filterRanges(dimension, []);
+        console.log(JSON.stringify(calls));
+        """) == [['range', [0, 8]],
+                 ['function', [True, False, False, False]],
+                 ['function', [True, False, True, False]],
+                 ['range', [3, 9]],
+                 ['function', [False, False, False, False]]]
+
+
+def test_grid_clustering():
+    data = {'lat': np.array([1., 1.001, 10.]), 'lng': np.array([1., 1.001, 10.])}
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter(data, columns='auto').add_to(f)
+    m = folium.Map().add_to(c)
+    mc = crossfolium.MarkerClusterFilter(c, clustering='grid', geofilter=False).add_to(m)
+    out = f.render()
+    assert '"lat:lng:morton:20":' in out
+    assert '{}.chart = L.layerGroup();'.format(mc.get_name()) in out
+    assert 'markerClusterGroup(' not in out
+    assert ''.join('''crossfolium.gridClusters({}, {}.keyDimension, "lat", "lng", 20, 2);
+        '''.format(c.get_name(), mc.get_name()).split()) in ''.join(out.split())
+
+    codes = crossfolium.spatial.morton_codes(data['lat'], data['lng'], 20)
+    clusters = crossfolium.spatial.parent_codes(codes, 20, 5 + 2)
+    assert clusters[0] == clusters[1] != clusters[2]
+    assert crossfolium.spatial.cluster_offset(80) == 2
+    assert crossfolium.spatial.cluster_offset(300) == 0
+
+    with pytest.raises(ValueError):
+        crossfolium.MarkerClusterFilter(c, clustering='kmeans')
+
+
+def test_heatmap():
+    data = {'la': np.array([1., 2.]), 'ln': np.array([1., 2.]), 'w': np.array([3, 4])}
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter(data, columns='auto').add_to(f)
+    m = folium.Map().add_to(c)
+    heat = crossfolium.HeatmapFilter(c, lat='la', lng='ln', weight='w').add_to(m)
+    grid = crossfolium.HeatmapFilter(c, lat='la', lng='ln', weight='w',
+                                     aggregate=True).add_to(m)
+    out = f.render()
+    flat = ''.join(out.split())
+    assert 'minOpacity:0.5,' in flat
+    assert 'latlngs.push([d["la"],d["ln"],d["w"]]);' in flat
+    assert '"la:ln:morton:20":' in out
+    assert ('crossfolium.gridClusters({0},{1}.keyDimension,"la","ln",20,4,"w");'
+            .format(c.get_name(), grid.get_name())) in flat
+    assert '{}.updateFun(records);'.format(heat.get_name()) in out
+
+    with pytest.raises(ValueError):
+        crossfolium.HeatmapFilter(crossfolium.Crossfilter([{'lat': 0, 'lng': 0}]),
+                                  aggregate=True)
+
+    # Collapsed rows weigh the number of records they stand for.
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter(data, collapse=True).add_to(f)
+    m = folium.Map().add_to(c)
+    crossfolium.HeatmapFilter(c, lat='la', lng='ln', weight='w').add_to(m)
+    crossfolium.HeatmapFilter(c, lat='la', lng='ln').add_to(m)
+    flat = ''.join(f.render().split())
+    assert 'latlngs.push([d["la"],d["ln"],d["w"]*d["__count__"]]);' in flat
+    assert 'latlngs.push([d["la"],d["ln"],d["__count__"]]);' in flat
+
+
+def test_heatmap_max(run_js):
+    # The hottest color goes to the largest cell intensity in view, unless max_val is given.
+    c = crossfolium.Crossfilter([{'lat': 0, 'lng': 0, 'w': 1}])
+    m = folium.Map().add_to(c)
+    heat = crossfolium.HeatmapFilter(c, weight='w').add_to(m)
+    fixed = crossfolium.HeatmapFilter(c, weight='w', max_val=50).add_to(m)
+    columnar = crossfolium.Crossfilter({'lat': np.zeros(1), 'lng': np.zeros(1)})
+    grid = crossfolium.HeatmapFilter(columnar, aggregate=True).add_to(
+        folium.Map().add_to(columnar))
+    assert 'crossfolium.heatMax(map, latlngs, this.heatmap.options)' in ' '.join(
+        grid._template.module.__dict__['script'](grid, {}).split())
+    mocks = u"""
+        var L = {heatLayer: function (latlngs, options) {
+            return {options: options, maxes: [], addTo: function () {return this;},
+                    setLatLngs: function (latlngs) {this.latlngs = latlngs;},
+                    setOptions: function (o) {this.maxes.push(o.max);}};
+            }};
+        var zoom = 18;
+        var %(map)s = {
+            handlers: [],
+            on: function (event, f) {this.handlers.push(f);},
+            getZoom: function () {return zoom;},
+            getBounds: function () {return {contains: function (ll) {return ll[0] < 10;}};},
+            // 1000 pixels per degree: cells of (25 + 15) / 2 = 20 pixels.
+            project: function (ll) {return {x: ll[1] * 1000, y: ll[0] * 1000};}
+            };
+        var %(cf)s = {subscribe: function () {}};
+        """ % {'map': m.get_name(), 'cf': c.get_name()}
+    check = u"""
+        var records = [{lat: 0, lng: 0, w: 10}, {lat: 0, lng: 0.001, w: 10},
+                       {lat: 1, lng: 1, w: 4}, {lat: 20, lng: 0, w: 100}];
+        var heat = %(heat)s, fixed = %(fixed)s;
+        heat.updateFun(records);
+        fixed.updateFun(records);
+        zoom = 10;
+        %(map)s.handlers.forEach(function (f) {f();});
+        console.log(JSON.stringify([heat.heatmap.options.max, heat.heatmap.maxes,
+                                    fixed.heatmap.options.max, fixed.heatmap.maxes]));
+        """ % {'heat': heat.get_name(), 'fixed': fixed.get_name(), 'map': m.get_name()}
+    assert run_js(mocks, heat, fixed, check) == [1, [20, 20 / 256.], 50, []]
+
+
+def test_hexbin_filter():
+    data = {'lat': np.array([40., 40.001, 41.]), 'lng': np.array([2., 2.001, 3.]),
+            'w': np.array([1, 2, 3])}
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter(data, columns='auto').add_to(f)
+    m = folium.Map().add_to(c)
+    hexbin = crossfolium.HexbinFilter(c, weight='w', zooms=[6, 10]).add_to(m)
+    out = f.render()
+    ids = crossfolium.spatial.hex_ids(data['lat'], data['lng'],
+                                      crossfolium.spatial.hex_size(6, 20))
+    assert ids[0] == ids[1] != ids[2]
+    assert '"lat:lng:hex:6:20":{}'.format(str(ids.tolist()).replace(' ', '')) in out
+    assert '"lat:lng:hex:10:20":[' in out
+    assert 'dc.registerChart({0}.chart, {1}.group);'.format(
+        hexbin.get_name(), c.get_name()) in out
+    assert [zoom for zoom, _, _ in hexbin._resolutions()] == [6, 10]
+
+    assert crossfolium.HexbinFilter(c)._zooms() == [crossfolium.spatial.auto_zoom(
+        data['lat'], data['lng'])]
+    with pytest.raises(ValueError):
+        crossfolium.HexbinFilter(crossfolium.Crossfilter([{'lat': 0, 'lng': 0}]))
+
+
+@pytest.mark.parametrize('layer', [crossfolium.FeatureGroupFilter,
+                                   crossfolium.MarkerClusterFilter])
+def test_invalidate_redraws(run_js, layer):
+    c = crossfolium.Crossfilter([{'lat': 0, 'lng': 0}])
+    m = folium.Map().add_to(c)
+    element = layer(c, geofilter=False) if layer is crossfolium.MarkerClusterFilter else layer(c)
+    element.add_to(m)
+    mocks = u"""
+        var Layer = function () {this.layers = [];};
+        Layer.prototype.addLayer = function (l) {this.layers.push(l);};
+        Layer.prototype.removeLayer = function (l) {
+            this.layers.splice(this.layers.indexOf(l), 1);
+            };
+        Layer.prototype.addLayers = function (ls) {ls.forEach(this.addLayer, this);};
+        Layer.prototype.removeLayers = function (ls) {ls.forEach(this.removeLayer, this);};
+        Layer.prototype.clearLayers = function () {this.layers = [];};
+        var L = {FeatureGroup: Layer, markerClusterGroup: Layer};
+        var %(map)s = {addLayer: function () {}};
+        var %(cf)s = {
+            crossfilter: {allFiltered: function () {return [1, 2];}},
+            subscribe: function () {}
+            };
+        """ % {'map': m.get_name(), 'cf': c.get_name()}
+    check = u"""
+        var layer = %s, group = layer.feature_group || layer.chart;
+        layer.marker_function = function (d) {return 'old' + d;};
+        var before = group.layers.slice();
+        layer.updateFun();
+        var drawn = group.layers.slice();
+        // A style change redraws the layer with the new markers at once.
+        layer.marker_function = function (d) {return 'new' + d;};
+        console.log(JSON.stringify([before, drawn, group.layers]));
+        """ % element.get_name()
+    assert run_js(mocks, element, check) == [[], ['old1', 'old2'], ['new1', 'new2']]
@@ -109,3 +109,20 @@ def test_awesome_marker_function():
                 };
         """.split())
     assert tmp in out
+
+
+def test_column_store_marker_function():
+    f = branca.element.Figure()
+    c = crossfolium.Crossfilter({'lat': [0], 'lng': [0], 'p': ['x']}, store='columns').add_to(f)
+    m = folium.Map().add_to(c)
+    g = crossfolium.FeatureGroupFilter(c).add_to(m)
+    crossfolium.marker_function.MarkerFunction(popup='p').add_to(g)
+
+    out = ''.join(f.render().split())
+    tmp = ''.join("""
+        .marker_function = function (d) {
+            return L.marker([{0}.col["lat"][d], {0}.col["lng"][d]])
+                .bindPopup({0}.col["p"][d]);
+            }
+        """.split()).replace('{0}', c.get_name())
+    assert tmp in out